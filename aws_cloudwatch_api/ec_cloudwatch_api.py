@@ -1,36 +1,212 @@
+import threading
+
 from datetime import datetime, timedelta
 
-# Returns a dictionary containing all the clusters in given account
+from exporter import tracing
+from aws_cloudwatch_api import metric_data
+
+# month to date usage per account and serverless cache: {"month": (year, month), "until": datetime, "ecpus": float, "gbHours": float}
+# every poll only adds the complete hours since the last poll, see get_serverless_usage
+serverless_usage_totals = dict()
+serverless_usage_lock = threading.Lock()
+serverless_metric_delay = timedelta(minutes=15) # the datapoints of an hour are complete a few minutes after it ended
+
+# Returns the identifier and the dictionary entry of a given cache cluster description
+def parse_cache_cluster(cache_cluster):
+    term = "OnDemand"
+
+    cache_cluster_id = cache_cluster["CacheClusterId"]
+    cache_node_type = cache_cluster["CacheNodeType"]
+    engine = cache_cluster["Engine"]
+    engine_version = cache_cluster["EngineVersion"]
+    network_type = cache_cluster["NetworkType"]
+    outpost = False
+    snapshot_retention_period = cache_cluster["SnapshotRetentionLimit"]
+    arn = cache_cluster.get("ARN")
+    replication_group = cache_cluster.get("ReplicationGroupId") # set for the member clusters (nodes) of a replication group
+    nodes = cache_cluster.get("NumCacheNodes", 1) # memcached clusters can have several nodes, every node is billed
+
+    if "PreferredOutpostArn" in cache_cluster:
+        outpost = True
+
+    return cache_cluster_id, {"cacheNodeType": cache_node_type, "engine": engine, "engineVersion": engine_version, "networkType": network_type, "outpost": outpost, "snapshotRetentionPeriod": snapshot_retention_period, "term": term, "arn": arn, "replicationGroup": replication_group, "nodes": nodes}
+
+# Returns a dictionary containing all the clusters in given account, the member clusters of replication groups included
 def get_ec_cache_clusters(client):
     clusters = dict()
-    response = client.describe_cache_clusters()
-    term = "OnDemand"
 
-    for cache_cluster in response["CacheClusters"]:
-        cache_cluster_id = cache_cluster["CacheClusterId"]
-        cache_node_type = cache_cluster["CacheNodeType"]
-        engine = cache_cluster["Engine"]
-        engine_version = cache_cluster["EngineVersion"]
-        network_type = cache_cluster["NetworkType"]
-        outpost = False
-        snapshot_retention_period = cache_cluster["SnapshotRetentionLimit"]
+    with tracing.span("elasticache.describe_cache_clusters") as span:
+        paginator = client.get_paginator("describe_cache_clusters")
 
-        if "PreferredOutpostArn" in cache_cluster:
-            outpost = True
+        for page in paginator.paginate(ShowCacheNodeInfo=True):
+            for cache_cluster in page["CacheClusters"]:
+                cache_cluster_id, cluster = parse_cache_cluster(cache_cluster)
+                clusters[cache_cluster_id] = cluster
 
-        clusters[cache_cluster_id] = {"cacheNodeType": cache_node_type, "engine": engine, "engineVersion": engine_version, "networkType": network_type, "outpost": outpost, "snapshotRetentionPeriod": snapshot_retention_period, "term": term}
+        span["attributes"]["clusters"] = len(clusters)
 
     return clusters
 
-# how to fix  this?
+# Returns a dictionary of all the replication groups in given account with their member clusters, shards and replicas
+def get_replication_groups(client):
+    replication_groups = dict()
+
+    with tracing.span("elasticache.describe_replication_groups") as span:
+        paginator = client.get_paginator("describe_replication_groups")
+
+        for page in paginator.paginate():
+            for replication_group in page["ReplicationGroups"]:
+                node_groups = replication_group.get("NodeGroups", [])
+
+                replication_groups[replication_group["ReplicationGroupId"]] = {
+                    "members": replication_group.get("MemberClusters", []),
+                    "shards": len(node_groups),
+                    "replicas": sum(max(len(node_group.get("NodeGroupMembers", [])) - 1, 0) for node_group in node_groups),
+                    "clusterMode": replication_group.get("ClusterEnabled", False),
+                    "snapshotRetentionPeriod": replication_group.get("SnapshotRetentionLimit", 0),
+                    "arn": replication_group.get("ARN")
+                }
+
+        span["attributes"]["replicationGroups"] = len(replication_groups)
+
+    return replication_groups
+
+# Returns the dictionary entry of a single cluster, None if the cluster does not exist (anymore)
+def get_ec_cache_cluster(client, cache_cluster_id):
+    try:
+        with tracing.span("elasticache.describe_cache_clusters", resource=cache_cluster_id):
+            response = client.describe_cache_clusters(CacheClusterId=cache_cluster_id, ShowCacheNodeInfo=True)
+    except client.exceptions.CacheClusterNotFoundFault:
+        return None
+
+    for cache_cluster in response["CacheClusters"]:
+        return parse_cache_cluster(cache_cluster)[1]
+
+    return None
+
+# Returns the identifiers of the clusters with events (creation, deletion, modification, ...) in the given time frame
+def get_changed_clusters(client, start_time, end_time):
+    changed_clusters = set()
+
+    with tracing.span("elasticache.describe_events") as span:
+        paginator = client.get_paginator("describe_events")
+
+        for page in paginator.paginate(SourceType="cache-cluster", StartTime=start_time, EndTime=end_time):
+            for event in page["Events"]:
+                changed_clusters.add(event["SourceIdentifier"])
+
+        span["attributes"]["changedClusters"] = len(changed_clusters)
+
+    return changed_clusters
+
+# Returns a dictionary of all the serverless caches in given account
+def get_serverless_caches(client):
+    caches = dict()
+
+    with tracing.span("elasticache.describe_serverless_caches") as span:
+        paginator = client.get_paginator("describe_serverless_caches")
+
+        for page in paginator.paginate():
+            for serverless_cache in page["ServerlessCaches"]:
+                caches[serverless_cache["ServerlessCacheName"]] = {
+                    "engine": serverless_cache["Engine"],
+                    "status": serverless_cache.get("Status"),
+                    "arn": serverless_cache.get("ARN")
+                }
+
+        span["attributes"]["caches"] = len(caches)
+
+    return caches
+
+# Returns the month to date ECPUs and GB hours of data stored of the given serverless caches
+# only the complete hours since the last poll are read, with one batched GetMetricData query for all caches of the account
+def get_serverless_usage(client, account, caches):
+    end_time = (datetime.utcnow() - serverless_metric_delay).replace(minute=0, second=0, microsecond=0)
+    month_start = end_time.replace(day=1, hour=0)
+    month = (month_start.year, month_start.month)
+
+    with serverless_usage_lock:
+        for key in list(serverless_usage_totals.keys()):
+            if key[0] == account and key[1] not in caches:
+                serverless_usage_totals.pop(key) # deleted caches
+
+        queries = list()
+        query_caches = dict()
+        starts = dict()
+
+        for index, cache in enumerate(caches):
+            totals = serverless_usage_totals.get((account, cache))
+
+            if totals == None or totals["month"] != month:
+                totals = {"month": month, "until": month_start, "ecpus": 0, "gbHours": 0}
+                serverless_usage_totals[(account, cache)] = totals
+
+            if totals["until"] >= end_time:
+                continue
+
+            query_caches[f"e{index}"] = (cache, "ecpus")
+            query_caches[f"b{index}"] = (cache, "gbHours")
+            starts[cache] = totals["until"]
+            queries.append(metric_data.build_metric_query(f"e{index}", "AWS/ElastiCache", "ElastiCacheProcessingUnits", {"clusterId": cache}, 3600, "Sum"))
+            queries.append(metric_data.build_metric_query(f"b{index}", "AWS/ElastiCache", "BytesUsedForCache", {"clusterId": cache}, 3600, "Average"))
+
+        if queries:
+            # caches can have different starts (e.g. new caches), the query starts at the earliest and the datapoints are filtered per cache
+            results = metric_data.get_metric_data(client, queries, min(starts.values()), end_time, with_timestamps=True)
+
+            for query_id, datapoints in results.items():
+                cache, usage = query_caches[query_id]
+                values = [value for timestamp, value in datapoints if timestamp.replace(tzinfo=None) >= starts[cache]]
+
+                if usage == "gbHours":
+                    values = [value / 1024 / 1024 / 1024 for value in values] # hourly averages in bytes add up to GB hours
+
+                serverless_usage_totals[(account, cache)][usage] += sum(values)
+
+            for query_id in results:
+                serverless_usage_totals[(account, query_caches[query_id][0])]["until"] = end_time
+
+        return {cache: dict(serverless_usage_totals[(account, cache)]) for cache in caches}
+
+# Returns a list of all active reserved cache nodes in a given account
 def get_ec_cache_reserved_nodes(client):
-    return 0
+    reserved_nodes = list()
+
+    with tracing.span("elasticache.describe_reserved_cache_nodes") as span:
+        paginator = client.get_paginator("describe_reserved_cache_nodes")
+
+        for page in paginator.paginate():
+            for reserved_node in page["ReservedCacheNodes"]:
+                if reserved_node["State"] != "active":
+                    continue
+
+                reserved_nodes.append({
+                    "id": reserved_node["ReservedCacheNodeId"],
+                    "class": reserved_node["CacheNodeType"],
+                    "count": reserved_node["CacheNodeCount"],
+                    "product": reserved_node["ProductDescription"],
+                    "multiAZ": False,
+                    "duration": reserved_node["Duration"], # in seconds
+                    "fixedPrice": reserved_node["FixedPrice"],
+                    "usagePrice": reserved_node["UsagePrice"],
+                    "recurringCharges": reserved_node.get("RecurringCharges", [])
+                })
+
+        span["attributes"]["reservedNodes"] = len(reserved_nodes)
+
+    return reserved_nodes
 
-# Returns the allocated storage snapshot of a  given cluster
-def get_snapshot_storage(client, cluster_identifier):
-    response = client.describe_snapshots(
-        CacheClusterId=cluster_identifier
-    )
+# Returns the allocated storage snapshot of a  given cluster, or of a given replication group, its snapshots cover every member
+def get_snapshot_storage(client, cluster_identifier, replication_group=False):
+    with tracing.span("elasticache.describe_snapshots", resource=cluster_identifier):
+        if replication_group:
+            response = client.describe_snapshots(
+                ReplicationGroupId=cluster_identifier
+            )
+        else:
+            response = client.describe_snapshots(
+                CacheClusterId=cluster_identifier
+            )
 
     try:
         return response["Snapshots"][-1]["AllocatedStorage"] # always take the latest allocated storage in the snapshot
@@ -49,16 +225,17 @@ def get_metrics(client, cluster_identifier, metric_name, start_time, end_time, p
         }
     ]
 
-    response = client.get_metric_statistics(
-        Namespace=namespace,
-        MetricName=metric_name,
-        Dimensions=dimensions,
-        StartTime=start_time,
-        EndTime=end_time,
-        Period=period,
-        Statistics=[statistic],
-        Unit=unit
-    )
+    with tracing.span("cloudwatch.get_metric_statistics", namespace=namespace, metric=metric_name, resource=cluster_identifier):
+        response = client.get_metric_statistics(
+            Namespace=namespace,
+            MetricName=metric_name,
+            Dimensions=dimensions,
+            StartTime=start_time,
+            EndTime=end_time,
+            Period=period,
+            Statistics=[statistic],
+            Unit=unit
+        )
 
     return response["Datapoints"]
 
@@ -0,0 +1,109 @@
+import time
+import threading
+
+from datetime import datetime, timedelta
+
+from aws_cloudwatch_api import rds_cloudwatch_api
+from aws_cloudwatch_api import ec_cloudwatch_api
+
+inventory_ttl = 900 # seconds an inventory is served from the cache, the cost and recommendation jobs share it
+incremental = False # if set, only the resources with events since the last poll are described between full resyncs
+full_resync_interval = 6 * 3600 # seconds between full reconciliations of an account's inventory
+event_overlap = timedelta(minutes=5) # events can show up with a delay, so every poll looks back a bit further
+event_retention = timedelta(days=13) # describe_events only returns the last 14 days
+
+# per account and service: {"resources": dict, "lastPoll": datetime, "lastFullSync": float, "fetchedAt": float}
+inventories = dict()
+inventory_locks = dict()
+inventory_locks_lock = threading.Lock()
+
+# the describe functions of every service, see get_inventory, services without changes are always listed completely
+services = {
+    "rds": {"list": rds_cloudwatch_api.get_rds_on_demand_instances, "get": rds_cloudwatch_api.get_rds_instance, "changes": rds_cloudwatch_api.get_changed_instances},
+    "rds_clusters": {"list": rds_cloudwatch_api.get_db_clusters},
+    "ec": {"list": ec_cloudwatch_api.get_ec_cache_clusters, "get": ec_cloudwatch_api.get_ec_cache_cluster, "changes": ec_cloudwatch_api.get_changed_clusters},
+    "ec_replication_groups": {"list": ec_cloudwatch_api.get_replication_groups},
+    "ec_serverless": {"list": ec_cloudwatch_api.get_serverless_caches}
+}
+
+# Returns the lock of given inventory key
+def get_inventory_lock(key):
+    with inventory_locks_lock:
+        if key not in inventory_locks:
+            inventory_locks[key] = threading.Lock()
+
+        return inventory_locks[key]
+
+# Returns the inventory of given account and service, it is served from the cache for inventory_ttl seconds
+# concurrent calls for the same account and service wait for the one describe call in flight instead of describing again
+# in incremental mode it is fully listed every full_resync_interval, in between only the resources with events since the last poll are described again
+def get_inventory(account, service, client):
+    describe = services[service]
+    key = (account, service)
+
+    with get_inventory_lock(key):
+        now = datetime.utcnow()
+        inventory = inventories.get(key)
+
+        if inventory != None and time.time() - inventory["fetchedAt"] < inventory_ttl:
+            return dict(inventory["resources"])
+
+        if not incremental or "changes" not in describe or inventory == None or time.time() - inventory["lastFullSync"] >= full_resync_interval or now - inventory["lastPoll"] >= event_retention:
+            inventories[key] = {"resources": describe["list"](client), "lastPoll": now, "lastFullSync": time.time()}
+        else:
+            for identifier in describe["changes"](client, inventory["lastPoll"] - event_overlap, now):
+                resource = describe["get"](client, identifier)
+
+                if resource == None:
+                    inventory["resources"].pop(identifier, None)
+                else:
+                    inventory["resources"][identifier] = resource
+
+            inventory["lastPoll"] = now
+
+        inventories[key]["fetchedAt"] = time.time()
+
+        return dict(inventories[key]["resources"])
+
+# Drops the cached inventory of given account, the next call lists it completely
+def invalidate(account, service=None):
+    for key in list(inventories.keys()):
+        if key[0] == account and (service == None or key[1] == service):
+            inventories.pop(key, None)
+
+# Returns the cached resources of given service per account without describing anything, also inventories beyond their TTL
+# the resources are copied under the lock of the inventory, the incremental sync changes them in place
+def get_cached_resources(service):
+    cached = dict()
+
+    for key in list(inventories.keys()):
+        if key[1] != service:
+            continue
+
+        with get_inventory_lock(key):
+            inventory = inventories.get(key)
+
+            if inventory != None: # dropped by invalidate in the meantime
+                cached[key[0]] = dict(inventory["resources"])
+
+    return cached
+
+# Returns all the OnDemand instances in the given account
+def get_rds_instances(account, client):
+    return get_inventory(account, "rds", client)
+
+# Returns all the aurora clusters in the given account
+def get_rds_clusters(account, client):
+    return get_inventory(account, "rds_clusters", client)
+
+# Returns all the cache clusters in the given account
+def get_ec_clusters(account, client):
+    return get_inventory(account, "ec", client)
+
+# Returns all the replication groups in the given account
+def get_ec_replication_groups(account, client):
+    return get_inventory(account, "ec_replication_groups", client)
+
+# Returns all the serverless caches in the given account
+def get_ec_serverless_caches(account, client):
+    return get_inventory(account, "ec_serverless", client)
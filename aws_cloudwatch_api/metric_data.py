@@ -0,0 +1,64 @@
+from exporter import tracing
+
+max_queries_per_request = 500 # limit of GetMetricData
+
+# Returns a GetMetricData query for the given metric, dimensions is a dictionary of dimension names and values
+def build_metric_query(query_id, namespace, metric_name, dimensions, period, statistic):
+    return {
+        "Id": query_id,
+        "MetricStat": {
+            "Metric": {
+                "Namespace": namespace,
+                "MetricName": metric_name,
+                "Dimensions": [{"Name": name, "Value": value} for name, value in dimensions.items()]
+            },
+            "Period": period,
+            "Stat": statistic
+        },
+        "ReturnData": True
+    }
+
+# Returns the values of all the given queries by query id, the queries are sent in batches of 500 per GetMetricData call
+# with_timestamps returns (timestamp, value) tuples instead of the values
+def get_metric_data(client, queries, start_time, end_time, with_timestamps=False):
+    results = {query["Id"]: [] for query in queries}
+
+    for index in range(0, len(queries), max_queries_per_request):
+        batch = queries[index:index + max_queries_per_request]
+        next_token = None
+
+        while True:
+            kwargs = {"MetricDataQueries": batch, "StartTime": start_time, "EndTime": end_time, "ScanBy": "TimestampAscending"}
+
+            if next_token:
+                kwargs["NextToken"] = next_token
+
+            with tracing.span("cloudwatch.get_metric_data", queries=len(batch)):
+                response = client.get_metric_data(**kwargs)
+
+            for result in response["MetricDataResults"]:
+                if with_timestamps:
+                    results[result["Id"]].extend(zip(result["Timestamps"], result["Values"]))
+                else:
+                    results[result["Id"]].extend(result["Values"])
+
+            next_token = response.get("NextToken")
+            if not next_token:
+                break
+
+    return results
+
+# Returns the metric values of the given metric for all the given resources with one batched request
+# resources maps the resource names to their dimensions, the result maps the resource names to their values
+def get_metric_values(client, resources, namespace, metric_name, period, statistic, start_time, end_time):
+    queries = list()
+    query_ids = dict()
+
+    for index, name in enumerate(resources):
+        query_id = f"q{index}"
+        query_ids[query_id] = name
+        queries.append(build_metric_query(query_id, namespace, metric_name, resources[name], period, statistic))
+
+    results = get_metric_data(client, queries, start_time, end_time)
+
+    return {query_ids[query_id]: values for query_id, values in results.items()}
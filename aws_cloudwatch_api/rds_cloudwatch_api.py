@@ -1,38 +1,152 @@
 from datetime import datetime, timedelta
 
+from exporter import tracing
+from aws_cloudwatch_api import metric_data
+
+# Returns the identifier and the dictionary entry of a given db instance description
+def parse_db_instance(db_instance):
+    term = "OnDemand"
+
+    db_instance_identifier = db_instance["DBInstanceIdentifier"]
+    db_instance_class = db_instance["DBInstanceClass"] # this for instance type, getting this price category
+    allocated_storage = db_instance["AllocatedStorage"] # in GB -> just provisioned storage is billed -> get from cloudwatch!
+    deployment_option = db_instance["MultiAZ"] # boolean
+    storage_type = db_instance["StorageType"] # for example gp2
+    network_type = db_instance["NetworkType"]
+    iops = 0
+    storage_throughput = 0
+    backup_retention_period = db_instance["BackupRetentionPeriod"]
+    arn = db_instance.get("DBInstanceArn")
+    engine = db_instance.get("Engine")
+    cluster = db_instance.get("DBClusterIdentifier") # set for aurora cluster members
+
+    if "StorageThroughput" in db_instance:
+        storage_throughput = db_instance["StorageThroughput"]
+
+    if "Iops" in db_instance:
+        iops = db_instance["Iops"]
+
+    return db_instance_identifier, {"class" : db_instance_class, "storage": allocated_storage, "storageType": storage_type, "storageThroughput": storage_throughput, "network": network_type, "iops": iops, "deployment" : deployment_option, "backup": backup_retention_period, "term": term, "arn": arn, "engine": engine, "cluster": cluster}
+
 # Returns a dictionary of all the OnDemand instances in a given account
 def get_rds_on_demand_instances(client):
     instances = dict()
-    response = client.describe_db_instances()
-    term = "OnDemand"
+
+    with tracing.span("rds.describe_db_instances") as span:
+        response = client.describe_db_instances()
+        span["attributes"]["instances"] = len(response["DBInstances"])
 
     # needing to iterate through instances
     for db_instance in response["DBInstances"]:
-        db_instance_identifier = db_instance["DBInstanceIdentifier"]      
-        db_instance_class = db_instance["DBInstanceClass"] # this for instance type, getting this price category
-        allocated_storage = db_instance["AllocatedStorage"] # in GB -> just provisioned storage is billed -> get from cloudwatch!
-        deployment_option = db_instance["MultiAZ"] # boolean
-        storage_type = db_instance["StorageType"] # for example gp2
-        network_type = db_instance["NetworkType"]
-        iops = 0
-        storage_throughput = 0
-        backup_retention_period = db_instance["BackupRetentionPeriod"]
-
-        if "StorageThroughput" in db_instance:
-            storage_throughput = db_instance["StorageThroughput"]
-            
-        if "Iops" in db_instance:
-            iops = db_instance["Iops"]
-
-        instances[db_instance_identifier] = {"class" : db_instance_class, "storage": allocated_storage, "storageType": storage_type, "storageThroughput": storage_throughput, "network": network_type, "iops": iops, "deployment" : deployment_option, "backup": backup_retention_period, "term": term}
+        db_instance_identifier, instance = parse_db_instance(db_instance)
+        instances[db_instance_identifier] = instance
 
     return instances
 
+# Returns the dictionary entry of a single instance, None if the instance does not exist (anymore)
+def get_rds_instance(client, db_instance_identifier):
+    try:
+        with tracing.span("rds.describe_db_instances", resource=db_instance_identifier):
+            response = client.describe_db_instances(DBInstanceIdentifier=db_instance_identifier)
+    except client.exceptions.DBInstanceNotFoundFault:
+        return None
+
+    for db_instance in response["DBInstances"]:
+        return parse_db_instance(db_instance)[1]
+
+    return None
+
+# Returns the identifiers of the instances with events (creation, deletion, modification, ...) in the given time frame
+def get_changed_instances(client, start_time, end_time):
+    changed_instances = set()
+
+    with tracing.span("rds.describe_events") as span:
+        paginator = client.get_paginator("describe_events")
+
+        for page in paginator.paginate(SourceType="db-instance", StartTime=start_time, EndTime=end_time):
+            for event in page["Events"]:
+                changed_instances.add(event["SourceIdentifier"])
+
+        span["attributes"]["changedInstances"] = len(changed_instances)
+
+    return changed_instances
+
+# Returns a dictionary of all the aurora clusters in a given account, one paginated describe call
+def get_db_clusters(client):
+    clusters = dict()
+
+    with tracing.span("rds.describe_db_clusters") as span:
+        paginator = client.get_paginator("describe_db_clusters")
+
+        for page in paginator.paginate():
+            for db_cluster in page["DBClusters"]:
+                if not db_cluster["Engine"].startswith("aurora"):
+                    continue # multi-az db clusters are billed like their instances
+
+                clusters[db_cluster["DBClusterIdentifier"]] = {
+                    "engine": db_cluster["Engine"],
+                    "storageType": db_cluster.get("StorageType", "aurora"), # aurora-iopt1 for I/O-Optimized clusters
+                    "members": [member["DBInstanceIdentifier"] for member in db_cluster.get("DBClusterMembers", [])],
+                    "serverlessV2": "ServerlessV2ScalingConfiguration" in db_cluster,
+                    "arn": db_cluster.get("DBClusterArn")
+                }
+
+        span["attributes"]["clusters"] = len(clusters)
+
+    return clusters
+
+# Returns the month to date usage of the given aurora clusters and their serverless v2 instances with batched metric reads
+# volume in GB (latest VolumeBytesUsed), billed I/O operations of the month and ACU hours of the month per serverless instance
+def get_aurora_usage(client, clusters, serverless_instances):
+    end_time = datetime.utcnow()
+    month_start = end_time.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    start_time = min(month_start, end_time - timedelta(hours=3)) # VolumeBytesUsed needs a few hours of data at the beginning of a month
+
+    cluster_dimensions = {cluster: {"DBClusterIdentifier": cluster} for cluster in clusters}
+    instance_dimensions = {instance: {"DBInstanceIdentifier": instance} for instance in serverless_instances}
+
+    volume_bytes = metric_data.get_metric_values(client, cluster_dimensions, "AWS/RDS", "VolumeBytesUsed", 3600, "Average", start_time, end_time)
+    read_ios = metric_data.get_metric_values(client, cluster_dimensions, "AWS/RDS", "VolumeReadIOPs", 3600, "Sum", month_start, end_time)
+    write_ios = metric_data.get_metric_values(client, cluster_dimensions, "AWS/RDS", "VolumeWriteIOPs", 3600, "Sum", month_start, end_time)
+    capacity = metric_data.get_metric_values(client, instance_dimensions, "AWS/RDS", "ServerlessDatabaseCapacity", 3600, "Average", month_start, end_time)
+
+    usage = dict()
+    for cluster in clusters:
+        volume_gb = volume_bytes[cluster][-1] / 1024 / 1024 / 1024 if volume_bytes[cluster] else 0
+
+        usage[cluster] = {"volumeGB": volume_gb, "ios": sum(read_ios[cluster]) + sum(write_ios[cluster])}
+
+    acu_hours = {instance: sum(capacity[instance]) for instance in serverless_instances} # hourly averages add up to ACU hours
+
+    return usage, acu_hours
+
+# Returns a list of all active reserved db instances in a given account
 def get_rds_reserved_instances(client):
-    response = client.describe_reserved_db_instances()
+    reserved_instances = list()
 
-    print(response["ReservedDBInstances"])
-    return 0
+    with tracing.span("rds.describe_reserved_db_instances") as span:
+        paginator = client.get_paginator("describe_reserved_db_instances")
+
+        for page in paginator.paginate():
+            for reserved_instance in page["ReservedDBInstances"]:
+                if reserved_instance["State"] != "active":
+                    continue
+
+                reserved_instances.append({
+                    "id": reserved_instance["ReservedDBInstanceId"],
+                    "class": reserved_instance["DBInstanceClass"],
+                    "count": reserved_instance["DBInstanceCount"],
+                    "product": reserved_instance["ProductDescription"],
+                    "multiAZ": reserved_instance["MultiAZ"],
+                    "duration": reserved_instance["Duration"], # in seconds
+                    "fixedPrice": reserved_instance["FixedPrice"],
+                    "usagePrice": reserved_instance["UsagePrice"],
+                    "recurringCharges": reserved_instance.get("RecurringCharges", [])
+                })
+
+        span["attributes"]["reservedInstances"] = len(reserved_instances)
+
+    return reserved_instances
 
 # Returns RDS metrics for a given instance, metric, period, time frame, statistic and unit can be passed to the method
 def get_metrics(client, db_instance_identifier, metric_name, start_time, end_time, period, statistic, unit):
@@ -44,16 +158,17 @@ def get_metrics(client, db_instance_identifier, metric_name, start_time, end_tim
         }
     ]
 
-    response = client.get_metric_statistics(
-        Namespace=namespace,
-        MetricName=metric_name,
-        Dimensions=dimensions,
-        StartTime=start_time,
-        EndTime=end_time,
-        Period=period,
-        Statistics=[statistic],
-        Unit=unit
-    )
+    with tracing.span("cloudwatch.get_metric_statistics", namespace=namespace, metric=metric_name, resource=db_instance_identifier):
+        response = client.get_metric_statistics(
+            Namespace=namespace,
+            MetricName=metric_name,
+            Dimensions=dimensions,
+            StartTime=start_time,
+            EndTime=end_time,
+            Period=period,
+            Statistics=[statistic],
+            Unit=unit
+        )
 
     return response["Datapoints"]
 
@@ -74,9 +189,10 @@ def get_cloudwatch_provisioned_storage_space(client, db_instance_identifier, max
 
 # Returns allocated snapshot storage for given instance
 def get_snapshot_storage(client, db_instance_identifier):
-    response = client.describe_db_snapshots(
-        DBInstanceIdentifier=db_instance_identifier
-    )
+    with tracing.span("rds.describe_db_snapshots", resource=db_instance_identifier):
+        response = client.describe_db_snapshots(
+            DBInstanceIdentifier=db_instance_identifier
+        )
 
     try:
         return response["DBSnapshots"][-1]["AllocatedStorage"] # always take the latest allocated storage in the snapshot
@@ -187,14 +303,36 @@ def get_throughput_usage(client, db_instance_identifier):
 
     return round(throughput_usage, 2) # Megabyte/Second
 
+# Returns the peak IOPS and throughput (in Megabyte/Second) of every given instance of the last 7 days with batched metric reads
+# like get_iops_usage and get_throughput_usage the peaks of read and write are added up
+def get_storage_usage(client, instances):
+    start_time = datetime.utcnow() - timedelta(days=7)
+    end_time = datetime.utcnow()
+
+    metric_names = ["ReadIOPS", "WriteIOPS", "ReadThroughput", "WriteThroughput"]
+    queries = list()
+
+    # all metrics of all instances go into the same batches
+    for index, instance in enumerate(instances):
+        for metric_index, metric_name in enumerate(metric_names):
+            queries.append(metric_data.build_metric_query(f"m{metric_index}_{index}", "AWS/RDS", metric_name, {"DBInstanceIdentifier": instance}, 3600, "Maximum"))
+
+    results = metric_data.get_metric_data(client, queries, start_time, end_time)
+
+    usage = dict()
+    for index, instance in enumerate(instances):
+        peaks = [max(results[f"m{metric_index}_{index}"], default=0) for metric_index in range(len(metric_names))]
+
+        iops_usage = peaks[0] + peaks[1]
+        throughput_usage = (peaks[2] + peaks[3]) / 1024 / 1024
+
+        usage[instance] = {"iops": round(iops_usage, 2), "throughput": round(throughput_usage, 2)}
+
+    return usage
+
 # ================
 # testing section
 # ================
 def test(client):
     get_rds_on_demand_instances(client)
     get_rds_reserved_instances(client)
-
-def get_db_clusters(client):
-    response = client.describe_db_clusters()
-
-    print(response)
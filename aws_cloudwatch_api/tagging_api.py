@@ -0,0 +1,43 @@
+import time
+import threading
+
+from exporter import tracing
+
+tag_ttl = 3600 # seconds the tags of an account are cached
+resource_type_filters = ["rds:db", "rds:cluster", "elasticache:cluster", "elasticache:replicationgroup", "elasticache:serverlesscache"]
+
+# per account and region: {"tags": {arn: {key: value}}, "fetched": float}
+tag_cache = dict()
+tag_cache_lock = threading.Lock()
+
+# Returns the tags of all RDS and ElastiCache resources of the client's account and region by arn, one paginated GetResources call
+def get_resource_tags(client):
+    tags = dict()
+
+    with tracing.span("tagging.get_resources") as span:
+        paginator = client.get_paginator("get_resources")
+
+        for page in paginator.paginate(ResourceTypeFilters=resource_type_filters, ResourcesPerPage=100):
+            for resource in page["ResourceTagMappingList"]:
+                tags[resource["ResourceARN"]] = {tag["Key"]: tag["Value"] for tag in resource["Tags"]}
+
+        span["attributes"]["resources"] = len(tags)
+
+    return tags
+
+# Returns the cached tags of given account and region, they are fetched again once they are older than tag_ttl
+def get_cached_resource_tags(account, client, region="eu-central-1"):
+    key = (account, region)
+
+    with tag_cache_lock:
+        entry = tag_cache.get(key)
+
+        if entry != None and time.time() - entry["fetched"] < tag_ttl:
+            return entry["tags"]
+
+    tags = get_resource_tags(client)
+
+    with tag_cache_lock:
+        tag_cache[key] = {"tags": tags, "fetched": time.time()}
+
+    return tags
@@ -0,0 +1,248 @@
+import os
+import mmap
+import math
+import struct
+import tempfile
+import threading
+
+from aws_pricing_api import price_index
+
+# compiled price catalog, a flat file worker processes memory-map read-only so they all share one physical copy
+# layout: header | string offsets (uint32, string_count + 1) | utf-8 string data | records sorted by (kind, name, variant)
+magic = b"FINOPSC1"
+header_format = struct.Struct("<8sIIQQqqHH")
+record_format = struct.Struct("<BBxxI9d") # kind, variant, name string id, 9 price columns
+offset_format = struct.Struct("<I")
+
+# record kinds and their variant, the deployment for rds and the outpost flag for ec
+RDS_INSTANCE = 0
+EC_NODE = 1
+RDS_STORAGE = 2
+
+reserved_columns = [("NoUpfront", None), ("PartialUpfront", "1yr"), ("PartialUpfront", "3yr"), ("AllUpfront", "1yr"), ("AllUpfront", "3yr")]
+
+# opened catalogs per path, reopened when the file was replaced
+catalogs = dict()
+catalogs_lock = threading.Lock()
+
+# Returns the price columns of an instance or node entry of the price index, missing reserved prices are NaN
+def get_instance_columns(entry):
+    reserved = entry["monthly"]["Reserved"]
+    columns = [entry["hourly"], entry["vcpu"], entry["memory"], entry["monthly"]["OnDemand"]]
+
+    for option, term in reserved_columns:
+        if reserved == None:
+            columns.append(math.nan)
+        elif term == None:
+            columns.append(reserved[option])
+        else:
+            columns.append(reserved[option][term])
+
+    return columns
+
+# Compiles the loaded catalogs into the flat binary format and writes it atomically to given path
+def compile_catalog(path):
+    index = price_index.get_index()
+    key = price_index.get_index_key()
+    records = list()
+
+    for (instance_type, deployment), entry in index["rdsInstances"].items():
+        if deployment not in ["single-az", "multi-az"]:
+            continue # e.g. Multi-AZ (readable standbys), the variant only tells Single-AZ and Multi-AZ apart
+
+        records.append((RDS_INSTANCE, instance_type, int(deployment == "multi-az"), get_instance_columns(entry)))
+
+    for (node_type, outpost), entry in index["ecNodes"].items():
+        records.append((EC_NODE, node_type, int(outpost), get_instance_columns(entry)))
+
+    for (storage_type, deployment), entry in index["rdsStorage"].items():
+        columns = [entry["gbMonth"], entry["iopsMonth"], entry["throughputMonth"]] + [math.nan] * 6
+        records.append((RDS_STORAGE, storage_type, int(deployment == "multi-az"), columns))
+
+    records.sort(key=lambda record: (record[0], record[1].encode("utf-8"), record[2]))
+
+    strings = sorted({record[1] for record in records})
+    string_ids = {string: string_id for string_id, string in enumerate(strings)}
+    string_data = b"".join(string.encode("utf-8") for string in strings)
+
+    string_offsets = [0]
+    for string in strings:
+        string_offsets.append(string_offsets[-1] + len(string.encode("utf-8")))
+
+    strings_offset = header_format.size
+    records_offset = strings_offset + offset_format.size * len(string_offsets) + len(string_data)
+    records_offset += -records_offset % 8 # keeps the numeric columns aligned
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(header_format.pack(magic, len(records), len(strings), strings_offset, records_offset, key[0], key[1], key[2], key[3]))
+
+            for string_offset in string_offsets:
+                tmp_file.write(offset_format.pack(string_offset))
+
+            tmp_file.write(string_data)
+            tmp_file.write(b"\0" * (records_offset - tmp_file.tell()))
+
+            for kind, name, variant, columns in records:
+                tmp_file.write(record_format.pack(kind, variant, string_ids[name], *columns))
+
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+
+        mismatches = verify_catalog(tmp_path, index)
+        if mismatches:
+            raise ValueError(f"The compiled catalog differs from the price index for {len(mismatches)} lookups, e.g. {mismatches[0]}")
+
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path) # readers keep the old file mapped until they reopen
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+    return len(records)
+
+# Memory-maps the compiled catalog at given path read-only
+def open_catalog(path):
+    with open(path, "rb") as catalog_file:
+        stat = os.fstat(catalog_file.fileno())
+        data = mmap.mmap(catalog_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    header = header_format.unpack_from(data, 0)
+
+    if header[0] != magic:
+        data.close()
+        raise ValueError(f"{path} is not a compiled price catalog")
+
+    return {
+        "data": data,
+        "records": header[1],
+        "strings": header[2],
+        "stringsOffset": header[3],
+        "recordsOffset": header[4],
+        "stringDataOffset": header[3] + offset_format.size * (header[2] + 1),
+        "catalogVersions": (header[5], header[6]),
+        "month": (header[7], header[8]),
+        "fileId": (stat.st_ino, stat.st_mtime_ns)
+    }
+
+# Returns the opened catalog of given path, it is reopened once the file was replaced by a newer compilation
+def get_catalog(path):
+    stat = os.stat(path)
+
+    with catalogs_lock:
+        catalog = catalogs.get(path)
+
+        if catalog == None or catalog["fileId"] != (stat.st_ino, stat.st_mtime_ns):
+            catalog = open_catalog(path)
+            catalogs[path] = catalog
+
+        return catalog
+
+# Returns the utf-8 bytes of given string id, sliced straight out of the mapping
+def get_string(catalog, string_id):
+    start, end = struct.unpack_from("<II", catalog["data"], catalog["stringsOffset"] + offset_format.size * string_id)
+
+    return catalog["data"][catalog["stringDataOffset"] + start:catalog["stringDataOffset"] + end]
+
+# Returns the columns of the record with given kind, name and variant with a binary search over the sorted records
+def find_record(catalog, kind, name, variant):
+    search_key = (kind, name.encode("utf-8"), variant)
+    low = 0
+    high = catalog["records"]
+
+    while low < high:
+        middle = (low + high) // 2
+        record = record_format.unpack_from(catalog["data"], catalog["recordsOffset"] + record_format.size * middle)
+        record_key = (record[0], get_string(catalog, record[2]), record[1])
+
+        if record_key < search_key:
+            low = middle + 1
+        elif record_key > search_key:
+            high = middle
+        else:
+            return record[3:]
+
+    raise KeyError((kind, name, variant))
+
+# Returns the price index entry of an instance or node record
+def get_instance_entry(columns):
+    if math.isnan(columns[4]):
+        reserved = None
+    else:
+        reserved = {"NoUpfront": columns[4], "PartialUpfront": {"1yr": columns[5], "3yr": columns[6]}, "AllUpfront": {"1yr": columns[7], "3yr": columns[8]}}
+
+    return {"vcpu": int(columns[1]), "memory": columns[2], "hourly": columns[0], "monthly": {"OnDemand": columns[3], "Reserved": reserved}}
+
+# One table of the compiled catalog, it is looked up like the tables of price_index.build_index
+class CatalogTable:
+    def __init__(self, catalog, kind):
+        self.catalog = catalog
+        self.kind = kind
+
+    def __getitem__(self, key):
+        name, variant = key
+
+        if self.kind == EC_NODE:
+            columns = find_record(self.catalog, self.kind, name, int(variant))
+            return dict(service="ec", instanceType=name, outpost=bool(variant), **get_instance_entry(columns))
+
+        if variant not in ["single-az", "multi-az"]:
+            raise KeyError(key)
+
+        deployment = "Multi-AZ" if variant == "multi-az" else "Single-AZ"
+        columns = find_record(self.catalog, self.kind, name, int(variant == "multi-az"))
+
+        if self.kind == RDS_STORAGE:
+            return {"service": "rds", "storageType": name, "deployment": deployment, "gbMonth": columns[0], "iopsMonth": columns[1], "throughputMonth": columns[2]}
+
+        return dict(service="rds", instanceType=name, deployment=deployment, **get_instance_entry(columns))
+
+# Returns the lookup tables of given opened catalog, they replace the tables of price_index.build_index
+def get_tables(catalog):
+    return {"rdsInstances": CatalogTable(catalog, RDS_INSTANCE), "ecNodes": CatalogTable(catalog, EC_NODE), "rdsStorage": CatalogTable(catalog, RDS_STORAGE)}
+
+# Returns the price of the given lookup from the compiled catalog at given path, see price_index.lookup for the lookups
+def lookup(path, query):
+    return price_index.lookup(query, get_tables(get_catalog(path)))
+
+# Returns the lookups of every entry of given price index
+def get_index_queries(index):
+    queries = list()
+
+    for instance_type, deployment in index["rdsInstances"]:
+        if deployment in ["single-az", "multi-az"]:
+            queries.append({"service": "rds", "instanceType": instance_type, "deployment": deployment})
+
+    for node_type, outpost in index["ecNodes"]:
+        queries.append({"service": "ec", "instanceType": node_type, "outpost": str(outpost).lower()})
+
+    for storage_type, deployment in index["rdsStorage"]:
+        queries.append({"service": "rds", "storageType": storage_type, "deployment": deployment})
+
+    return queries
+
+# Returns the lookups the compiled catalog at given path answers differently than the given price index, empty if they all match
+def verify_catalog(path, index):
+    catalog = open_catalog(path)
+    tables = get_tables(catalog)
+    mismatches = list()
+
+    try:
+        for query in get_index_queries(index):
+            expected = price_index.lookup(query, index)
+
+            try:
+                mapped = price_index.lookup(query, tables)
+            except KeyError:
+                mapped = None
+
+            if mapped != expected:
+                mismatches.append(query)
+    finally:
+        catalog["data"].close()
+
+    return mismatches
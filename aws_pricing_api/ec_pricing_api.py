@@ -3,12 +3,25 @@ import datetime
 import calendar
 
 from aws_cloudwatch_api import ec_cloudwatch_api
+from exporter import tracing
 from .ec_utils import *
+from . import ri_coverage
+from . import pareto_frontier
 
 # write method to get product families?
 product_families = {"Cache Instance", "ElastiCache Serverless", "Amazon ElastiCache Global Datastore", "Storage Snapshot"}
 price_dict = None
 
+# precomputed monthly costs per catalog version and month, see build_monthly_price_table
+catalog_version = 0
+monthly_price_table = None
+monthly_price_table_key = None
+
+# pareto frontier of the clusters per outpost flag, see build_candidate_frontier
+recommendation_limit = 3 # maximum number of recommended clusters per cluster
+candidate_frontier = None
+candidate_frontier_version = None
+
 # Returns the deployment option as a string
 def get_deployment_option(deployment_option):
     if deployment_option:
@@ -40,42 +53,129 @@ def get_cluster_instance_price(instance, outpost, term):
     return 0
 
 # Returns a dictionary containing all the pricing information of given clusters
-def calculate_ec_prices(clusters, enterprise_discount, ec_client):
+# the member clusters of the given replication groups are priced per node, the snapshots of a group are priced once in the entry of the group
+# group entries carry the aggregated costs of all their members in "aggregate", their own costs are just the snapshots to keep the totals right
+# serverless caches are priced from their usage, see calculate_serverless_prices
+def calculate_ec_prices(clusters, enterprise_discount, ec_client, replication_groups=None, serverless_caches=None, serverless_usage=None):
     prices = dict()
     total_month = 0
     total_current = 0
 
     now = datetime.datetime.now()
-    total_days_in_month = calendar.monthrange(now.year, now.month)[1]
-    total_hours_in_month = total_days_in_month * 24
+    total_hours_in_month = get_hours_in_month(now)
     current_hours_of_month = (now.day - 1) * 24 + now.hour
 
+    if replication_groups == None:
+        replication_groups = dict()
+
+    snapshot_price = float(get_snapshot_storage_price())
+
+    for group in replication_groups:
+        snapshot_storage = ec_cloudwatch_api.get_snapshot_storage(ec_client, group, replication_group=True)
+        snapshot_final = round(snapshot_price * snapshot_storage * (1 - enterprise_discount), 2)
+
+        prices[group] = {"month": snapshot_final, "current": 0, "aggregate": {"month": snapshot_final, "current": 0, "nodes": 0}, "components": {"snapshot": snapshot_final}, "usage": {"snapshotGB": snapshot_storage}}
+        total_month += snapshot_final
+
     for cluster in clusters:
         cluster_instance = clusters[cluster]["cacheNodeType"]
         outpost = clusters[cluster]["outpost"]
         snapshot_retention_period = clusters[cluster]["snapshotRetentionPeriod"]
+        group = clusters[cluster].get("replicationGroup")
+        nodes = clusters[cluster].get("nodes", 1)
+
+        # clusters covered by reserved nodes have a blended rate, see apply_ec_reservations
+        if "effectiveHourlyRate" in clusters[cluster]:
+            cluster_price = clusters[cluster]["effectiveHourlyRate"]
+        else:
+            cluster_price = float(get_cluster_instance_price(cluster_instance, outpost, clusters[cluster]["term"]))
 
-        cluster_price = float(get_cluster_instance_price(cluster_instance, outpost, clusters[cluster]["term"]))
-        snapshot_price = float(get_snapshot_storage_price())
+        cluster_final = cluster_price * nodes * total_hours_in_month
 
-        cluster_final = cluster_price * total_hours_in_month
-        snapshot_final = snapshot_price * ec_cloudwatch_api.get_snapshot_storage(ec_client, cluster)
+        if group in replication_groups:
+            snapshot_storage = 0 # priced once per group
+        else:
+            snapshot_storage = ec_cloudwatch_api.get_snapshot_storage(ec_client, cluster)
+
+        snapshot_final = snapshot_price * snapshot_storage
 
         cluster_month = (cluster_final + snapshot_final) * (1 - enterprise_discount)
-        cluster_current = (cluster_price * current_hours_of_month * (1 - enterprise_discount))
+        cluster_current = (cluster_price * nodes * current_hours_of_month * (1 - enterprise_discount))
 
         cluster_month = round(cluster_month, 2)
         cluster_current = round(cluster_current, 2)
 
-        prices[cluster] = {"month": cluster_month, "current": cluster_current}
+        # the monthly cost components and usage aggregates are kept for the history export, see history_export
+        components = {"instance": round(cluster_final * (1 - enterprise_discount), 2), "snapshot": round(snapshot_final * (1 - enterprise_discount), 2)}
+
+        prices[cluster] = {"month": cluster_month, "current": cluster_current, "components": components, "usage": {"nodes": nodes, "snapshotGB": snapshot_storage}}
         total_month += cluster_month
         total_current += cluster_current
-    
+
+        if group in replication_groups:
+            aggregate = prices[group]["aggregate"]
+            aggregate["month"] = round(aggregate["month"] + cluster_month, 2)
+            aggregate["current"] = round(aggregate["current"] + cluster_current, 2)
+            aggregate["nodes"] += nodes
+
+    if serverless_caches:
+        serverless_prices = calculate_serverless_prices(serverless_caches, serverless_usage, enterprise_discount)
+
+        for cache in serverless_prices:
+            prices[cache] = serverless_prices[cache]
+            total_month += serverless_prices[cache]["month"]
+            total_current += serverless_prices[cache]["current"]
+
     prices["totalMonth"] = round(total_month, 2)
     prices["totalCurrent"] = round(total_current, 2)
 
     return prices
 
+# Returns the price of the given unit (e.g. GB-Hrs or ECPU) of serverless caches with given engine
+def get_serverless_price(engine, unit):
+    pf = "ElastiCache Serverless"
+
+    for key in price_dict[pf]:
+        if price_dict[pf][key]["cacheEngine"].lower() != engine.lower():
+            continue
+
+        for cost_unit in price_dict[pf][key]["costs"]:
+            if unit.lower() in cost_unit.lower():
+                return price_dict[pf][key]["costs"][cost_unit]
+
+    return 0
+
+# Returns a dictionary of the given serverless caches with their current price in the running month and a forecast for the running month end costs
+# the usage holds the month to date ECPUs and GB hours of data stored per cache, see ec_cloudwatch_api.get_serverless_usage
+def calculate_serverless_prices(caches, usage, enterprise_discount):
+    prices = dict()
+
+    now = datetime.datetime.now()
+    total_hours_in_month = get_hours_in_month(now)
+    current_hours_of_month = (now.day - 1) * 24 + now.hour
+    month_factor = total_hours_in_month / max(current_hours_of_month, 1) # extrapolates the month to date usage
+
+    for cache in caches:
+        engine = caches[cache]["engine"]
+
+        storage_current = usage[cache]["gbHours"] * float(get_serverless_price(engine, "GB"))
+        ecpu_current = usage[cache]["ecpus"] * float(get_serverless_price(engine, "ECPU"))
+
+        cache_current = (storage_current + ecpu_current) * (1 - enterprise_discount)
+        cache_month = cache_current * month_factor
+
+        components = {"storage": round(storage_current * month_factor * (1 - enterprise_discount), 2), "compute": round(ecpu_current * month_factor * (1 - enterprise_discount), 2)}
+
+        prices[cache] = {"month": round(cache_month, 2), "current": round(cache_current, 2), "components": components, "usage": {"storageGB": usage[cache]["gbHours"] / max(current_hours_of_month, 1), "computeUnits": usage[cache]["ecpus"]}}
+
+    return prices
+
+# Returns copies of the given clusters with the reserved cache nodes applied, size flexible per node family like AWS applies them
+def apply_ec_reservations(clusters, reserved_nodes):
+    on_demand_price = lambda cluster: get_cluster_instance_price(cluster["cacheNodeType"], cluster["outpost"], "OnDemand")
+
+    return ri_coverage.apply_reservations(clusters, reserved_nodes, on_demand_price, "cacheNodeType", "multiAZ", "engine")
+
 # Returns a dictionary containing all the specs of a given cluster type
 def return_cluster_instance_item(cluster_type, outpost, term, term_length=None):
     pf = "Cache Instance"
@@ -90,45 +190,117 @@ def return_cluster_instance_item(cluster_type, outpost, term, term_length=None):
     for key in filtered_keys:   
         return price_dict[pf][key]
 
+# Returns the number of hours of the given (or running) month
+def get_hours_in_month(now=None):
+    if now == None:
+        now = datetime.datetime.now()
+
+    total_days_in_month = calendar.monthrange(now.year, now.month)[1]
+
+    return total_days_in_month * 24
+
+# Returns the monthly costs without any discounts of a given price item, OnDemand and all the Reserved options
+def build_cluster_monthly_price(item, hours_in_month):
+    costs = item["costs"]
+    on_demand_costs = float(costs["OnDemand"]["Hrs"]) * hours_in_month
+
+    if costs["Reserved"] == None:
+        return {"OnDemand": on_demand_costs, "Reserved": None}
+
+    try:
+        reserved = costs["Reserved"]
+
+        if "Heavy Utilization" in reserved.keys():
+            hu_one_costs = float(reserved["Heavy Utilization"]["1yr"]["Hrs"]) * hours_in_month + (float(reserved["Heavy Utilization"]["1yr"]["upfrontFee"]) / 12)
+            hu_three_costs = float(reserved["Heavy Utilization"]["3yr"]["Hrs"]) * hours_in_month + (float(reserved["Heavy Utilization"]["3yr"]["upfrontFee"]) / 36)
+
+            return {"OnDemand": on_demand_costs, "Reserved": {"Heavy Utilization" : {"1yr": hu_one_costs, "3yr" : hu_three_costs}}}
+
+        reserved_nu_costs = float(reserved["No Upfront"]["1yr"]["Hrs"]) * hours_in_month # no upfront
+        reserved_pu_one_costs = float(reserved["Partial Upfront"]["1yr"]["Hrs"]) * hours_in_month + (float(reserved["Partial Upfront"]["1yr"]["upfrontFee"]) / 12) # partial upfront 1 year
+        reserved_pu_three_costs = float(reserved["Partial Upfront"]["3yr"]["Hrs"]) * hours_in_month + (float(reserved["Partial Upfront"]["3yr"]["upfrontFee"]) / 36) # partial upfront 3 years
+        reserved_au_one_costs = float(reserved["All Upfront"]["1yr"]["Hrs"]) * hours_in_month + (float(reserved["All Upfront"]["1yr"]["upfrontFee"]) / 12) # all upfront 1 year
+        reserved_au_three_costs = float(reserved["All Upfront"]["3yr"]["Hrs"]) * hours_in_month + (float(reserved["All Upfront"]["3yr"]["upfrontFee"]) / 36) # all upfront 3 years
+    except KeyError:
+        # not every node type is offered with every reserved option
+        return {"OnDemand": on_demand_costs, "Reserved": None}
+
+    return {"OnDemand": on_demand_costs, "Reserved": {"NoUpfront" : reserved_nu_costs, "PartialUpfront": {"1yr" : reserved_pu_one_costs, "3yr" : reserved_pu_three_costs}, "AllUpfront": {"1yr": reserved_au_one_costs, "3yr": reserved_au_three_costs}}}
+
+# Builds the monthly price table of all cache instances for the loaded catalog and the running month
+def build_monthly_price_table(now=None):
+    global monthly_price_table
+    global monthly_price_table_key
+
+    pf = "Cache Instance"
+
+    if now == None:
+        now = datetime.datetime.now()
+
+    hours_in_month = get_hours_in_month(now)
+    table = dict()
+
+    for cluster in price_dict[pf]:
+        table[cluster] = build_cluster_monthly_price(price_dict[pf][cluster], hours_in_month)
+
+    monthly_price_table = table
+    monthly_price_table_key = (catalog_version, now.year, now.month)
+
+    return monthly_price_table
+
+# Returns the monthly price table, it is only rebuilt after a catalog reload or at month rollover
+def get_monthly_price_table():
+    now = datetime.datetime.now()
+
+    if monthly_price_table_key != (catalog_version, now.year, now.month):
+        build_monthly_price_table(now)
+
+    return monthly_price_table
+
 # Returns a dictionary containing monthly cost forecast for given cluster
 def calculate_cluster_monthly_price(cluster):
+    return get_monthly_price_table()[cluster]
+
+# Builds the pareto frontier over memory, cpuVal, network performance and OnDemand costs of all cache instances per outpost flag
+# a cluster type is dropped if another one offers at least the same specs for less or equal costs, see pareto_frontier.build
+def build_candidate_frontier():
+    global candidate_frontier
+    global candidate_frontier_version
+
     pf = "Cache Instance"
+    groups = dict()
 
-    now = datetime.datetime.now()
-    total_days_in_month = calendar.monthrange(now.year, now.month)[1]
-    hours_in_month = total_days_in_month * 24
-    on_demand_costs = float(price_dict[pf][cluster]["costs"]["OnDemand"]["Hrs"]) * hours_in_month
+    for key in price_dict[pf]:
+        item = price_dict[pf][key]
+        entry = (float(item["costs"]["OnDemand"]["Hrs"]), item["memory"], item["cpuVal"], item["networkPerformance"], key)
+        groups.setdefault(item["outpost"], []).append(entry)
 
-    if price_dict[pf][cluster]["costs"]["Reserved"] != None:
-        if "Heavy Utilization" in price_dict[pf][cluster]["costs"]["Reserved"].keys():
-            hu_one_costs = float(price_dict[pf][cluster]["costs"]["Reserved"]["Heavy Utilization"]["1yr"]["Hrs"]) * hours_in_month + (float(price_dict[pf][cluster]["costs"]["Reserved"]["Heavy Utilization"]["1yr"]["upfrontFee"]) / 12)
-            hu_three_costs = float(price_dict[pf][cluster]["costs"]["Reserved"]["Heavy Utilization"]["3yr"]["Hrs"]) * hours_in_month + (float(price_dict[pf][cluster]["costs"]["Reserved"]["Heavy Utilization"]["3yr"]["upfrontFee"]) / 12)
+    candidate_frontier = {outpost: pareto_frontier.build(groups[outpost]) for outpost in groups}
+    candidate_frontier_version = catalog_version
 
-            return {"OnDemand": on_demand_costs, "Reserved": {"Heavy Utilization" : {"1yr": hu_one_costs, "3yr" : hu_three_costs}}}
-        else:
-            reserved_nu_costs = float(price_dict[pf][cluster]["costs"]["Reserved"]["No Upfront"]["1yr"]["Hrs"]) * hours_in_month # no upfront
-            reserved_pu_one_costs = float(price_dict[pf][cluster]["costs"]["Reserved"]["Partial Upfront"]["1yr"]["Hrs"]) * hours_in_month +  (float(price_dict[pf][cluster]["costs"]["Reserved"]["Partial Upfront"]["1yr"]["upfrontFee"]) / 12)# partial upfront 1 year
-            reserved_pu_three_costs = float(price_dict[pf][cluster]["costs"]["Reserved"]["Partial Upfront"]["3yr"]["Hrs"]) * hours_in_month + (float(price_dict[pf][cluster]["costs"]["Reserved"]["Partial Upfront"]["3yr"]["upfrontFee"]) / 36) # partial upfront 3 years
-            reserved_au_one_costs = float(price_dict[pf][cluster]["costs"]["Reserved"]["All Upfront"]["1yr"]["Hrs"]) * hours_in_month + (float(price_dict[pf][cluster]["costs"]["Reserved"]["All Upfront"]["1yr"]["upfrontFee"]) / 12) # all upfront 1 year
-            reserved_au_three_costs = float(price_dict[pf][cluster]["costs"]["Reserved"]["All Upfront"]["3yr"]["Hrs"]) * hours_in_month + (float(price_dict[pf][cluster]["costs"]["Reserved"]["All Upfront"]["3yr"]["upfrontFee"]) / 36) # all upfront 3 years
+    return candidate_frontier
 
-            return {"OnDemand": on_demand_costs, "Reserved": {"NoUpfront" : reserved_nu_costs, "PartialUpfront": {"1yr" : reserved_pu_one_costs, "3yr" : reserved_pu_three_costs}, "AllUpfront": {"1yr": reserved_au_one_costs, "3yr": reserved_au_three_costs}}}
-    return {"OnDemand": on_demand_costs}
+# Returns the candidate frontier, it is only rebuilt after a catalog reload
+def get_candidate_frontier():
+    if candidate_frontier_version != catalog_version:
+        build_candidate_frontier()
 
-# Returns a dictionary with possible clusters that are cheaper than given cluster
-def get_possible_clusters(memory, cpu_val, network_performance, outpost, costs):
+    return candidate_frontier
+
+# Returns a dictionary with the cheapest non-dominated clusters that are cheaper than given cluster and fulfill the given usage
+def get_possible_clusters(memory, cpu_val, network_performance, outpost, costs, limit=None):
     pf = "Cache Instance"
 
-    possible_cluster_keys = list(filter(lambda cluster: price_dict[pf][cluster]["memory"] >= memory
-                                     and price_dict[pf][cluster]["cpuVal"] >= cpu_val
-                                     and price_dict[pf][cluster]["networkPerformance"] >= network_performance
-                                     and price_dict[pf][cluster]["outpost"] == outpost
-                                     and price_dict[pf][cluster]["costs"]["OnDemand"]["Hrs"] <= costs,
-                                     price_dict[pf].keys()))
-    
+    if limit == None:
+        limit = recommendation_limit
+
     possible_candidates = dict()
+    frontier = get_candidate_frontier().get(outpost)
 
-    for key in possible_cluster_keys:
+    if frontier == None:
+        return possible_candidates
+
+    for key in pareto_frontier.query(frontier, memory, cpu_val, network_performance, costs, limit):
         cluster_type = price_dict[pf][key]["cacheNodeType"]
         prices = calculate_cluster_monthly_price(key)
 
@@ -186,16 +358,20 @@ def get_price_list(client, service_code, product_family):
     return price_list
 
 # init the price_dict, gets called in __init__.py at module initialization
+@tracing.traced("pricing.init_ec_price_dict")
 def init_ec_price_dict(client):
     global price_dict
+    global catalog_version
 
-    price_dict = dict()
+    new_price_dict = dict() # filled completely before it replaces the current catalog, jobs may read it concurrently
 
     # Handle RDS Service
     for pf in product_families:
-        price_dict[pf] = dict() # creating a dictionary for every product family to add items
+        new_price_dict[pf] = dict() # creating a dictionary for every product family to add items
 
-        price_list = get_price_list(client, "AmazonElastiCache", pf)
+        with tracing.span("pricing.get_products", serviceCode="AmazonElastiCache", productFamily=pf) as span:
+            price_list = get_price_list(client, "AmazonElastiCache", pf)
+            span["attributes"]["items"] = len(price_list)
 
         for price_item in price_list:
             price_item = json.loads(price_item) # load json string as json
@@ -213,7 +389,12 @@ def init_ec_price_dict(client):
             elif pf == "Storage Snapshot":
                 current_item = handle_storage_snapshot_item(product_attributes, terms)
 
-            price_dict[pf].update(current_item)
+            new_price_dict[pf].update(current_item)
+
+    price_dict = new_price_dict
+    catalog_version += 1
+    build_monthly_price_table()
+    build_candidate_frontier()
 
     return price_dict
 
@@ -0,0 +1,49 @@
+import bisect
+
+# pareto frontier of the rightsizing candidates, shared by the RDS instances and the cache clusters
+# an entry is a tuple (costs, memory, cpuVal, network performance, catalog key)
+
+# Returns the pareto frontier of the given entries, an entry is dropped if another one offers at least the same specs for less or equal costs
+# the frontier is sorted by costs and indexed by memory: per distinct memory value it keeps the cost sorted entries with at least that memory
+def build(entries):
+    entries = sorted(entries, key=lambda e: (e[0], -e[1], -e[2], -e[3]))
+    non_dominated = list()
+
+    for entry in entries:
+        # every entry before the current one is at most as expensive
+        if not any(f[1] >= entry[1] and f[2] >= entry[2] and f[3] >= entry[3] for f in non_dominated):
+            non_dominated.append(entry)
+
+    memory_levels = sorted(set(e[1] for e in non_dominated))
+    by_memory = [[e for e in non_dominated if e[1] >= level] for level in memory_levels]
+
+    return {
+        "costs": [e[0] for e in non_dominated],
+        "entries": non_dominated,
+        "memoryLevels": memory_levels,
+        "byMemory": by_memory,
+        "byMemoryCosts": [[e[0] for e in level_entries] for level_entries in by_memory]
+    }
+
+# Returns the catalog keys of the at most limit cheapest entries of given frontier that fulfill the given usage and cost at most the given costs
+# memory and costs are looked up with bisect, only the remaining candidates are checked for cpuVal and network performance
+def query(frontier, memory, cpu_val, network_performance, costs, limit):
+    level = bisect.bisect_left(frontier["memoryLevels"], memory)
+
+    if level == len(frontier["memoryLevels"]):
+        return list()
+
+    entries = frontier["byMemory"][level]
+    upper_bound = bisect.bisect_right(frontier["byMemoryCosts"][level], float(costs))
+    keys = list()
+
+    for index in range(upper_bound):
+        entry = entries[index]
+
+        if entry[2] >= cpu_val and entry[3] >= network_performance:
+            keys.append(entry[4])
+
+            if len(keys) >= limit:
+                break
+
+    return keys
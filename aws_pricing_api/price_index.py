@@ -0,0 +1,125 @@
+import datetime
+
+from aws_pricing_api import rds_pricing_api
+from aws_pricing_api import ec_pricing_api
+from aws_pricing_api import storage_optimizer
+
+# lookup indexes over both catalogs, rebuilt when a catalog is reloaded or the month rolls over
+index = None
+index_key = None
+
+storage_types = ["standard", "gp2", "gp3", "io1", "io2"]
+
+# Returns the key the index is valid for
+def get_index_key():
+    now = datetime.datetime.now()
+
+    return (rds_pricing_api.catalog_version, ec_pricing_api.catalog_version, now.year, now.month)
+
+# Returns true if both catalogs are loaded
+def is_loaded():
+    return rds_pricing_api.price_dict != None and ec_pricing_api.price_dict != None
+
+# Returns the price the given catalog function returns as float, 0 if the catalog has no such price
+def get_price_or_zero(function, *args):
+    try:
+        return float(function(*args) or 0)
+    except (KeyError, TypeError):
+        return 0.0
+
+# Builds the lookup indexes of instance types, cache node types and storage types
+def build_index():
+    global index
+    global index_key
+
+    key = get_index_key()
+    rds_table = rds_pricing_api.get_monthly_price_table()
+    ec_table = ec_pricing_api.get_monthly_price_table()
+
+    rds_instances = dict()
+    for usagetype, item in rds_pricing_api.price_dict["Database Instance"].items():
+        rds_instances[(item["instanceType"], item["deploymentOption"].lower())] = {
+            "service": "rds",
+            "instanceType": item["instanceType"],
+            "deployment": item["deploymentOption"],
+            "vcpu": item["vcpu"],
+            "memory": item["memory"],
+            "hourly": float(item["costs"]["OnDemand"]["Hrs"]),
+            "monthly": rds_table[usagetype]
+        }
+
+    ec_nodes = dict()
+    for usagetype, item in ec_pricing_api.price_dict["Cache Instance"].items():
+        ec_nodes[(item["cacheNodeType"], item["outpost"])] = {
+            "service": "ec",
+            "instanceType": item["cacheNodeType"],
+            "outpost": item["outpost"],
+            "vcpu": item["vcpu"],
+            "memory": item["memory"],
+            "hourly": float(item["costs"]["OnDemand"]["Hrs"]),
+            "monthly": ec_table[usagetype]
+        }
+
+    rds_storage = dict()
+    for storage_type in storage_types:
+        for multi_az in [False, True]:
+            deployment = rds_pricing_api.get_deployment_option(multi_az)
+            prices = storage_optimizer.get_storage_prices(storage_type, multi_az) or {} # by usagetype per storage type, IOPS and throughput are 0 if the type is not billed for them
+
+            rds_storage[(storage_type, deployment.lower())] = {
+                "service": "rds",
+                "storageType": storage_type,
+                "deployment": deployment,
+                "gbMonth": prices.get("gb") or get_price_or_zero(rds_pricing_api.get_database_storage_price, storage_type, multi_az),
+                "iopsMonth": prices.get("iops") or 0.0,
+                "throughputMonth": prices.get("throughput") or 0.0
+            }
+
+    index = {"rdsInstances": rds_instances, "ecNodes": ec_nodes, "rdsStorage": rds_storage}
+    index_key = key
+
+    return index
+
+# Returns the lookup indexes, they are only rebuilt if a catalog or the month changed
+def get_index():
+    if index_key != get_index_key():
+        build_index()
+
+    return index
+
+# Returns the price of the given lookup, a lookup is a dict with the keys
+# service (rds or ec), instanceType or storageType (rds only), deployment (rds, Single-AZ or Multi-AZ), outpost (ec) and term (OnDemand or Reserved)
+# raises a KeyError if nothing matches and a ValueError if the lookup is invalid, current_index defaults to the index of the loaded catalogs
+def lookup(query, current_index=None):
+    if current_index == None:
+        current_index = get_index()
+
+    service = str(query.get("service", "rds")).lower()
+    deployment = str(query.get("deployment", "Single-AZ")).lower()
+
+    if service == "rds" and "storageType" in query:
+        return current_index["rdsStorage"][(str(query["storageType"]).lower(), deployment)]
+
+    if "instanceType" not in query:
+        raise ValueError("instanceType or storageType is required")
+
+    if service == "rds":
+        result = current_index["rdsInstances"][(query["instanceType"], deployment)]
+    elif service == "ec":
+        outpost = str(query.get("outpost", "false")).lower() in ["true", "1", "yes"]
+        result = current_index["ecNodes"][(query["instanceType"], outpost)]
+    else:
+        raise ValueError(f"Unknown service {service}, use rds or ec")
+
+    term = query.get("term")
+
+    if term == None:
+        return result
+
+    if term not in ["OnDemand", "Reserved"]:
+        raise ValueError(f"Unknown term {term}, use OnDemand or Reserved")
+
+    filtered_result = dict(result)
+    filtered_result["monthly"] = {term: result["monthly"][term]}
+
+    return filtered_result
@@ -3,12 +3,32 @@ import datetime
 import calendar
 
 from aws_cloudwatch_api import rds_cloudwatch_api
+from exporter import tracing
 from .rds_utils import *
+from . import ri_coverage
+from . import pareto_frontier
 
 # write method to get product families?
 product_families = {"Database Instance", "Database Storage", "RDSProxy", "CPU Credits", "Provisioned IOPS", "System Operation", "Performance Insights", "Provisioned Throughput", "Storage Snapshot"}
 price_dict = None
 
+# aurora is billed per cluster for storage and I/O, its items are loaded into price_dict["Aurora"] keyed by usagetype
+aurora_product_families = {"Database Instance", "Database Storage", "System Operation", "ServerlessV2"}
+aurora_engine = "Aurora PostgreSQL"
+aurora_cluster_engines = ["aurora-postgresql"] # cluster engines the loaded aurora catalog prices, other clusters and their members are skipped
+cluster_key_prefix = "cluster:" # clusters are priced under their own keys, a cluster and an instance can have the same identifier
+aurora_io_optimized = "aurora-iopt1" # storage type of I/O-Optimized clusters
+
+# precomputed monthly costs per catalog version and month, see build_monthly_price_table
+catalog_version = 0
+monthly_price_table = None
+monthly_price_table_key = None
+
+# pareto frontier of the instances per deployment option, see build_candidate_frontier
+recommendation_limit = 3 # maximum number of recommended instances per instance
+candidate_frontier = None
+candidate_frontier_version = None
+
 # Returns the deployment option as a string
 def get_deployment_option(deployment_option):
     if deployment_option:
@@ -101,18 +121,136 @@ def get_database_storage_throughput_price(deployment_option):
 
     return price_dict["Provisioned Throughput"][deployment_option]["costs"]["MBPS-Mo"]
 
+# Returns the aurora catalog item of the given usage, usagetypes are prefixed with the region code like EUC1-Aurora:StorageUsage
+def get_aurora_item(usage):
+    for key in price_dict["Aurora"]:
+        if key == usage or key.endswith("-" + usage):
+            return price_dict["Aurora"][key]
+
+    return None
+
+# Returns the hourly OnDemand price of a provisioned aurora instance
+def get_aurora_instance_price(instance_type, io_optimized):
+    usage = f"InstanceUsageIOOptimized:{instance_type}" if io_optimized else f"InstanceUsage:{instance_type}"
+    item = get_aurora_item(usage)
+
+    if item == None:
+        return 0
+
+    return item["costs"]["OnDemand"]["Hrs"]
+
+# Returns the price per GB-Mo of aurora cluster storage
+def get_aurora_storage_price(io_optimized):
+    item = get_aurora_item("Aurora:IO-OptimizedStorageUsage" if io_optimized else "Aurora:StorageUsage")
+
+    return item["costs"]["GB-Mo"] if item != None else 0
+
+# Returns the price per I/O request of aurora cluster storage, I/O-Optimized clusters do not pay for I/O
+def get_aurora_io_price(io_optimized):
+    item = get_aurora_item("Aurora:StorageIOUsage")
+
+    if io_optimized or item == None:
+        return 0
+
+    return item["costs"]["IOs"]
+
+# Returns the price per ACU-Hr of aurora serverless v2
+def get_aurora_serverless_price(io_optimized):
+    item = get_aurora_item("Aurora:ServerlessV2IOOptimizedUsage" if io_optimized else "Aurora:ServerlessV2Usage")
+
+    return item["costs"]["ACU-Hr"] if item != None else 0
+
+# Returns true if given instance is an aurora instance, its storage is billed per cluster
+# members of Multi-AZ DB clusters have a cluster too, but provisioned storage like single instances
+def is_aurora(instance):
+    return (instance.get("engine") or "").startswith("aurora")
+
+# Returns the key of the prices of given aurora cluster
+def get_cluster_key(cluster):
+    return cluster_key_prefix + cluster
+
+# Returns a dictionary of the aurora members of the given instances and of the given clusters with their current price in the running month
+# as well as a forecast for the running month end costs, storage and I/O are billed per cluster and serverless v2 instances per ACU hour
+def calculate_aurora_prices(instances, clusters, enterprise_discount, cloudwatch_client):
+    prices = dict()
+
+    now = datetime.datetime.now()
+    total_hours_in_month = get_hours_in_month(now)
+    current_hours_of_month = (now.day - 1) * 24 + now.hour
+    month_factor = total_hours_in_month / max(current_hours_of_month, 1) # extrapolates the month to date usage
+
+    serverless_instances = [instance for instance in instances if instances[instance]["class"] == "db.serverless"]
+    usage, acu_hours = rds_cloudwatch_api.get_aurora_usage(cloudwatch_client, clusters, serverless_instances)
+
+    for instance in instances:
+        io_optimized = clusters[instances[instance]["cluster"]]["storageType"] == aurora_io_optimized
+
+        if instance in acu_hours:
+            instance_current = acu_hours[instance] * float(get_aurora_serverless_price(io_optimized))
+            instance_month = instance_current * month_factor
+        else:
+            # instances covered by reservations have a blended rate, see apply_rds_reservations
+            if "effectiveHourlyRate" in instances[instance]:
+                instance_price = instances[instance]["effectiveHourlyRate"]
+            else:
+                instance_price = float(get_aurora_instance_price(instances[instance]["class"], io_optimized))
+
+            instance_current = instance_price * current_hours_of_month
+            instance_month = instance_price * total_hours_in_month
+
+        prices[instance] = {"month": round(instance_month * (1 - enterprise_discount), 2), "current": round(instance_current * (1 - enterprise_discount), 2)}
+
+        if instance in acu_hours:
+            prices[instance]["components"] = {"compute": prices[instance]["month"]}
+            prices[instance]["usage"] = {"computeUnits": acu_hours[instance]}
+        else:
+            prices[instance]["components"] = {"instance": prices[instance]["month"]}
+
+    for cluster in clusters:
+        io_optimized = clusters[cluster]["storageType"] == aurora_io_optimized
+
+        storage_final = usage[cluster]["volumeGB"] * float(get_aurora_storage_price(io_optimized))
+        io_current = usage[cluster]["ios"] * float(get_aurora_io_price(io_optimized))
+
+        cluster_month = (storage_final + io_current * month_factor) * (1 - enterprise_discount)
+        cluster_current = (storage_final + io_current) * (1 - enterprise_discount)
+
+        components = {"storage": round(storage_final * (1 - enterprise_discount), 2), "io": round(io_current * month_factor * (1 - enterprise_discount), 2)}
+
+        prices[get_cluster_key(cluster)] = {"month": round(cluster_month, 2), "current": round(cluster_current, 2), "components": components, "usage": {"storageGB": usage[cluster]["volumeGB"], "ios": usage[cluster]["ios"]}}
+
+    return prices
+
 # Returns a dictionary of the given instances and their current price in the running month as well as a forecast for the running month end costs
-def calculate_rds_prices(instances, enterprise_discount, cloudwatch_client, rds_client):
+# aurora members of the given clusters are priced per cluster, see calculate_aurora_prices, clusters of engines without a loaded catalog are skipped
+def calculate_rds_prices(instances, enterprise_discount, cloudwatch_client, rds_client, clusters=None):
     prices = dict()
     total_month = 0
     total_current = 0
 
     now = datetime.datetime.now()
-    total_days_in_month = calendar.monthrange(now.year, now.month)[1]
-    total_hours_in_month = total_days_in_month * 24
+    total_hours_in_month = get_hours_in_month(now)
     current_hours_of_month = (now.day - 1) * 24 + now.hour
 
+    if clusters == None:
+        clusters = dict()
+
+    priced_clusters = dict()
+    for cluster in clusters:
+        if clusters[cluster]["engine"] in aurora_cluster_engines:
+            priced_clusters[cluster] = clusters[cluster]
+        else:
+            print(f"[WARN] Aurora cluster {cluster} is not priced, there is no catalog loaded for its engine {clusters[cluster]['engine']}")
+
+    aurora_instances = {instance: instances[instance] for instance in instances if instances[instance].get("cluster") in priced_clusters}
+
+    if priced_clusters:
+        prices.update(calculate_aurora_prices(aurora_instances, priced_clusters, enterprise_discount, cloudwatch_client))
+
     for instance in instances:
+        if instances[instance].get("cluster") in clusters: # priced with their cluster or skipped with it
+            continue
+
         deployment = instances[instance]["deployment"]
         storage = instances[instance]["storage"]
         storage_type = instances[instance]["storageType"]
@@ -120,8 +258,11 @@ def calculate_rds_prices(instances, enterprise_discount, cloudwatch_client, rds_
         storage_throughput = instances[instance]["storageThroughput"]
         iops = instances[instance]["iops"]
 
-        # get the prices
-        instance_price = float(get_database_instance_price(instances[instance]["class"], deployment, instances[instance]["term"]))
+        # get the prices, instances covered by reservations have a blended rate, see apply_rds_reservations
+        if "effectiveHourlyRate" in instances[instance]:
+            instance_price = instances[instance]["effectiveHourlyRate"]
+        else:
+            instance_price = float(get_database_instance_price(instances[instance]["class"], deployment, instances[instance]["term"]))
         storage_price = float(get_database_storage_price(storage_type, deployment))
         backup_price = float(get_database_backup_storage_price())
         storage_throughput_price = float(get_database_storage_throughput_price(deployment))
@@ -134,7 +275,8 @@ def calculate_rds_prices(instances, enterprise_discount, cloudwatch_client, rds_
         iops_final = iops * iops_price
 
         provisioned_storage = rds_cloudwatch_api.get_cloudwatch_provisioned_storage_space(cloudwatch_client, instance, storage)
-        snapshot_storage_price = rds_cloudwatch_api.get_snapshot_storage(rds_client, instance) * backup_price
+        snapshot_storage = rds_cloudwatch_api.get_snapshot_storage(rds_client, instance)
+        snapshot_storage_price = snapshot_storage * backup_price
 
         storage_current = provisioned_storage * storage_price
         instance_current = instance_price * current_hours_of_month
@@ -145,50 +287,142 @@ def calculate_rds_prices(instances, enterprise_discount, cloudwatch_client, rds_
         instance_month = round(instance_month, 2)
         instance_current = round(instance_current, 2)
         
-        prices[instance] = {"month": instance_month, "current": instance_current}
+        # the monthly cost components and usage aggregates are kept for the history export, see history_export
+        components = {"instance": instance_final, "storage": storage_final, "throughput": storage_throughput_final, "iops": iops_final, "snapshot": snapshot_storage_price}
+        components = {component: round(components[component] * (1 - enterprise_discount), 2) for component in components}
+
+        prices[instance] = {"month": instance_month, "current": instance_current, "components": components, "usage": {"storageGB": provisioned_storage, "snapshotGB": snapshot_storage}}
         total_month += instance_month
         total_current += instance_current
 
+    aurora_resources = list(aurora_instances) + [get_cluster_key(cluster) for cluster in priced_clusters]
+    total_month += sum(prices[resource]["month"] for resource in aurora_resources)
+    total_current += sum(prices[resource]["current"] for resource in aurora_resources)
+
     prices["totalMonth"] = round(total_month, 2)
     prices["totalCurrent"] = round(total_current, 2)
 
     return prices
 
+# Returns the number of hours of the given (or running) month
+def get_hours_in_month(now=None):
+    if now == None:
+        now = datetime.datetime.now()
+
+    total_days_in_month = calendar.monthrange(now.year, now.month)[1]
+
+    return total_days_in_month * 24
+
+# Returns the monthly costs without any discounts of a given price item, OnDemand and all the Reserved options
+def build_instance_monthly_price(item, hours_in_month):
+    costs = item["costs"]
+    on_demand_costs = float(costs["OnDemand"]["Hrs"]) * hours_in_month
+
+    if costs["Reserved"] == None:
+        return {"OnDemand": on_demand_costs, "Reserved": None}
+
+    try:
+        reserved = costs["Reserved"]
+        reserved_nu_costs = float(reserved["No Upfront"]["1yr"]["Hrs"]) * hours_in_month # no upfront
+        reserved_pu_one_costs = float(reserved["Partial Upfront"]["1yr"]["Hrs"]) * hours_in_month + (float(reserved["Partial Upfront"]["1yr"]["upfrontFee"]) / 12) # partial upfront 1 year
+        reserved_pu_three_costs = float(reserved["Partial Upfront"]["3yr"]["Hrs"]) * hours_in_month + (float(reserved["Partial Upfront"]["3yr"]["upfrontFee"]) / 36) # partial upfront 3 years
+        reserved_au_one_costs = float(reserved["All Upfront"]["1yr"]["Hrs"]) * hours_in_month + (float(reserved["All Upfront"]["1yr"]["upfrontFee"]) / 12) # all upfront 1 year
+        reserved_au_three_costs = float(reserved["All Upfront"]["3yr"]["Hrs"]) * hours_in_month + (float(reserved["All Upfront"]["3yr"]["upfrontFee"]) / 36) # all upfront 3 years
+    except KeyError:
+        # not every instance type is offered with every reserved option
+        return {"OnDemand": on_demand_costs, "Reserved": None}
+
+    return {"OnDemand": on_demand_costs, "Reserved": {"NoUpfront" : reserved_nu_costs, "PartialUpfront": {"1yr" : reserved_pu_one_costs, "3yr" : reserved_pu_three_costs}, "AllUpfront": {"1yr": reserved_au_one_costs, "3yr": reserved_au_three_costs}}}
+
+# Builds the monthly price table of all database instances for the loaded catalog and the running month
+def build_monthly_price_table(now=None):
+    global monthly_price_table
+    global monthly_price_table_key
+
+    pf = "Database Instance"
+
+    if now == None:
+        now = datetime.datetime.now()
+
+    hours_in_month = get_hours_in_month(now)
+    table = dict()
+
+    for instance in price_dict[pf]:
+        table[instance] = build_instance_monthly_price(price_dict[pf][instance], hours_in_month)
+
+    monthly_price_table = table
+    monthly_price_table_key = (catalog_version, now.year, now.month)
+
+    return monthly_price_table
+
+# Returns the monthly price table, it is only rebuilt after a catalog reload or at month rollover
+def get_monthly_price_table():
+    now = datetime.datetime.now()
+
+    if monthly_price_table_key != (catalog_version, now.year, now.month):
+        build_monthly_price_table(now)
+
+    return monthly_price_table
+
+# Returns copies of the given instances with the reserved db instances applied, size flexible per instance family like AWS applies them
+# the uncovered share of aurora members of the given clusters is priced at the aurora rate of their cluster's storage type
+def apply_rds_reservations(instances, reserved_instances, clusters=None):
+    if clusters == None:
+        clusters = dict()
+
+    def on_demand_price(instance):
+        if instance.get("cluster") in clusters:
+            return get_aurora_instance_price(instance["class"], clusters[instance["cluster"]]["storageType"] == aurora_io_optimized)
+
+        return get_database_instance_price(instance["class"], instance["deployment"], "OnDemand")
+
+    return ri_coverage.apply_reservations(instances, reserved_instances, on_demand_price, "class", "deployment", "engine")
+
 # Returns the monthly price without any discounts of a given instance
 def calculate_instance_monhtly_price(instance):
+    return get_monthly_price_table()[instance]
+
+# Builds the pareto frontier over memory, cpuVal, network performance and OnDemand costs of all database instances per deployment option
+# an instance is dropped if another instance offers at least the same specs for less or equal costs, see pareto_frontier.build
+def build_candidate_frontier():
+    global candidate_frontier
+    global candidate_frontier_version
+
     pf = "Database Instance"
+    groups = dict()
 
-    now = datetime.datetime.now()
-    total_days_in_month = calendar.monthrange(now.year, now.month)[1]
-    hours_in_month = total_days_in_month * 24
-    on_demand_costs = float(price_dict[pf][instance]["costs"]["OnDemand"]["Hrs"]) * hours_in_month
+    for key in price_dict[pf]:
+        item = price_dict[pf][key]
+        entry = (float(item["costs"]["OnDemand"]["Hrs"]), item["memory"], item["cpuVal"], item["networkPerformance"], key)
+        groups.setdefault(item["deploymentOption"], []).append(entry)
 
-    if price_dict[pf][instance]["costs"]["Reserved"] != None:
-        reserved_nu_costs = float(price_dict[pf][instance]["costs"]["Reserved"]["No Upfront"]["1yr"]["Hrs"]) * hours_in_month # no upfront
-        reserved_pu_one_costs = float(price_dict[pf][instance]["costs"]["Reserved"]["Partial Upfront"]["1yr"]["Hrs"]) * hours_in_month + (float(price_dict[pf][instance]["costs"]["Reserved"]["Partial Upfront"]["1yr"]["upfrontFee"]) / 12)# partial upfront 1 year
-        reserved_pu_three_costs = float(price_dict[pf][instance]["costs"]["Reserved"]["Partial Upfront"]["3yr"]["Hrs"]) * hours_in_month + (float(price_dict[pf][instance]["costs"]["Reserved"]["Partial Upfront"]["3yr"]["upfrontFee"]) / 36) # partial upfront 3 years
-        reserved_au_one_costs = float(price_dict[pf][instance]["costs"]["Reserved"]["All Upfront"]["1yr"]["Hrs"]) * hours_in_month + (float(price_dict[pf][instance]["costs"]["Reserved"]["All Upfront"]["1yr"]["upfrontFee"]) / 12) # all upfront 1 year
-        reserved_au_three_costs = float(price_dict[pf][instance]["costs"]["Reserved"]["All Upfront"]["3yr"]["Hrs"]) * hours_in_month + (float(price_dict[pf][instance]["costs"]["Reserved"]["All Upfront"]["3yr"]["upfrontFee"]) / 36) # all upfront 3 years
+    candidate_frontier = {deployment_option: pareto_frontier.build(groups[deployment_option]) for deployment_option in groups}
+    candidate_frontier_version = catalog_version
 
-        return {"OnDemand": on_demand_costs, "Reserved": {"NoUpfront" : reserved_nu_costs, "PartialUpfront": {"1yr" : reserved_pu_one_costs, "3yr" : reserved_pu_three_costs}, "AllUpfront": {"1yr": reserved_au_one_costs, "3yr": reserved_au_three_costs}}}
-    return {"OnDemand": on_demand_costs}
+    return candidate_frontier
 
-# Returns a dictionary with possible instances that are cheaper than given instance
-def get_possible_instances(memory, cpu_val, network_performance, deployment_option, costs, iops=0):
+# Returns the candidate frontier, it is only rebuilt after a catalog reload
+def get_candidate_frontier():
+    if candidate_frontier_version != catalog_version:
+        build_candidate_frontier()
+
+    return candidate_frontier
+
+# Returns a dictionary with the cheapest non-dominated instances that are cheaper than given instance and fulfill the given usage
+def get_possible_instances(memory, cpu_val, network_performance, deployment_option, costs, limit=None):
     pf = "Database Instance"
     deployment_option = get_deployment_option(deployment_option)
 
-    possible_instance_keys = list(filter(lambda instance: price_dict[pf][instance]["memory"] >= memory
-                                     and price_dict[pf][instance]["cpuVal"] >= cpu_val
-                                     and price_dict[pf][instance]["networkPerformance"] >= network_performance
-                                     and price_dict[pf][instance]["deploymentOption"] == deployment_option
-                                     and price_dict[pf][instance]["costs"]["OnDemand"]["Hrs"] <= costs
-                                     and price_dict[pf].get(instance, {}).get("iops", float("inf")) >= iops, # this is how an optional dimension can be added to the filtering
-                                     price_dict[pf].keys()))
-    
+    if limit == None:
+        limit = recommendation_limit
+
     possible_candidates = dict()
+    frontier = get_candidate_frontier().get(deployment_option)
 
-    for key in possible_instance_keys:
+    if frontier == None:
+        return possible_candidates
+
+    for key in pareto_frontier.query(frontier, memory, cpu_val, network_performance, costs, limit):
         instance_type = price_dict[pf][key]["instanceType"]
         prices = calculate_instance_monhtly_price(key)
 
@@ -208,7 +442,7 @@ def get_resource_keys(resource_type, deployment_option, pf):
     return filtered_keys
 
 # Returns the complete pricing information of a given AWS service
-def get_price_list(client, service_code, product_family):
+def get_price_list(client, service_code, product_family, database_engine="PostgreSQL"):
     price_list = []
 
     next_token = None
@@ -225,7 +459,7 @@ def get_price_list(client, service_code, product_family):
                     {
                         'Type': 'TERM_MATCH',
                         'Field': 'databaseEngine',
-                        'Value': "PostgreSQL"
+                        'Value': database_engine
                     },
                     {
                         'Type': 'TERM_MATCH',
@@ -247,7 +481,7 @@ def get_price_list(client, service_code, product_family):
                     {
                         'Type': 'TERM_MATCH',
                         'Field': 'databaseEngine',
-                        'Value': "PostgreSQL"
+                        'Value': database_engine
                     },
                     {
                         'Type': 'TERM_MATCH',
@@ -267,16 +501,20 @@ def get_price_list(client, service_code, product_family):
     return price_list
 
 # init the price_dict, gets called in __init__.py at module initialization
+@tracing.traced("pricing.init_rds_price_dict")
 def init_rds_price_dict(client):
     global price_dict
+    global catalog_version
 
-    price_dict = dict()
+    new_price_dict = dict() # filled completely before it replaces the current catalog, jobs may read it concurrently
 
     # Handle RDS Service
     for pf in product_families:
-        price_dict[pf] = dict() # creating a dictionary for every product family to add items
+        new_price_dict[pf] = dict() # creating a dictionary for every product family to add items
 
-        price_list = get_price_list(client, "AmazonRDS", pf)
+        with tracing.span("pricing.get_products", serviceCode="AmazonRDS", productFamily=pf) as span:
+            price_list = get_price_list(client, "AmazonRDS", pf)
+            span["attributes"]["items"] = len(price_list)
 
         for price_item in price_list:
             price_item = json.loads(price_item) # load json string as json
@@ -304,7 +542,33 @@ def init_rds_price_dict(client):
             elif pf == "Database Instance":
                 current_item = handle_database_instance_item(product_attributes, terms)
 
-            price_dict[pf].update(current_item)
+            new_price_dict[pf].update(current_item)
+
+    # Handle Aurora, storage, I/O and serverless v2 items are generic usage prices
+    new_price_dict["Aurora"] = dict()
+
+    for pf in aurora_product_families:
+        with tracing.span("pricing.get_products", serviceCode="AmazonRDS", productFamily=pf, databaseEngine=aurora_engine) as span:
+            price_list = get_price_list(client, "AmazonRDS", pf, aurora_engine)
+            span["attributes"]["items"] = len(price_list)
+
+        for price_item in price_list:
+            price_item = json.loads(price_item) # load json string as json
+
+            product_attributes = price_item["product"]["attributes"]
+            terms = price_item["terms"]
+
+            if pf == "Database Instance":
+                current_item = handle_database_instance_item(product_attributes, terms)
+            else:
+                current_item = handle_aurora_usage_item(product_attributes, terms)
+
+            new_price_dict["Aurora"].update(current_item)
+
+    price_dict = new_price_dict
+    catalog_version += 1
+    build_monthly_price_table()
+    build_candidate_frontier()
 
     return price_dict
 
@@ -108,6 +108,14 @@ def handle_system_operation_item(product_attributes, terms):
 
     return {group : get_price_per_unit(on_demand_term)}
 
+# Returns a dictionary containing all the necessary information for a given aurora storage, I/O or serverless v2 item
+def handle_aurora_usage_item(product_attributes, terms):
+    on_demand_term = terms["OnDemand"] # there is just the OnDemand term for these usages
+
+    usagetype = product_attributes["usagetype"]
+
+    return {usagetype : {"costs" : get_price_per_unit(on_demand_term)}}
+
 # Returns a dictionary containing all the necessary information for a given database instance item
 def handle_database_instance_item(product_attributes, terms):
     on_demand_term = terms["OnDemand"]  
@@ -0,0 +1,140 @@
+import math
+
+from aws_pricing_api import rds_pricing_api
+from aws_pricing_api import ec_pricing_api
+from aws_pricing_api import ri_coverage
+
+hours_per_year = 8760
+allowed_terms = ["1yr", "3yr"] # contract lengths the optimizer may buy
+rds_catalog_products = ["postgresql"] # the Database Instance catalog is loaded for PostgreSQL only, see rds_pricing_api.get_price_list
+
+# Returns the catalog items of given service, product and family (or instance class for pools that are not size flexible)
+# products without a loaded catalog have no items, their pools are skipped
+def get_family_items(service, product, family):
+    if service == "rds":
+        if product not in rds_catalog_products:
+            return list()
+
+        items = rds_pricing_api.price_dict["Database Instance"].values()
+        return [(item["instanceType"], item) for item in items if item["deploymentOption"] == "Single-AZ" and family in [item["instanceType"], ri_coverage.get_instance_family(item["instanceType"])]]
+
+    items = ec_pricing_api.price_dict["Cache Instance"].values()
+    return [(item["cacheNodeType"], item) for item in items if not item["outpost"] and item["cacheEngine"].lower() == product and family in [item["cacheNodeType"], ri_coverage.get_instance_family(item["cacheNodeType"])]]
+
+# Returns the units of one instance of given class, the same units ri_coverage.get_pool counts the demand in
+def get_class_units(instance_class, product):
+    units = ri_coverage.get_normalized_units(instance_class)
+
+    if not ri_coverage.is_size_flexible(product) or units == None:
+        return 1 # pools that are not size flexible count instances
+
+    return units
+
+# Returns the OnDemand rate per unit, the purchasable classes and the reservation options of a family, every option with its effective hourly rate per unit
+def get_family_options(service, product, family):
+    on_demand_rates = list()
+    classes = list()
+    options = dict()
+
+    for instance_class, item in get_family_items(service, product, family):
+        units = get_class_units(instance_class, product)
+        on_demand_rates.append(float(item["costs"]["OnDemand"]["Hrs"]) / units)
+
+        reserved = item["costs"]["Reserved"]
+        if reserved == None:
+            continue
+
+        classes.append((units, instance_class))
+
+        for payment_option in reserved:
+            for term in reserved[payment_option]:
+                if term not in allowed_terms:
+                    continue
+
+                prices = reserved[payment_option][term]
+                term_hours = int(term[0]) * hours_per_year
+                hourly_rate = float(prices.get("Hrs", 0)) + float(prices.get("upfrontFee", 0)) / term_hours
+
+                # sizes of a family are priced linearly, the cheapest size per unit is taken
+                option_rate = hourly_rate / units
+                if (term, payment_option) not in options or option_rate < options[(term, payment_option)]:
+                    options[(term, payment_option)] = option_rate
+
+    if len(on_demand_rates) == 0:
+        return None, classes, options
+
+    return min(on_demand_rates), classes, options
+
+# Returns the number of reservations per class that add up to the given units, largest classes first
+def decompose_units(units, classes):
+    purchases = list()
+
+    for class_units, instance_class in sorted(classes, reverse=True):
+        count = int(units // class_units)
+
+        if count > 0:
+            purchases.append({"class": instance_class, "count": count})
+            units -= count * class_units
+
+    return purchases
+
+# Returns the reserved units that minimize the expected costs of the given hourly demand
+# the k-th unit pays off if it is used in more than rate / on_demand_rate of the hours, so the optimum is a quantile of the sorted demand
+def get_optimal_units(sorted_demand, rate, on_demand_rate):
+    hours = len(sorted_demand)
+    break_even_hours = math.floor(hours * rate / on_demand_rate)
+
+    if break_even_hours >= hours:
+        return 0
+
+    return sorted_demand[break_even_hours] # sorted descending, this level is used in more than break_even_hours hours
+
+# Returns the expected hourly costs of the given demand with the given reserved units
+def get_expected_hourly_costs(demand, units, rate, on_demand_rate):
+    on_demand_units = sum(max(0, hourly_units - units) for hourly_units in demand)
+
+    return units * rate + on_demand_rate * on_demand_units / len(demand)
+
+# Returns the cheapest purchase for the given pool and its hourly demand in normalized units
+def optimize_pool(service, product, family, demand):
+    on_demand_rate, classes, options = get_family_options(service, product, family)
+
+    if on_demand_rate == None or len(options) == 0 or len(demand) == 0:
+        return None
+
+    sorted_demand = sorted(demand, reverse=True)
+    smallest_units = min(class_units for class_units, instance_class in classes)
+    on_demand_costs = on_demand_rate * sum(demand) / len(demand)
+
+    best_plan = None
+    for (term, payment_option), rate in options.items():
+        units = get_optimal_units(sorted_demand, rate, on_demand_rate)
+        units = math.floor(units / smallest_units) * smallest_units # only whole reservations can be bought
+
+        if units <= 0:
+            continue
+
+        expected_costs = get_expected_hourly_costs(demand, units, rate, on_demand_rate)
+
+        if best_plan == None or expected_costs < best_plan["expectedHourlyCosts"]:
+            best_plan = {"service": service, "product": product, "family": family, "term": term, "paymentOption": payment_option, "units": units,
+                         "purchases": decompose_units(units, classes), "onDemandHourlyCosts": on_demand_costs, "expectedHourlyCosts": expected_costs}
+
+    if best_plan != None:
+        hours_in_month = rds_pricing_api.get_hours_in_month()
+        best_plan["expectedMonthlySavings"] = (best_plan["onDemandHourlyCosts"] - best_plan["expectedHourlyCosts"]) * hours_in_month
+
+    return best_plan
+
+# Returns the purchase plans of all pools, demand maps (service, region, product, family) to the hourly units of the lookback window
+def optimize(demand):
+    plans = list()
+
+    for service, region, product, family in demand:
+        plan = optimize_pool(service, product, family, demand[(service, region, product, family)])
+
+        if plan != None:
+            plan["region"] = region
+            plans.append(plan)
+
+    return sorted(plans, key=lambda plan: plan["expectedMonthlySavings"], reverse=True)
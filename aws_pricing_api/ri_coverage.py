@@ -0,0 +1,138 @@
+import re
+
+# normalization factors of the instance sizes, a reservation covers any size of its family with the same number of units
+size_units = {"nano": 0.25, "micro": 0.5, "small": 1, "medium": 2, "large": 4, "xlarge": 8}
+
+# engine names of the instances mapped to the product description of the reservations
+engine_products = {"postgres": "postgresql", "aurora": "aurora-mysql"}
+
+# Returns the normalized units of given instance class, e.g. db.m5.2xlarge -> 16
+def get_normalized_units(instance_class):
+    size = instance_class.split(".")[-1]
+
+    if size in size_units:
+        return size_units[size]
+
+    match = re.match(r"(\d+)xlarge$", size)
+    if match:
+        return int(match.group(1)) * size_units["xlarge"]
+
+    return None # e.g. metal sizes, they are not size flexible
+
+# Returns the family of given instance class, e.g. db.m5.2xlarge -> db.m5
+def get_instance_family(instance_class):
+    return instance_class.rsplit(".", 1)[0]
+
+# Returns true if reservations of the given product apply to every size of their family
+def is_size_flexible(product):
+    return "sqlserver" not in product and "(li)" not in product
+
+# Returns the product description reservations of given engine have
+def get_product(engine):
+    engine = (engine or "").lower()
+
+    return engine_products.get(engine, engine)
+
+# Returns the pool key a reservation or instance belongs to and its normalized units
+# size flexible resources are pooled per family, all others per instance class
+def get_pool(instance_class, product, multi_az, region):
+    units = get_normalized_units(instance_class)
+
+    if is_size_flexible(product) and units != None:
+        pool = (region, product, get_instance_family(instance_class))
+    else:
+        pool = (region, product, instance_class)
+        units = 1
+
+    if multi_az:
+        units *= 2 # a Multi-AZ deployment consumes and a Multi-AZ reservation provides twice the units
+
+    return pool, units
+
+# Returns the effective hourly rate of one reserved instance, the upfront fee is amortized over the term
+def get_reserved_hourly_rate(reservation):
+    hourly_rate = float(reservation["usagePrice"])
+
+    for charge in reservation["recurringCharges"]:
+        if charge.get("RecurringChargeFrequency") == "Hourly":
+            hourly_rate += float(charge["RecurringChargeAmount"])
+
+    term_hours = reservation["duration"] / 3600
+
+    if term_hours > 0:
+        hourly_rate += float(reservation["fixedPrice"]) / term_hours
+
+    return hourly_rate
+
+# Returns the reserved units and their average hourly rate per unit per pool
+def build_reservation_pools(reservations, region):
+    pools = dict()
+
+    for reservation in reservations:
+        pool, units = get_pool(reservation["class"], get_product(reservation["product"]), reservation["multiAZ"], region)
+        units *= reservation["count"]
+
+        entry = pools.setdefault(pool, {"units": 0, "costs": 0})
+        entry["units"] += units
+        entry["costs"] += get_reserved_hourly_rate(reservation) * reservation["count"]
+
+    for pool in pools:
+        pools[pool]["rate"] = pools[pool]["costs"] / pools[pool]["units"] if pools[pool]["units"] > 0 else 0
+
+    return pools
+
+# Applies the reservations to the given resources the way AWS does, per pool starting with the smallest resources
+# returns copies of the resources with the covered fraction ("riCoverage") and the blended hourly rate ("effectiveHourlyRate")
+# class_key, multi_az_key and engine_key are the names of the resource fields, on_demand_price returns the hourly OnDemand price of a resource
+# a resource of several nodes (cache clusters) needs the units of all its nodes, its rate stays per node
+def apply_reservations(resources, reservations, on_demand_price, class_key, multi_az_key, engine_key, region="eu-central-1"):
+    pools = build_reservation_pools(reservations, region)
+    covered_resources = dict()
+    pooled_resources = dict()
+
+    for name in resources:
+        resource = dict(resources[name])
+        pool, units = get_pool(resource[class_key], get_product(resource.get(engine_key)), resource.get(multi_az_key, False), region)
+        units *= resource.get("nodes", 1)
+
+        resource["riCoverage"] = 0.0
+        resource["normalizedUnits"] = units
+        covered_resources[name] = resource
+
+        if pool in pools:
+            pooled_resources.setdefault(pool, []).append((units, name))
+
+    for pool in pooled_resources:
+        remaining_units = pools[pool]["units"]
+        rate = pools[pool]["rate"]
+
+        for units, name in sorted(pooled_resources[pool]):
+            if remaining_units <= 0:
+                break
+
+            resource = covered_resources[name]
+            covered_units = min(units, remaining_units)
+            coverage = covered_units / units
+            remaining_units -= covered_units
+
+            resource["riCoverage"] = coverage
+            resource["effectiveHourlyRate"] = covered_units * rate / resource.get("nodes", 1) + (1 - coverage) * float(on_demand_price(resource))
+
+            if coverage >= 1:
+                resource["term"] = "Reserved"
+
+    return covered_resources
+
+# Returns the share of normalized units of the given resources that is covered by reservations, see apply_reservations
+def get_coverage(resources):
+    total_units = 0
+    covered_units = 0
+
+    for name in resources:
+        total_units += resources[name]["normalizedUnits"]
+        covered_units += resources[name]["normalizedUnits"] * resources[name]["riCoverage"]
+
+    if total_units == 0:
+        return 0.0
+
+    return covered_units / total_units
@@ -0,0 +1,206 @@
+import fnmatch
+
+from aws_pricing_api import price_index
+from aws_pricing_api import ri_coverage
+from aws_pricing_api import storage_optimizer
+
+# what-if simulation of the fleet's monthly OnDemand costs, the scenarios are priced from the loaded catalogs without any AWS calls
+# a scenario is {"name": str, "rules": [{"match": {...}, "set": {...}}, ...]}, every matching rule of a scenario is applied in order
+# match compares the fields below with a glob pattern or a list of values, e.g. {"service": "rds", "family": "db.m5", "stage": ["dev", "int"]}
+match_fields = ["account", "team", "stage", "service", "resource", "class", "family", "deployment", "storageType", "engine"]
+set_fields = ["class", "family", "deployment", "storageType"] # set the family to move every size of a family, e.g. {"family": "db.m6g"}
+max_scenarios = 50
+
+# Returns a simulation row of given RDS instance, the rows of all resources are the columns the scenarios are evaluated on
+def build_rds_row(account, team, stage, resource, instance):
+    return {
+        "account": account, "team": team, "stage": stage, "service": "rds", "resource": resource,
+        "class": instance["class"], "deployment": rds_deployment(instance["deployment"]), "engine": instance.get("engine"),
+        "storageType": instance["storageType"], "storage": instance["storage"], "iops": instance["iops"], "throughput": instance["storageThroughput"], "nodes": 1
+    }
+
+# Returns a simulation row of given cache cluster
+def build_ec_row(account, team, stage, resource, cluster):
+    return {
+        "account": account, "team": team, "stage": stage, "service": "ec", "resource": resource,
+        "class": cluster["cacheNodeType"], "deployment": rds_deployment(cluster.get("multiAZ")), "engine": cluster.get("engine"),
+        "storageType": None, "outpost": cluster["outpost"], "nodes": cluster.get("nodes", 1)
+    }
+
+# Returns the deployment option name of given multi-az flag
+def rds_deployment(multi_az):
+    return "Multi-AZ" if multi_az else "Single-AZ"
+
+# Returns the value of given match field of a row
+def get_field(row, field):
+    if field == "family":
+        return ri_coverage.get_instance_family(row["class"])
+
+    return row.get(field)
+
+# Returns true if the row matches all the conditions of given rule
+def matches(row, conditions):
+    for field, pattern in conditions.items():
+        value = str(get_field(row, field))
+
+        if isinstance(pattern, list):
+            if value not in [str(item) for item in pattern]:
+                return False
+        elif not fnmatch.fnmatchcase(value, str(pattern)):
+            return False
+
+    return True
+
+# Returns true if given value can be compared in a match, a glob pattern, a number or a boolean
+def is_match_value(value):
+    return isinstance(value, (str, int, float, bool))
+
+# Returns the given rules validated, raises a ValueError for unknown fields and values of the wrong type
+def validate_rules(rules):
+    if not isinstance(rules, list):
+        raise ValueError("The rules of a scenario must be a list")
+
+    for rule in rules:
+        if not isinstance(rule, dict) or not isinstance(rule.get("match", {}), dict) or not isinstance(rule.get("set"), dict):
+            raise ValueError("Every rule must be an object with an optional match object and a set object")
+
+        unknown = (set(rule.get("match", {})) - set(match_fields)) | (set(rule["set"]) - set(set_fields))
+
+        if unknown:
+            raise ValueError(f"Unknown rule fields {sorted(unknown)}, match one of {match_fields} and set one of {set_fields}")
+
+        if not rule["set"]:
+            raise ValueError("Every rule needs a set")
+
+        for field, pattern in rule.get("match", {}).items():
+            if not (is_match_value(pattern) or (isinstance(pattern, list) and all(is_match_value(item) for item in pattern))):
+                raise ValueError(f"The match of {field} must be a pattern or a list of values")
+
+        for field, value in rule["set"].items():
+            if not isinstance(value, str) or value == "":
+                raise ValueError(f"The set of {field} must be a non-empty string")
+
+    return rules
+
+# Returns the given scenarios validated, raises a ValueError for scenarios of the wrong shape
+def validate_scenarios(scenarios):
+    if not isinstance(scenarios, list):
+        raise ValueError("The scenarios must be a list")
+
+    if len(scenarios) > max_scenarios:
+        raise ValueError(f"at most {max_scenarios} scenarios per simulation")
+
+    for scenario in scenarios:
+        if not isinstance(scenario, dict):
+            raise ValueError("Every scenario must be an object with a name and a list of rules")
+
+        if not isinstance(scenario.get("name", ""), str):
+            raise ValueError("The name of a scenario must be a string")
+
+        validate_rules(scenario.get("rules", []))
+
+    return scenarios
+
+# Returns a copy of given row with the matching rules applied
+def transform(row, rules):
+    transformed = row
+
+    for rule in rules:
+        if not matches(transformed, rule.get("match", {})):
+            continue
+
+        transformed = dict(transformed)
+
+        for field, value in rule["set"].items():
+            if field == "family": # keeps the size, e.g. db.m5.2xlarge -> db.m6g.2xlarge
+                transformed["class"] = f"{value}.{transformed['class'].rsplit('.', 1)[-1]}"
+            else:
+                transformed[field] = value
+
+    return transformed
+
+# Returns the key of the price of given row, rows with the same key have the same monthly costs
+def get_price_key(row):
+    if row["service"] == "ec":
+        return ("ec", row["class"], row["outpost"], row["nodes"])
+
+    return ("rds", row["class"], row["deployment"], row["storageType"], row["storage"], row["iops"], row["throughput"])
+
+# Returns the monthly OnDemand costs of given row, raises a KeyError if the catalog has no price for it
+def get_monthly_costs(row, index):
+    if row["service"] == "ec":
+        node = index["ecNodes"][(row["class"], row["outpost"])]
+        return node["monthly"]["OnDemand"] * row["nodes"]
+
+    instance = index["rdsInstances"][(row["class"], row["deployment"].lower())]
+
+    # the provisioned IOPS and throughput beyond the baseline of the storage type are billed at the prices of the type, see storage_optimizer
+    storage = storage_optimizer.get_current_configuration({"storageType": row["storageType"], "storage": row["storage"], "iops": row["iops"], "storageThroughput": row["throughput"]})
+    storage_costs = storage_optimizer.get_monthly_costs(storage, storage_optimizer.get_storage_prices(storage["storageType"], row["deployment"] == "Multi-AZ"))
+
+    if storage_costs == None:
+        raise KeyError(row["storageType"])
+
+    return instance["monthly"]["OnDemand"] + storage_costs
+
+# Returns the baseline and every scenario's monthly costs of the given rows with per resource deltas
+# all scenarios are evaluated in one pass over the rows, every distinct configuration is priced once
+def simulate(rows, scenarios, enterprise_discount=0):
+    validate_scenarios(scenarios)
+
+    index = price_index.get_index()
+    price_cache = dict()
+
+    def get_costs(row):
+        key = get_price_key(row)
+
+        if key not in price_cache:
+            try:
+                price_cache[key] = get_monthly_costs(row, index) * (1 - enterprise_discount)
+            except KeyError:
+                price_cache[key] = None
+
+        return price_cache[key]
+
+    baseline = {"total": 0, "resources": len(rows), "unpriced": list()}
+    results = [{"name": scenario.get("name", f"scenario-{position}"), "total": 0, "delta": 0, "changed": 0, "resources": list(), "unpriced": list()} for position, scenario in enumerate(scenarios)]
+
+    for row in rows:
+        baseline_costs = get_costs(row)
+
+        if baseline_costs == None: # e.g. aurora or outdated classes, they are left out of every scenario
+            baseline["unpriced"].append(row["resource"])
+            continue
+
+        baseline["total"] += baseline_costs
+
+        for scenario, result in zip(scenarios, results):
+            transformed = transform(row, scenario.get("rules", []))
+
+            if transformed is row or get_price_key(transformed) == get_price_key(row):
+                result["total"] += baseline_costs
+                continue
+
+            simulated_costs = get_costs(transformed)
+
+            if simulated_costs == None: # the target has no price, the resource keeps its costs
+                result["unpriced"].append(row["resource"])
+                result["total"] += baseline_costs
+                continue
+
+            result["total"] += simulated_costs
+            result["changed"] += 1
+            result["resources"].append({
+                "account": row["account"], "service": row["service"], "resource": row["resource"],
+                "from": {field: row[field] for field in set_fields if field in row},
+                "to": {field: transformed[field] for field in set_fields if field in transformed},
+                "baseline": round(baseline_costs, 2), "simulated": round(simulated_costs, 2), "delta": round(simulated_costs - baseline_costs, 2)
+            })
+
+    for result in results:
+        result["delta"] = round(result["total"] - baseline["total"], 2)
+        result["total"] = round(result["total"], 2)
+
+    baseline["total"] = round(baseline["total"], 2)
+
+    return {"baseline": baseline, "scenarios": results}
@@ -0,0 +1,193 @@
+import math
+
+from aws_pricing_api import rds_pricing_api
+
+candidate_storage_types = ["gp2", "gp3", "io1", "io2"]
+headroom = 1.2 # the recommended configuration covers the observed peaks plus 20 %
+max_storage = 65536 # GB
+
+# usagetypes of the storage types without region prefix and Multi-AZ infix, e.g. EUC1-RDS:Multi-AZ-GP3-Storage -> GP3-Storage
+storage_usagetypes = {"standard": ["StorageUsage"], "gp2": ["GP2-Storage"], "gp3": ["GP3-Storage"], "io1": ["IO1-Storage", "PIOPS-Storage"], "io2": ["IO2-Storage"]}
+iops_usagetypes = {"gp3": ["GP3-PIOPS"], "io1": ["IO1-PIOPS", "PIOPS"], "io2": ["IO2-PIOPS"]}
+throughput_storage_types = ["gp3"] # only gp3 volumes pay for provisioned throughput
+
+# performance limits of the storage types on RDS
+gp2_iops_per_gb = 3
+gp2_min_iops = 100
+gp2_max_iops = 16000
+gp2_max_throughput = 250 # MB/s, volumes from 334 GB on, smaller ones have 128 MB/s
+gp2_large_volume = 334 # GB
+gp2_small_throughput = 128 # MB/s
+gp3_large_volume = 400 # GB, smaller volumes have the small baseline and can not be provisioned beyond it
+gp3_baseline = {"iops": 3000, "throughput": 125}
+gp3_large_baseline = {"iops": 12000, "throughput": 500}
+gp3_max = {"iops": 64000, "throughput": 4000}
+io_min_iops = 1000
+io_max_iops = 256000
+io_max_iops_per_gb = {"io1": 50, "io2": 500}
+io_throughput_per_iops = 0.25 # MB/s, 256 KiB per I/O
+io_max_throughput = 4000
+
+# Returns the price of the given usagetypes in given product family and deployment, None if the catalog has no such price
+def get_usage_price(pf, usagetypes, multi_az, unit):
+    for key in rds_pricing_api.price_dict[pf]:
+        usagetype = key.split(":", 1)[-1]
+        key_multi_az = usagetype.startswith("Multi-AZ-")
+
+        if key_multi_az == bool(multi_az) and usagetype.removeprefix("Multi-AZ-") in usagetypes:
+            return float(rds_pricing_api.price_dict[pf][key]["costs"][unit])
+
+    return None
+
+# Returns the monthly prices per GB, provisioned IOPS and provisioned MB/s of given storage type, None if its storage is not in the catalog
+# the IOPS and throughput prices are None for storage types that are not billed for them
+def get_storage_prices(storage_type, multi_az):
+    gb_price = get_usage_price("Database Storage", storage_usagetypes.get(storage_type, []), multi_az, "GB-Mo")
+
+    if gb_price == None:
+        return None
+
+    iops_price = get_usage_price("Provisioned IOPS", iops_usagetypes.get(storage_type, []), multi_az, "IOPS-Mo")
+    throughput_price = None
+
+    if storage_type in throughput_storage_types:
+        try:
+            throughput_price = float(rds_pricing_api.get_database_storage_throughput_price(multi_az))
+        except KeyError:
+            pass
+
+    return {"gb": gb_price, "iops": iops_price, "throughput": throughput_price}
+
+# Returns the IOPS and throughput of a gp2 volume of given size
+def get_gp2_performance(storage):
+    throughput = gp2_max_throughput if storage >= gp2_large_volume else gp2_small_throughput
+
+    return {"iops": max(gp2_min_iops, min(storage * gp2_iops_per_gb, gp2_max_iops)), "throughput": throughput}
+
+# Returns the configuration of given storage type that delivers the given IOPS and throughput with at least the given storage, None if it can not
+# billable IOPS and throughput are the provisioned performance that is paid on top of the storage
+def get_configuration(storage_type, storage, iops, throughput):
+    if storage_type == "gp2":
+        storage = max(storage, math.ceil(iops / gp2_iops_per_gb)) # gp2 performance grows with the volume
+
+        if throughput > gp2_small_throughput:
+            storage = max(storage, gp2_large_volume)
+
+        if iops > gp2_max_iops or throughput > gp2_max_throughput or storage > max_storage:
+            return None
+
+        return dict(get_gp2_performance(storage), storageType="gp2", storage=storage, billableIops=0, billableThroughput=0)
+
+    if storage_type == "gp3":
+        if storage < gp3_large_volume and iops <= gp3_baseline["iops"] and throughput <= gp3_baseline["throughput"]:
+            return {"storageType": "gp3", "storage": storage, "iops": gp3_baseline["iops"], "throughput": gp3_baseline["throughput"], "billableIops": 0, "billableThroughput": 0}
+
+        if iops > gp3_max["iops"] or throughput > gp3_max["throughput"]:
+            return None
+
+        storage = max(storage, gp3_large_volume) # more than the small baseline needs a large volume
+        provisioned_iops = max(gp3_large_baseline["iops"], math.ceil(iops))
+        provisioned_throughput = max(gp3_large_baseline["throughput"], math.ceil(throughput))
+
+        return {"storageType": "gp3", "storage": storage, "iops": provisioned_iops, "throughput": provisioned_throughput, "billableIops": provisioned_iops - gp3_large_baseline["iops"], "billableThroughput": provisioned_throughput - gp3_large_baseline["throughput"]}
+
+    if storage_type in io_max_iops_per_gb:
+        if throughput > io_max_throughput:
+            return None
+
+        provisioned_iops = max(io_min_iops, math.ceil(iops), math.ceil(throughput / io_throughput_per_iops))
+        storage = max(storage, math.ceil(provisioned_iops / io_max_iops_per_gb[storage_type]))
+
+        if provisioned_iops > io_max_iops or storage > max_storage:
+            return None
+
+        return {"storageType": storage_type, "storage": storage, "iops": provisioned_iops, "throughput": min(provisioned_iops * io_throughput_per_iops, io_max_throughput), "billableIops": provisioned_iops, "billableThroughput": 0}
+
+    return None
+
+# Returns the current configuration of given instance, the provisioned IOPS and throughput it pays for
+def get_current_configuration(instance):
+    storage_type = instance["storageType"].lower()
+    storage = instance["storage"]
+    iops = instance["iops"]
+    throughput = instance["storageThroughput"]
+    configuration = {"storageType": storage_type, "storage": storage, "iops": iops, "throughput": throughput, "billableIops": 0, "billableThroughput": 0}
+
+    if storage_type == "gp2": # gp2 reports no IOPS, they follow from the volume
+        configuration.update(get_gp2_performance(storage))
+    elif storage_type == "gp3" and storage < gp3_large_volume:
+        configuration["iops"] = gp3_baseline["iops"]
+        configuration["throughput"] = gp3_baseline["throughput"]
+    elif storage_type == "gp3":
+        configuration["billableIops"] = max(0, iops - gp3_large_baseline["iops"])
+        configuration["billableThroughput"] = max(0, throughput - gp3_large_baseline["throughput"])
+    elif storage_type in io_max_iops_per_gb:
+        configuration["billableIops"] = iops
+
+    return configuration
+
+# Returns the monthly costs of given configuration, None if a needed price is missing in the catalog
+def get_monthly_costs(configuration, prices):
+    if prices == None:
+        return None
+
+    costs = configuration["storage"] * prices["gb"]
+
+    for billable, price in [("billableIops", "iops"), ("billableThroughput", "throughput")]:
+        if configuration[billable] > 0:
+            if prices[price] == None:
+                return None
+
+            costs += configuration[billable] * prices[price]
+
+    return costs
+
+# Returns a label of given configuration for messages and reports, e.g. gp3 500 GB 12000 IOPS 500 MB/s
+def describe_configuration(configuration):
+    return f"{configuration['storageType']} {configuration['storage']} GB {configuration['iops']} IOPS {configuration['throughput']} MB/s"
+
+# Returns the cheapest storage configuration of every given instance that meets its observed peak IOPS and throughput
+# the costs of every candidate storage type are evaluated as one cost column over the whole fleet, the cheapest column wins per instance
+# usage holds the peaks per instance, see rds_cloudwatch_api.get_storage_usage, instances without a cheaper configuration are not returned
+def optimize(instances, usage):
+    names = [name for name in instances if name in usage and not rds_pricing_api.is_aurora(instances[name])] # aurora storage is billed per cluster
+    price_table = dict()
+
+    def get_prices(storage_type, multi_az):
+        if (storage_type, multi_az) not in price_table:
+            price_table[(storage_type, multi_az)] = get_storage_prices(storage_type, multi_az)
+
+        return price_table[(storage_type, multi_az)]
+
+    current_configurations = [get_current_configuration(instances[name]) for name in names]
+    current_costs = [get_monthly_costs(configuration, get_prices(configuration["storageType"], instances[name]["deployment"])) for name, configuration in zip(names, current_configurations)]
+
+    required_iops = [usage[name]["iops"] * headroom for name in names]
+    required_throughput = [usage[name]["throughput"] * headroom for name in names]
+    storage = [instances[name]["storage"] for name in names] # allocated storage can not shrink
+
+    configurations = dict()
+    costs = dict()
+
+    for storage_type in candidate_storage_types:
+        configurations[storage_type] = [get_configuration(storage_type, gb, iops, throughput) for gb, iops, throughput in zip(storage, required_iops, required_throughput)]
+        costs[storage_type] = [math.inf if configuration == None else (get_monthly_costs(configuration, get_prices(storage_type, instances[name]["deployment"])) or math.inf) for name, configuration in zip(names, configurations[storage_type])]
+
+    recommendations = dict()
+
+    for index, name in enumerate(names):
+        best_type = min(candidate_storage_types, key=lambda storage_type: costs[storage_type][index])
+        best_costs = costs[best_type][index]
+
+        if best_costs == math.inf or current_costs[index] == None or best_costs >= current_costs[index] - 0.01:
+            continue
+
+        recommendations[name] = {
+            "current": dict(current_configurations[index], monthly=round(current_costs[index], 2)),
+            "recommended": dict(configurations[best_type][index], monthly=round(best_costs, 2)),
+            "savings": round(current_costs[index] - best_costs, 2),
+            "peakIops": usage[name]["iops"],
+            "peakThroughput": usage[name]["throughput"]
+        }
+
+    return recommendations
@@ -0,0 +1,81 @@
+import time
+import threading
+
+# circuit states, the values are exposed as metric values
+CLOSED = 0
+HALF_OPEN = 1
+OPEN = 2
+
+failure_threshold = 3 # consecutive failures until the circuit of an account opens
+base_backoff = 3600 # seconds an account is skipped after its circuit opened the first time
+max_backoff = 7 * 24 * 3600 # upper bound of the exponential backoff
+
+# every job kind has its own circuit per account, e.g. failing recommendations do not stop the cost collection
+default_job = "collection"
+account_health = dict() # job -> account -> health entry
+health_lock = threading.RLock() # the jobs run on their own executors and share this state
+
+# Returns the health entry of given account and job, creates a closed one for unknown accounts
+def get_account_health(account, job=default_job):
+    with health_lock:
+        job_health = account_health.setdefault(job, dict())
+
+        if account not in job_health:
+            job_health[account] = {"state": CLOSED, "consecutiveFailures": 0, "openCount": 0, "retryAt": 0, "lastDuration": 0}
+
+        return job_health[account]
+
+# Returns true if the account should be collected, an open circuit turns half-open once its backoff is over to allow a probe
+def allow_request(account, now=None, job=default_job):
+    if now == None:
+        now = time.time()
+
+    with health_lock:
+        health = get_account_health(account, job)
+
+        if health["state"] == OPEN and now >= health["retryAt"]:
+            health["state"] = HALF_OPEN
+
+        return health["state"] != OPEN
+
+# Records a successful collection of given account and closes its circuit
+def record_success(account, duration, job=default_job):
+    with health_lock:
+        health = get_account_health(account, job)
+
+        health["state"] = CLOSED
+        health["consecutiveFailures"] = 0
+        health["openCount"] = 0
+        health["retryAt"] = 0
+        health["lastDuration"] = duration
+
+# Records a failed collection of given account, the circuit opens after too many failures or a failed probe
+def record_failure(account, duration, now=None, job=default_job):
+    if now == None:
+        now = time.time()
+
+    with health_lock:
+        health = get_account_health(account, job)
+
+        health["consecutiveFailures"] += 1
+        health["lastDuration"] = duration
+
+        if health["state"] == HALF_OPEN or health["consecutiveFailures"] >= failure_threshold:
+            backoff = min(base_backoff * 2 ** health["openCount"], max_backoff)
+
+            health["state"] = OPEN
+            health["openCount"] += 1
+            health["retryAt"] = now + backoff
+
+            print(f"[WARN] Circuit of the {job} for account {account} opened, next probe in {backoff} seconds")
+
+# Returns the given accounts in collection order, accounts with an open circuit are left out
+# healthy accounts are collected first, so probes of broken accounts do not delay them
+def get_schedule(accounts, now=None, job=default_job):
+    if now == None:
+        now = time.time()
+
+    with health_lock:
+        allowed_accounts = [account for account in accounts if allow_request(account, now, job)]
+
+        return sorted(allowed_accounts, key=lambda account: (get_account_health(account, job)["state"], get_account_health(account, job)["consecutiveFailures"])) # sorted is stable, closed before half-open
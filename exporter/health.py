@@ -0,0 +1,76 @@
+import json
+import time
+import threading
+
+# startup state of the exporter, the http server is up before the price catalogs are loaded
+required_catalogs = ["rds", "ec"]
+catalogs = dict() # service -> {"state": "loading" | "loaded" | "failed", "error": str, "updatedAt": float}
+started_at = time.time()
+costs_source = None # "snapshot" once checkpointed costs are restored, "collection" once the first collection finished
+first_collection_at = None
+state_lock = threading.Lock()
+
+json_headers = [("Content-Type", "application/json")]
+
+# Records the state of the price catalog of given service
+def set_catalog_state(service, state, error=None):
+    with state_lock:
+        catalogs[service] = {"state": state, "error": error, "updatedAt": time.time()}
+
+# Returns the state of the price catalog of given service, None if its loading did not start yet
+def get_catalog_state(service):
+    with state_lock:
+        return catalogs.get(service, {}).get("state")
+
+# Returns true if the price catalogs of all services are loaded
+def catalogs_loaded():
+    with state_lock:
+        return all(catalogs.get(service, {}).get("state") == "loaded" for service in required_catalogs)
+
+# Records that costs are exposed, either restored from a snapshot or collected
+def set_costs_exposed(source):
+    global costs_source
+    global first_collection_at
+
+    with state_lock:
+        if source == "collection" and first_collection_at == None:
+            first_collection_at = time.time()
+
+        if costs_source != "collection":
+            costs_source = source
+
+# Returns true if the catalogs are loaded and there are costs to scrape
+def is_ready():
+    return catalogs_loaded() and costs_source != None
+
+# Returns the startup state as a dictionary
+def get_status():
+    with state_lock:
+        status = {
+            "uptime": round(time.time() - started_at, 3),
+            "catalogs": {service: dict(catalogs.get(service, {"state": "pending"})) for service in required_catalogs},
+            "costs": costs_source,
+            "firstCollectionAt": first_collection_at
+        }
+
+    status["ready"] = is_ready()
+
+    return status
+
+# Handles GET /healthz, the process is alive as long as it answers
+def handle_healthz(environ):
+    return "200 OK", json_headers, json.dumps(get_status()).encode("utf-8")
+
+# Handles GET /ready, 503 until the catalogs are loaded and costs are exposed
+def handle_ready(environ):
+    status = get_status()
+
+    if status["ready"]:
+        return "200 OK", json_headers, json.dumps(status).encode("utf-8")
+
+    return "503 Service Unavailable", json_headers, json.dumps(status).encode("utf-8")
+
+# Registers the health routes on the given http server module
+def register_routes(http_server):
+    http_server.register_route("/healthz", handle_healthz)
+    http_server.register_route("/ready", handle_ready)
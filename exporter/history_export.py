@@ -0,0 +1,163 @@
+import os
+import time
+import uuid
+import datetime
+import threading
+
+# every collected price is appended to parquet files partitioned by date and account, e.g. <dir>/date=2024-05-01/account=123/part-*.parquet
+# the rows are buffered in memory and written in batches, so the hourly runs produce few and well compressed files
+history_dir = None # the export is disabled if not set
+batch_size = 50000 # rows buffered before they are written
+max_buffered_batches = 4 # rows of failed writes are kept up to this many batches, the oldest rows are dropped beyond
+compression = "zstd"
+
+component_columns = ["instance", "storage", "iops", "throughput", "snapshot", "io", "compute"] # monthly cost components, see calculate_rds_prices
+usage_columns = ["storageGB", "snapshotGB", "nodes", "ios", "computeUnits"] # usage aggregates of the collection
+
+buffer = list()
+buffer_lock = threading.Lock()
+write_lock = threading.Lock()
+
+# Enables the export to given directory, pyarrow is only needed if the export is enabled
+def configure(path, rows_per_batch=None):
+    global history_dir
+    global batch_size
+
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("The history export needs pyarrow, install it with: pip install pyarrow")
+
+    history_dir = path
+
+    if rows_per_batch != None:
+        batch_size = rows_per_batch
+
+# Returns true if the export is enabled
+def is_enabled():
+    return history_dir != None
+
+# Returns the parquet schema of the history rows, date and account are only part of the partition path
+def get_schema():
+    import pyarrow
+
+    columns = [
+        ("timestamp", pyarrow.timestamp("s", tz="UTC")),
+        ("team", pyarrow.string()),
+        ("stage", pyarrow.string()),
+        ("service", pyarrow.string()),
+        ("resource", pyarrow.string()),
+        ("resourceClass", pyarrow.string()),
+        ("engine", pyarrow.string()),
+        ("storageType", pyarrow.string()),
+        ("multiAZ", pyarrow.bool_()),
+        ("catalogVersion", pyarrow.int64()),
+        ("month", pyarrow.float64()),
+        ("current", pyarrow.float64())
+    ]
+
+    columns += [(f"{component}Costs", pyarrow.float64()) for component in component_columns]
+    columns += [(usage, pyarrow.float64()) for usage in usage_columns]
+
+    return pyarrow.schema(columns)
+
+# Returns the history rows of the given prices of given account and service, resources holds the listed resources the prices stem from
+def build_rows(account, team, stage, service, prices, resources, catalog_version, timestamp):
+    collected_at = datetime.datetime.fromtimestamp(int(timestamp), tz=datetime.timezone.utc)
+    rows = list()
+
+    for resource in prices:
+        if resource == "totalMonth" or resource == "totalCurrent":
+            continue
+
+        attributes = resources.get(resource, {})
+        multi_az = attributes.get("deployment", attributes.get("multiAZ"))
+
+        row = {
+            "timestamp": collected_at,
+            "account": account,
+            "team": team,
+            "stage": stage,
+            "service": service,
+            "resource": resource,
+            "resourceClass": attributes.get("class", attributes.get("cacheNodeType")),
+            "engine": attributes.get("engine"),
+            "storageType": attributes.get("storageType"),
+            "multiAZ": None if multi_az == None else bool(multi_az),
+            "catalogVersion": catalog_version,
+            "month": prices[resource]["month"],
+            "current": prices[resource]["current"]
+        }
+
+        components = prices[resource].get("components", {})
+        usage = prices[resource].get("usage", {})
+
+        for component in component_columns:
+            row[f"{component}Costs"] = components.get(component)
+
+        for column in usage_columns:
+            row[column] = None if usage.get(column) == None else float(usage[column])
+
+        rows.append(row)
+
+    return rows
+
+# Appends the rows of the given prices to the buffer and writes the buffer once a batch is full
+def add_prices(account, team, stage, service, prices, resources, catalog_version, timestamp):
+    rows = build_rows(account, team, stage, service, prices, resources, catalog_version, timestamp)
+
+    with buffer_lock:
+        buffer.extend(rows)
+        full = len(buffer) >= batch_size
+
+    if full:
+        flush()
+
+# Writes all buffered rows, one compressed parquet file per date and account partition
+# the files are written under a temporary name and renamed, so readers never see half written files
+def flush():
+    global buffer
+
+    import pyarrow
+    import pyarrow.parquet
+
+    with buffer_lock:
+        rows = buffer
+        buffer = list()
+
+    if len(rows) == 0:
+        return 0
+
+    partitions = dict()
+    for row in rows:
+        partitions.setdefault((row["timestamp"].date().isoformat(), row["account"]), []).append(row)
+
+    schema = get_schema()
+
+    with write_lock:
+        for (date, account) in list(partitions):
+            directory = os.path.join(history_dir, f"date={date}", f"account={account}")
+            path = os.path.join(directory, f"part-{int(time.time())}-{uuid.uuid4().hex[:8]}.parquet")
+            tmp_path = path + ".tmp"
+
+            try:
+                os.makedirs(directory, exist_ok=True)
+                pyarrow.parquet.write_table(pyarrow.Table.from_pylist(partitions[(date, account)], schema=schema), tmp_path, compression=compression)
+                os.replace(tmp_path, path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+                with buffer_lock: # the unwritten rows are written with the next batch
+                    buffer[:0] = [row for partition_rows in partitions.values() for row in partition_rows]
+                    dropped = max(len(buffer) - batch_size * max_buffered_batches, 0)
+                    del buffer[:dropped]
+
+                if dropped > 0:
+                    print(f"[ERROR] History export dropped the {dropped} oldest rows, the buffer is limited to {batch_size * max_buffered_batches} rows")
+                raise
+
+            del partitions[(date, account)]
+
+    return len(rows)
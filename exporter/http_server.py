@@ -0,0 +1,50 @@
+import threading
+
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+from prometheus_client import make_wsgi_app
+
+# additional routes served next to the prometheus metrics, path -> handler(environ) returning (status, headers, body)
+routes = dict()
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+class SilentHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass # no access log for every scrape
+
+# Registers a handler for the given path
+def register_route(path, handler):
+    routes[path] = handler
+
+# Returns the wsgi app serving the registered routes and the prometheus metrics for every other path
+def create_app():
+    metrics_app = make_wsgi_app()
+
+    def app(environ, start_response):
+        handler = routes.get(environ.get("PATH_INFO", "/"))
+
+        if handler == None:
+            return metrics_app(environ, start_response)
+
+        try:
+            status, headers, body = handler(environ)
+        except Exception as e:
+            print(e)
+            print(f"[ERROR] Request to {environ.get('PATH_INFO')} failed!")
+            status, headers, body = "500 Internal Server Error", [("Content-Type", "text/plain")], b"internal error\n"
+
+        start_response(status, list(headers)) # wsgiref adds the content length to the given list
+        return [body]
+
+    return app
+
+# Starts the http server in a daemon thread, it replaces prometheus_client.start_http_server
+def start_http_server(port, addr="0.0.0.0"):
+    httpd = make_server(addr, port, create_app(), ThreadingWSGIServer, handler_class=SilentHandler)
+
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    return httpd
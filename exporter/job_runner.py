@@ -0,0 +1,93 @@
+import time
+import random
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from prometheus_client import Gauge, Counter
+
+jobs = dict()
+
+# Prometheus metrics of the job runner
+job_lag = Gauge("job_lag_seconds", "Shows the delay between the scheduled time and the start of the last run of the job, after skipped runs from the first skipped one", ["job"])
+job_duration = Gauge("job_duration_seconds", "Shows the duration of the last run of the job", ["job"])
+job_running = Gauge("job_running", "Shows if the job is currently running", ["job"])
+job_skipped_runs = Counter("job_skipped_runs", "Counts the runs that were skipped because the previous run was still running", ["job"])
+job_overruns = Counter("job_overruns", "Counts the runs that took longer than the interval of the job", ["job"])
+
+# Registers a job, every job gets its own executor so a long running job never delays another one
+def register_job(name, function, interval):
+    jobs[name] = {"function": function, "interval": interval, "executor": ThreadPoolExecutor(max_workers=1, thread_name_prefix=name), "running": False, "lock": threading.Lock(), "pendingSince": None}
+
+# Schedules runs of the given job with given job of the schedule library, e.g. schedule.every().hour.at(":00")
+# the runs know the time they were scheduled for, so the lag shows how far the job is behind its schedule
+def schedule_job(scheduler_job, name, *args):
+    scheduler_job.do(lambda: submit(name, *args, scheduled_at=scheduler_job.next_run.timestamp())) # next_run is still the due time while the job runs
+
+# Triggers a run of the given job without blocking, the run is skipped if the previous run of the job is still running
+# scheduled_at is the time the run was due, the next run that starts after skipped runs counts its lag from the first skipped one
+def submit(name, *args, scheduled_at=None):
+    job = jobs[name]
+
+    if scheduled_at == None:
+        scheduled_at = time.time()
+
+    with job["lock"]:
+        if job["running"]:
+            print(f"[WARN] Job {name} is still running, skipping this run!")
+            job_skipped_runs.labels(job=name).inc()
+
+            if job["pendingSince"] == None:
+                job["pendingSince"] = scheduled_at
+            return
+
+        job["running"] = True
+        due_at = job["pendingSince"] if job["pendingSince"] != None else scheduled_at
+        job["pendingSince"] = None
+
+    job["executor"].submit(run_job, name, due_at, args)
+
+# Runs the given job and records its lag, duration and overrun
+def run_job(name, due_at, args):
+    job = jobs[name]
+    start_time = time.time()
+
+    job_lag.labels(job=name).set(start_time - due_at)
+    job_running.labels(job=name).set(1)
+
+    try:
+        job["function"](*args)
+    except Exception as e:
+        print(e)
+        print(f"[ERROR] Job {name} failed!")
+    finally:
+        duration = time.time() - start_time
+
+        job_duration.labels(job=name).set(duration)
+        job_running.labels(job=name).set(0)
+
+        if duration > job["interval"]:
+            print(f"[WARN] Job {name} took {round(duration)} seconds, longer than its interval of {job['interval']} seconds!")
+            job_overruns.labels(job=name).inc()
+
+        with job["lock"]:
+            job["running"] = False
+
+# Yields the given items spread evenly over the given window in seconds, every item gets a random offset within its slot
+# so the AWS APIs are not hit by all accounts at the same second
+def spread(items, window):
+    items = list(items)
+
+    if window <= 0 or len(items) == 0:
+        yield from items
+        return
+
+    start_time = time.time()
+    slot = window / len(items)
+
+    for index, item in enumerate(items):
+        delay = start_time + index * slot + random.uniform(0, slot) - time.time()
+
+        if delay > 0:
+            time.sleep(delay)
+
+        yield item
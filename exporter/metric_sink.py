@@ -0,0 +1,96 @@
+import os
+import tempfile
+import threading
+import urllib.request
+
+from urllib.parse import quote
+
+# the cost metrics of a batch run, they have the names and labels of the exporter's gauges
+metric_help = {
+    "current_costs": "Shows the current running costs of the resource",
+    "monthly_costs": "Shows the forecast of this month's costs",
+    "total_current_costs": "Shows the total current running costs of this service",
+    "total_monthly_costs": "Shows the total forecast of this month's costs",
+    "last_collection_timestamp": "Shows the unix timestamp of the collection the exposed costs stem from"
+}
+
+push_timeout = 30 # seconds
+
+# Opens a sink the collected prices of a batch run are added to, it is rendered once at the end of the run
+def open_sink():
+    return {"samples": {name: list() for name in metric_help}, "lock": threading.Lock()}
+
+# Adds the given prices of given account and service to the sink
+def add_prices(sink, account, service, prices, timestamp):
+    samples = list()
+
+    for resource in prices:
+        if resource == "totalMonth" or resource == "totalCurrent":
+            continue
+
+        samples.append(("current_costs", {"resource_name": resource, "account": account, "service": service}, prices[resource]["current"]))
+        samples.append(("monthly_costs", {"resource_name": resource, "account": account, "service": service}, prices[resource]["month"]))
+
+    samples.append(("total_current_costs", {"account": account, "service": service}, prices["totalCurrent"]))
+    samples.append(("total_monthly_costs", {"account": account, "service": service}, prices["totalMonth"]))
+    samples.append(("last_collection_timestamp", {"account": account, "service": service}, timestamp))
+
+    with sink["lock"]:
+        for name, labels, value in samples:
+            sink["samples"][name].append((labels, value))
+
+# Returns the given label value escaped for the text exposition format
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+# Returns the metrics of the sink in the text exposition format, OpenMetrics adds the terminating # EOF line
+def render(sink, openmetrics=True):
+    lines = list()
+
+    with sink["lock"]:
+        for name in metric_help:
+            lines.append(f"# HELP {name} {metric_help[name]}")
+            lines.append(f"# TYPE {name} gauge")
+
+            for labels, value in sink["samples"][name]:
+                label_string = ",".join(f'{key}="{escape_label_value(labels[key])}"' for key in labels)
+                lines.append(f"{name}{{{label_string}}} {float(value)!r}")
+
+    if openmetrics:
+        lines.append("# EOF")
+
+    return "\n".join(lines) + "\n"
+
+# Writes the metrics of the sink as OpenMetrics file for the textfile collector of the node_exporter
+# the file is replaced atomically, so the collector never reads a half written file
+def write_textfile(sink, path):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp") # the collector only reads *.prom files
+
+    try:
+        with os.fdopen(fd, "w") as tmp_file:
+            tmp_file.write(render(sink))
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+
+        os.chmod(tmp_path, 0o644) # mkstemp creates the file readable by its owner only
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+# Pushes all the metrics of the sink with one PUT request to a Pushgateway compatible endpoint
+# the PUT replaces the metrics of the grouping key, so parallel batch workers need distinct grouping keys
+def push(sink, gateway, job, grouping_key=None):
+    url = f"{gateway.rstrip('/')}/metrics/job/{quote(job, safe='')}"
+
+    for key, value in (grouping_key or {}).items():
+        url += f"/{quote(key, safe='')}/{quote(str(value), safe='')}"
+
+    request = urllib.request.Request(url, data=render(sink, openmetrics=False).encode("utf-8"), method="PUT")
+    request.add_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+
+    with urllib.request.urlopen(request, timeout=push_timeout) as response:
+        return response.status
@@ -0,0 +1,86 @@
+import json
+import threading
+
+from collections import OrderedDict
+from urllib.parse import parse_qsl
+
+from aws_pricing_api import price_index
+
+max_batch_size = 1000 # lookups per batch request
+max_cached_responses = 4096
+
+# serialized responses per index key and query, evicted least recently used first
+response_cache = OrderedDict()
+response_cache_lock = threading.Lock()
+
+json_headers = [("Content-Type", "application/json")]
+not_loaded = ("503 Service Unavailable", json.dumps({"error": "price catalogs are still loading"}).encode("utf-8"))
+
+# Returns the serialized result of a single lookup and its http status
+def lookup_json(query):
+    if not price_index.is_loaded():
+        return not_loaded
+
+    cache_key = (price_index.get_index_key(), tuple(sorted(query.items())))
+
+    with response_cache_lock:
+        if cache_key in response_cache:
+            response_cache.move_to_end(cache_key)
+            return response_cache[cache_key]
+
+    try:
+        response = ("200 OK", json.dumps(price_index.lookup(query)).encode("utf-8"))
+    except KeyError:
+        return ("404 Not Found", json.dumps({"error": "no price found", "query": query}).encode("utf-8"))
+    except ValueError as e:
+        return ("400 Bad Request", json.dumps({"error": str(e), "query": query}).encode("utf-8"))
+
+    with response_cache_lock:
+        response_cache[cache_key] = response
+
+        if len(response_cache) > max_cached_responses:
+            response_cache.popitem(last=False)
+
+    return response
+
+# Handles GET /api/prices?service=rds&instanceType=db.m5.large&deployment=Multi-AZ&term=Reserved
+def handle_price(environ):
+    query = dict(parse_qsl(environ.get("QUERY_STRING", "")))
+    status, body = lookup_json(query)
+
+    return status, json_headers, body
+
+# Handles POST /api/prices/batch with a body like {"lookups": [{"service": "ec", "instanceType": "cache.m5.large"}, ...]}
+def handle_price_batch(environ):
+    if environ["REQUEST_METHOD"] != "POST":
+        return "405 Method Not Allowed", json_headers, json.dumps({"error": "use POST"}).encode("utf-8")
+
+    try:
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+        lookups = json.loads(environ["wsgi.input"].read(length))["lookups"]
+    except Exception:
+        return "400 Bad Request", json_headers, json.dumps({"error": "body must be a json object with a list of lookups"}).encode("utf-8")
+
+    if not isinstance(lookups, list) or not all(isinstance(query, dict) for query in lookups):
+        return "400 Bad Request", json_headers, json.dumps({"error": "lookups must be a list of json objects"}).encode("utf-8")
+
+    if len(lookups) > max_batch_size:
+        return "400 Bad Request", json_headers, json.dumps({"error": f"at most {max_batch_size} lookups per request"}).encode("utf-8")
+
+    if not price_index.is_loaded():
+        return not_loaded[0], json_headers, not_loaded[1]
+
+    # the cached results are already serialized, so they are spliced into the response without decoding them again
+    results = list()
+    for query in lookups:
+        status, body = lookup_json({key: str(value) for key, value in query.items()})
+        results.append(body)
+
+    body = b'{"results":[' + b",".join(results) + b"]}"
+
+    return "200 OK", json_headers, body
+
+# Registers the price api routes on the given http server module
+def register_routes(http_server):
+    http_server.register_route("/api/prices", handle_price)
+    http_server.register_route("/api/prices/batch", handle_price_batch)
@@ -0,0 +1,177 @@
+import os
+import sys
+import time
+import json
+import hmac
+import threading
+import tracemalloc
+
+from urllib.parse import parse_qsl
+
+# on-demand profiling of the running process, the profiles are bounded in time and only one runs at a time so it can stay enabled
+max_seconds = 60
+default_seconds = 10
+min_interval = 0.001 # seconds between two stack samples
+default_interval = 0.01
+max_top = 200
+token = None # the requests need an "Authorization: Bearer <token>" header, without a token the routes are not registered
+
+profile_lock = threading.Lock()
+traced_at_startup = False # tracemalloc was started with --trace-malloc, the snapshots include everything allocated since
+
+json_headers = [("Content-Type", "application/json")]
+text_headers = [("Content-Type", "text/plain; charset=utf-8")]
+
+# Returns the label of a stack frame, e.g. calculate_rds_prices (aws_pricing_api/rds_pricing_api.py:207)
+def get_frame_label(frame):
+    code = frame.f_code
+    filename = os.path.relpath(code.co_filename) if code.co_filename.startswith(os.getcwd()) else code.co_filename
+
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ":")
+
+# Samples the stacks of all other threads every interval for given seconds and returns the counts per collapsed stack
+# the collapsed stacks are root first and separated by semicolons, the format of flamegraph.pl and speedscope
+def sample_stacks(seconds, interval):
+    own_thread = threading.get_ident()
+    thread_names = dict()
+    stacks = dict()
+    samples = 0
+    end = time.monotonic() + seconds
+
+    while time.monotonic() < end:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+
+            if thread_id not in thread_names:
+                thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+            labels = list()
+            while frame != None:
+                labels.append(get_frame_label(frame))
+                frame = frame.f_back
+
+            labels.append(thread_names.get(thread_id, str(thread_id)))
+            stack = ";".join(reversed(labels))
+            stacks[stack] = stacks.get(stack, 0) + 1
+
+        samples += 1
+        time.sleep(interval)
+
+    return stacks, samples
+
+# Returns the top allocation sites of a tracemalloc snapshot, tracing is started for the given seconds if it is not running
+def get_allocations(seconds, top, key_type):
+    started = False
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(25 if key_type == "traceback" else 1)
+        started = True
+        time.sleep(seconds) # only allocations made while tracing show up
+
+    try:
+        snapshot = tracemalloc.take_snapshot()
+        traced_current, traced_peak = tracemalloc.get_traced_memory()
+    finally:
+        if started:
+            tracemalloc.stop()
+
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>")])
+    statistics = snapshot.statistics(key_type)
+
+    sites = list()
+    for statistic in statistics[:top]:
+        sites.append({
+            "size": statistic.size,
+            "count": statistic.count,
+            "traceback": [f"{frame.filename}:{frame.lineno}" for frame in statistic.traceback]
+        })
+
+    return {
+        "tracedSince": "startup" if traced_at_startup else f"last {seconds} seconds",
+        "tracedCurrent": traced_current,
+        "tracedPeak": traced_peak,
+        "totalSize": sum(statistic.size for statistic in statistics),
+        "sites": sites
+    }
+
+# Returns the error response if the request is not authorized, None otherwise
+def check_token(environ):
+    authorization = environ.get("HTTP_AUTHORIZATION", "")
+
+    if token == None or not hmac.compare_digest(authorization.encode("utf-8"), f"Bearer {token}".encode("utf-8")):
+        return "401 Unauthorized", json_headers, json.dumps({"error": "missing or wrong token"}).encode("utf-8")
+
+    return None
+
+# Returns the query value of given name as number bounded to the given range
+def get_bounded(query, name, default, lower, upper, cast=float):
+    try:
+        value = cast(query.get(name, default))
+    except ValueError:
+        value = default
+
+    return min(max(value, lower), upper)
+
+# Handles GET /debug/profile?seconds=10&interval=0.01, returns the collapsed stacks of a sampling profile
+def handle_profile(environ):
+    denied = check_token(environ)
+    if denied != None:
+        return denied
+
+    query = dict(parse_qsl(environ.get("QUERY_STRING", "")))
+    seconds = get_bounded(query, "seconds", default_seconds, 0.1, max_seconds)
+    interval = get_bounded(query, "interval", default_interval, min_interval, 1)
+
+    if not profile_lock.acquire(blocking=False):
+        return "409 Conflict", json_headers, json.dumps({"error": "a profile is already running"}).encode("utf-8")
+
+    try:
+        stacks, samples = sample_stacks(seconds, interval)
+    finally:
+        profile_lock.release()
+
+    lines = [f"{stack} {count}" for stack, count in sorted(stacks.items(), key=lambda item: -item[1])]
+    headers = text_headers + [("X-Profile-Samples", str(samples)), ("Content-Disposition", "attachment; filename=\"profile.collapsed\"")]
+
+    return "200 OK", headers, ("\n".join(lines) + "\n").encode("utf-8")
+
+# Handles GET /debug/memory?top=25&seconds=10&group=lineno, returns the top allocation sites of a tracemalloc snapshot
+# group is lineno, filename or traceback, with --trace-malloc the snapshot includes everything allocated since startup
+def handle_memory(environ):
+    denied = check_token(environ)
+    if denied != None:
+        return denied
+
+    query = dict(parse_qsl(environ.get("QUERY_STRING", "")))
+    seconds = get_bounded(query, "seconds", default_seconds, 0.1, max_seconds)
+    top = get_bounded(query, "top", 25, 1, max_top, int)
+    key_type = query.get("group", "lineno")
+
+    if key_type not in ["lineno", "filename", "traceback"]:
+        return "400 Bad Request", json_headers, json.dumps({"error": "group must be lineno, filename or traceback"}).encode("utf-8")
+
+    if not profile_lock.acquire(blocking=False):
+        return "409 Conflict", json_headers, json.dumps({"error": "a profile is already running"}).encode("utf-8")
+
+    try:
+        allocations = get_allocations(seconds, top, key_type)
+    finally:
+        profile_lock.release()
+
+    return "200 OK", json_headers, json.dumps(allocations).encode("utf-8")
+
+# Starts tracing the allocations right away, so the memory snapshots include the price catalogs and gauges loaded at startup
+def start_tracing(frames=1):
+    global traced_at_startup
+
+    tracemalloc.start(frames)
+    traced_at_startup = True
+
+# Registers the profiling routes on the given http server module, nothing is registered without a token
+def register_routes(http_server):
+    if token == None:
+        return
+
+    http_server.register_route("/debug/profile", handle_profile)
+    http_server.register_route("/debug/memory", handle_memory)
@@ -0,0 +1,150 @@
+import sys
+import csv
+import json
+import threading
+
+from aws_pricing_api import storage_optimizer
+
+report_formats = ["jsonl", "csv", "parquet"]
+csv_columns = ["type", "account", "service", "resource", "candidate", "month", "current", "onDemandMonthly", "reservedMonthly", "timestamp"]
+parquet_batch_size = 10000 # records buffered per parquet row group
+
+# Opens a report of given format at given path, "-" writes to stdout
+def open_report(path, report_format):
+    if report_format not in report_formats:
+        raise ValueError(f"Unknown report format {report_format}, use one of {report_formats}")
+
+    report = {"format": report_format, "path": path, "lock": threading.Lock(), "records": 0, "stdout": path == "-"} # sys.stdout may be redirected when the report is closed
+
+    if report_format == "parquet":
+        if path == "-":
+            raise ValueError("Parquet reports can not be written to stdout, pass a file path with --output")
+
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet reports need pyarrow, install it with: pip install pyarrow")
+
+        report["buffer"] = list()
+        report["writer"] = None
+        return report
+
+    if path == "-":
+        report["file"] = sys.stdout
+    else:
+        report["file"] = open(path, "w", newline="")
+
+    if report_format == "csv":
+        report["csv"] = csv.DictWriter(report["file"], fieldnames=csv_columns, extrasaction="ignore")
+        report["csv"].writeheader()
+
+    return report
+
+# Returns the given record with nested values serialized, so every format has flat columns
+def flatten_record(record):
+    flat_record = dict.fromkeys(csv_columns)
+
+    for key in record:
+        value = record[key]
+        flat_record[key] = json.dumps(value) if isinstance(value, dict) else value
+
+    return flat_record
+
+# Writes the buffered records as one row group to the parquet file
+def flush_parquet(report):
+    import pyarrow
+    import pyarrow.parquet
+
+    if len(report["buffer"]) == 0:
+        return
+
+    table = pyarrow.Table.from_pylist(report["buffer"], schema=get_parquet_schema())
+
+    if report["writer"] == None:
+        report["writer"] = pyarrow.parquet.ParquetWriter(report["path"], table.schema, compression="zstd")
+
+    report["writer"].write_table(table)
+    report["buffer"] = list()
+
+# Returns the parquet schema of the report records
+def get_parquet_schema():
+    import pyarrow
+
+    return pyarrow.schema([
+        ("type", pyarrow.string()),
+        ("account", pyarrow.string()),
+        ("service", pyarrow.string()),
+        ("resource", pyarrow.string()),
+        ("candidate", pyarrow.string()),
+        ("month", pyarrow.float64()),
+        ("current", pyarrow.float64()),
+        ("onDemandMonthly", pyarrow.float64()),
+        ("reservedMonthly", pyarrow.string()),
+        ("timestamp", pyarrow.float64())
+    ])
+
+# Writes the given record to the report, can be called from multiple threads
+def write_record(report, record):
+    with report["lock"]:
+        report["records"] += 1
+
+        if report["format"] == "jsonl":
+            report["file"].write(json.dumps(record) + "\n")
+        elif report["format"] == "csv":
+            report["csv"].writerow(flatten_record(record))
+        else:
+            report["buffer"].append(flatten_record(record))
+
+            if len(report["buffer"]) >= parquet_batch_size:
+                flush_parquet(report)
+
+# Flushes and closes the report
+def close_report(report):
+    with report["lock"]:
+        if report["format"] == "parquet":
+            flush_parquet(report)
+
+            if report["writer"] != None:
+                report["writer"].close()
+        elif report["stdout"]:
+            report["file"].flush()
+        else:
+            report["file"].close()
+
+# Returns the report records of the calculated prices of given account and service
+def build_cost_records(account, service, prices, timestamp):
+    records = list()
+
+    for resource in prices:
+        if resource == "totalMonth" or resource == "totalCurrent":
+            continue
+
+        records.append({"type": "cost", "account": account, "service": service, "resource": resource, "month": prices[resource]["month"], "current": prices[resource]["current"], "timestamp": timestamp})
+
+    records.append({"type": "total", "account": account, "service": service, "month": prices["totalMonth"], "current": prices["totalCurrent"], "timestamp": timestamp})
+
+    return records
+
+# Returns the report records of the recommendations of given account and service
+def build_recommendation_records(account, service, recommendations, timestamp):
+    records = list()
+
+    for resource in recommendations:
+        for candidate in recommendations[resource]:
+            prices = recommendations[resource][candidate]["prices"]
+
+            records.append({"type": "recommendation", "account": account, "service": service, "resource": resource, "candidate": candidate, "onDemandMonthly": prices["OnDemand"], "reservedMonthly": prices["Reserved"], "timestamp": timestamp})
+
+    return records
+
+# Returns the report records of the storage recommendations of given account, the candidate describes the recommended configuration
+def build_storage_records(account, recommendations, timestamp):
+    records = list()
+
+    for resource in recommendations:
+        recommended = recommendations[resource]["recommended"]
+
+        records.append({"type": "storage", "account": account, "service": "rds", "resource": resource, "candidate": storage_optimizer.describe_configuration(recommended), "month": recommended["monthly"], "current": recommendations[resource]["current"]["monthly"], "timestamp": timestamp})
+
+    return records
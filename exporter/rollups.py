@@ -0,0 +1,102 @@
+import threading
+
+from prometheus_client import Gauge
+
+from aws_pricing_api import ri_coverage
+
+# pre-aggregated cost series, dashboards and recording rules query these instead of summing up every resource_name series
+# label names of every rollup, e.g. rollup_team_monthly_costs{team="core"}
+rollups = {
+    "team": ["team"],
+    "stage": ["stage"],
+    "service": ["service"],
+    "account": ["account"],
+    "family": ["service", "family"]
+}
+
+rollup_current_costs = {name: Gauge(f"rollup_{name}_current_costs", f"Shows the current running costs per {' and '.join(rollups[name])}", rollups[name]) for name in rollups}
+rollup_monthly_costs = {name: Gauge(f"rollup_{name}_monthly_costs", f"Shows the forecast of this month's costs per {' and '.join(rollups[name])}", rollups[name]) for name in rollups}
+rollup_resources = {name: Gauge(f"rollup_{name}_resources", f"Shows the number of resources per {' and '.join(rollups[name])}", rollups[name]) for name in rollups}
+
+# last contribution of every resource per account and service, an update only applies the resources that changed since
+contributions = dict() # (account, service) -> {resource: (label values per rollup, current, month)}
+totals = {name: dict() for name in rollups} # rollup -> label values -> {"current", "month", "resources"}
+rollups_lock = threading.Lock()
+
+# Returns the instance family of a resource, e.g. db.m5, resources without an instance class are other
+def get_family(attributes):
+    instance_class = attributes.get("class") or attributes.get("cacheNodeType")
+
+    if instance_class == None or instance_class == "db.serverless":
+        return "other"
+
+    return ri_coverage.get_instance_family(instance_class)
+
+# Returns the contributions of the given prices of given account and service
+def build_contributions(account, service, team, stage, prices, resources):
+    resource_contributions = dict()
+
+    for resource in prices:
+        if resource == "totalMonth" or resource == "totalCurrent":
+            continue
+
+        label_values = {
+            "team": (team,),
+            "stage": (stage,),
+            "service": (service,),
+            "account": (account,),
+            "family": (service, get_family(resources.get(resource, {})))
+        }
+
+        resource_contributions[resource] = (label_values, prices[resource]["current"], prices[resource]["month"])
+
+    return resource_contributions
+
+# Adds the given contribution with given sign to the totals and returns the touched rollup series
+def apply_contribution(contribution, sign):
+    label_values, current, month = contribution
+    touched = list()
+
+    for name in rollups:
+        total = totals[name].setdefault(label_values[name], {"current": 0, "month": 0, "resources": 0})
+        total["current"] += sign * current
+        total["month"] += sign * month
+        total["resources"] += sign
+        touched.append((name, label_values[name]))
+
+    return touched
+
+# Updates the rollups with the prices of given account and service, only resources that appeared, vanished or changed are applied
+# so every update costs O(changed resources) no matter how many accounts the exporter collects
+def update(account, service, team, stage, prices, resources):
+    new_contributions = build_contributions(account, service, team, stage, prices, resources)
+    touched = set()
+
+    with rollups_lock:
+        old_contributions = contributions.get((account, service), {})
+
+        for resource in old_contributions:
+            if new_contributions.get(resource) != old_contributions[resource]:
+                touched.update(apply_contribution(old_contributions[resource], -1))
+
+        for resource in new_contributions:
+            if old_contributions.get(resource) != new_contributions[resource]:
+                touched.update(apply_contribution(new_contributions[resource], 1))
+
+        contributions[(account, service)] = new_contributions
+
+        for name, label_values in touched:
+            total = totals[name][label_values]
+
+            if total["resources"] == 0: # the last resource of the series vanished
+                del totals[name][label_values]
+                rollup_current_costs[name].remove(*label_values)
+                rollup_monthly_costs[name].remove(*label_values)
+                rollup_resources[name].remove(*label_values)
+                continue
+
+            rollup_current_costs[name].labels(*label_values).set(round(total["current"], 2))
+            rollup_monthly_costs[name].labels(*label_values).set(round(total["month"], 2))
+            rollup_resources[name].labels(*label_values).set(total["resources"])
+
+    return len(touched)
@@ -0,0 +1,74 @@
+import bisect
+import hashlib
+
+from prometheus_client import Gauge
+
+# the accounts are spread over the replicas with consistent hashing, adding a replica only moves about 1/N of the accounts
+members = ["shard-0"] # names of all replicas
+replica = "shard-0" # name of this replica
+virtual_nodes = 128 # points per replica on the hash ring, they even out the share of every replica
+
+ring = None
+
+# Prometheus metrics of the shard ownership, sum(shard_owned_accounts) equals shard_total_accounts if every account is covered
+shard_owned_accounts = Gauge("shard_owned_accounts", "Shows the number of accounts this replica collects", ["shard"])
+shard_total_accounts = Gauge("shard_total_accounts", "Shows the number of accounts of all replicas", ["shard"])
+shard_members = Gauge("shard_members", "Shows the number of replicas the accounts are spread over", ["shard"])
+shard_account_owner = Gauge("shard_account_owner", "Is 1 for every account this replica collects", ["shard", "account"])
+
+# Returns a stable hash of the given key, the built-in hash is randomized per process
+def get_hash(key):
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+# Configures the replicas either by shard index and count or by a list of replica names and the name of this replica
+def configure(shard_index=None, shard_count=None, member_names=None, shard_name=None):
+    global members
+    global replica
+    global ring
+
+    if member_names:
+        if shard_name not in member_names:
+            raise ValueError(f"Shard name {shard_name} is not one of the shard members {member_names}")
+
+        members = list(member_names)
+        replica = shard_name
+    else:
+        if not 0 <= shard_index < shard_count:
+            raise ValueError(f"Shard index {shard_index} is not in range of the shard count {shard_count}")
+
+        members = [f"shard-{index}" for index in range(shard_count)]
+        replica = f"shard-{shard_index}"
+
+    ring = None
+
+# Builds the hash ring of the configured replicas, sorted by the hashes of their points
+def build_ring():
+    global ring
+
+    points = sorted((get_hash(f"{member}#{index}"), member) for member in members for index in range(virtual_nodes))
+    ring = {"hashes": [point[0] for point in points], "members": [point[1] for point in points]}
+
+    return ring
+
+# Returns the replica that collects given account, the owner of the first ring point at or after the hash of the account
+def get_owner(account):
+    if ring == None:
+        build_ring()
+
+    index = bisect.bisect_left(ring["hashes"], get_hash(account)) % len(ring["hashes"])
+
+    return ring["members"][index]
+
+# Returns the accounts of given accounts this replica collects and sets the shard ownership metrics
+def get_owned_accounts(accounts):
+    owned_accounts = [account for account in accounts if get_owner(account) == replica]
+
+    shard_account_owner.clear()
+    for account in owned_accounts:
+        shard_account_owner.labels(shard=replica, account=account).set(1)
+
+    shard_owned_accounts.labels(shard=replica).set(len(owned_accounts))
+    shard_total_accounts.labels(shard=replica).set(len(accounts))
+    shard_members.labels(shard=replica).set(len(members))
+
+    return owned_accounts
@@ -0,0 +1,70 @@
+import json
+
+from aws_pricing_api import price_index
+from aws_pricing_api import rds_pricing_api
+from aws_pricing_api import simulation
+from aws_cloudwatch_api import inventory
+
+json_headers = [("Content-Type", "application/json")]
+
+# resolves the team and stage of an account, set in register_routes
+team_resolver = lambda account: ("core", "no-stage")
+enterprise_discount = 0
+
+# Returns the simulation rows of all cached RDS instances and cache clusters, nothing is described
+# aurora members and serverless v2 instances are billed per cluster or ACU and are left out
+def build_fleet_rows(accounts=None):
+    rows = list()
+
+    for service, build_row in [("rds", simulation.build_rds_row), ("ec", simulation.build_ec_row)]:
+        for account, resources in inventory.get_cached_resources(service).items():
+            if accounts != None and account not in accounts:
+                continue
+
+            team, stage = team_resolver(account)
+
+            for resource in resources:
+                if service == "rds" and (rds_pricing_api.is_aurora(resources[resource]) or resources[resource]["class"] == "db.serverless"):
+                    continue
+
+                rows.append(build_row(account, team, stage, resource, resources[resource]))
+
+    return rows
+
+# Handles POST /api/simulate with a body like {"scenarios": [{"name": "graviton", "rules": [{"match": {"family": "db.m5"}, "set": {"family": "db.m6g"}}]}]}
+# the optional "accounts" list limits the simulation to these accounts, see simulation.simulate for the rules
+def handle_simulate(environ):
+    if environ["REQUEST_METHOD"] != "POST":
+        return "405 Method Not Allowed", json_headers, json.dumps({"error": "use POST"}).encode("utf-8")
+
+    try:
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+        request = json.loads(environ["wsgi.input"].read(length))
+        scenarios = request["scenarios"]
+        accounts = request.get("accounts")
+    except Exception:
+        return "400 Bad Request", json_headers, json.dumps({"error": "body must be a json object with a list of scenarios"}).encode("utf-8")
+
+    if accounts != None and (not isinstance(accounts, list) or not all(isinstance(account, str) for account in accounts)):
+        return "400 Bad Request", json_headers, json.dumps({"error": "accounts must be a list of account ids"}).encode("utf-8")
+
+    if not price_index.is_loaded():
+        return "503 Service Unavailable", json_headers, json.dumps({"error": "price catalogs are still loading"}).encode("utf-8")
+
+    try:
+        result = simulation.simulate(build_fleet_rows(accounts), scenarios, enterprise_discount)
+    except ValueError as e:
+        return "400 Bad Request", json_headers, json.dumps({"error": str(e)}).encode("utf-8")
+
+    return "200 OK", json_headers, json.dumps(result).encode("utf-8")
+
+# Registers the simulation route on the given http server module, resolver returns the team and stage of an account
+def register_routes(http_server, resolver=None, discount=0):
+    global team_resolver
+    global enterprise_discount
+
+    if resolver != None:
+        team_resolver = resolver
+
+    enterprise_discount = discount
+    http_server.register_route("/api/simulate", handle_simulate)
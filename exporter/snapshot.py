@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import uuid
+import tempfile
+
+snapshot_dir = "snapshots" # directory the checkpoints are written to, can be set with --snapshot-dir
+run_state_file = "run_state.json"
+
+# Writes the given content as json to the given path, the file is replaced atomically so a crash never leaves a half written checkpoint
+def write_json_atomic(path, content):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+
+    try:
+        with os.fdopen(fd, "w") as tmp_file:
+            json.dump(content, tmp_file)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+# Returns the json content of the given path or None if it does not exist or is not readable
+def read_json(path):
+    try:
+        with open(path, "r") as json_file:
+            return json.load(json_file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(e)
+        print(f"[ERROR] Could not read snapshot file {path}!")
+
+    return None
+
+# Returns the path of the checkpoint of given account and service
+def get_checkpoint_path(account, service):
+    return os.path.join(snapshot_dir, f"{account}_{service}.json")
+
+# Checkpoints the calculated prices of a successful collection of given account and service
+def save_checkpoint(account, service, prices, timestamp=None):
+    if timestamp == None:
+        timestamp = time.time()
+
+    checkpoint = {"account": account, "service": service, "timestamp": timestamp, "prices": prices}
+
+    try:
+        write_json_atomic(get_checkpoint_path(account, service), checkpoint)
+    except Exception as e:
+        print(e)
+        print(f"[ERROR] Could not write checkpoint for {account} ({service})!")
+
+# Returns a list of all checkpoints of the given accounts and services
+def load_checkpoints(accounts, services):
+    checkpoints = list()
+
+    for account in accounts:
+        for service in services:
+            checkpoint = read_json(get_checkpoint_path(account, service))
+
+            if checkpoint != None:
+                checkpoints.append(checkpoint)
+
+    return checkpoints
+
+# Persists the given run state, a failed write is only logged so checkpointing never affects the collection
+def save_run_state(run_state):
+    try:
+        write_json_atomic(os.path.join(snapshot_dir, run_state_file), run_state)
+    except Exception as e:
+        print(e)
+        print(f"[ERROR] Could not write the state of run {run_state['runId']}!")
+
+# Starts a new collection run for the given accounts and persists its state
+def start_run(accounts):
+    run_state = {"runId": str(uuid.uuid4()), "started": time.time(), "accounts": list(accounts), "finished": [], "completed": False}
+    save_run_state(run_state)
+
+    return run_state
+
+# Marks the given account as finished in the given run
+def mark_account_finished(run_state, account):
+    run_state["finished"].append(account)
+    save_run_state(run_state)
+
+# Marks the given run as completed
+def complete_run(run_state):
+    run_state["completed"] = True
+    save_run_state(run_state)
+
+# Returns the accounts the last run did not finish, either because it was interrupted or because their collection failed
+def get_unfinished_accounts(accounts):
+    run_state = read_json(os.path.join(snapshot_dir, run_state_file))
+
+    if run_state == None:
+        return list()
+
+    return [account for account in accounts if account in run_state["accounts"] and account not in run_state["finished"]]
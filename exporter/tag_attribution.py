@@ -0,0 +1,79 @@
+import re
+import threading
+
+tag_labels = list() # allowlist of tag keys exposed as labels, set with --tag-labels
+max_values_per_tag = 50 # distinct values per tag label, further values are exposed as other_value
+max_value_length = 64
+other_value = "other"
+
+# distinct values seen per tag key, bounds the cardinality of the tagged cost series
+seen_values = dict()
+seen_values_lock = threading.Lock()
+
+# Returns the prometheus label name of given tag key
+def get_label_name(tag_key):
+    return "tag_" + re.sub(r"[^a-zA-Z0-9_]", "_", tag_key).lower()
+
+# Sets the allowlist to the given tag keys, duplicates are dropped, raises a ValueError if two keys map to the same label name
+def configure(tag_keys):
+    global tag_labels
+
+    keys = list()
+    label_names = dict()
+
+    for tag_key in tag_keys:
+        if tag_key in keys:
+            continue
+
+        label_name = get_label_name(tag_key)
+
+        if label_name in label_names:
+            raise ValueError(f"Tag keys {label_names[label_name]} and {tag_key} both map to the label {label_name}, pass only one of them")
+
+        label_names[label_name] = tag_key
+        keys.append(tag_key)
+
+    tag_labels = keys
+
+# Returns the prometheus label names of all allowlisted tags
+def get_label_names():
+    return [get_label_name(tag_key) for tag_key in tag_labels]
+
+# Returns the bounded label value of given tag, values beyond max_values_per_tag are mapped to other_value
+def get_bounded_value(tag_key, value):
+    value = value[:max_value_length]
+
+    with seen_values_lock:
+        values = seen_values.setdefault(tag_key, set())
+
+        if value in values:
+            return value
+
+        if len(values) >= max_values_per_tag:
+            return other_value
+
+        values.add(value)
+
+    return value
+
+# Returns the label values of the allowlisted tags of a resource, missing tags are empty
+def get_label_values(resource_tags):
+    return tuple(get_bounded_value(tag_key, resource_tags[tag_key]) if tag_key in resource_tags else "" for tag_key in tag_labels)
+
+# Returns the costs of the given prices summed up per combination of allowlisted tag values
+# resources maps the resource names to their inventory entries with the arn, tags maps arns to tags
+def aggregate_costs(prices, resources, tags):
+    tagged_costs = dict()
+
+    for resource in prices:
+        if resource == "totalMonth" or resource == "totalCurrent":
+            continue
+
+        arn = resources.get(resource, {}).get("arn")
+        label_values = get_label_values(tags.get(arn, {}))
+
+        costs = tagged_costs.setdefault(label_values, {"current": 0, "month": 0})
+        costs["current"] += prices[resource]["current"]
+        costs["month"] += prices[resource]["month"]
+
+    return tagged_costs
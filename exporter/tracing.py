@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+import contextlib
+import functools
+
+from logging.handlers import RotatingFileHandler
+
+# spans are written as OTLP/JSON lines (one ExportTraceServiceRequest per line), the format of the OpenTelemetry collector file exporter
+service_name = "finops-tool"
+sample_rate = 1.0 # fraction of traces that are recorded, decided once per root span
+trace_logger = None # tracing is disabled until configure is called
+
+span_stack = threading.local()
+
+# Enables tracing to a rotating json lines file at given path
+def configure(path, rate=1.0, max_bytes=10 * 1024 * 1024, backup_count=5):
+    global trace_logger
+    global sample_rate
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+
+    logger = logging.getLogger("finops-tool.tracing")
+    logger.handlers = [handler]
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    sample_rate = rate
+    trace_logger = logger
+
+# Returns the currently active span of this thread or None
+def get_current_span():
+    stack = getattr(span_stack, "spans", None)
+
+    if not stack:
+        return None
+
+    return stack[-1]
+
+# Returns the given attribute value as an OTLP any value
+def to_attribute_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    elif isinstance(value, int):
+        return {"intValue": str(value)}
+    elif isinstance(value, float):
+        return {"doubleValue": value}
+
+    return {"stringValue": str(value)}
+
+# Writes the given finished span to the trace file
+def export_span(span):
+    otlp_span = {
+        "traceId": span["traceId"],
+        "spanId": span["spanId"],
+        "name": span["name"],
+        "kind": 1, # SPAN_KIND_INTERNAL
+        "startTimeUnixNano": str(span["start"]),
+        "endTimeUnixNano": str(span["end"]),
+        "attributes": [{"key": key, "value": to_attribute_value(value)} for key, value in span["attributes"].items()],
+        "status": span["status"]
+    }
+
+    if span["parentSpanId"] != None:
+        otlp_span["parentSpanId"] = span["parentSpanId"]
+
+    request = {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{"scope": {"name": "finops-tool"}, "spans": [otlp_span]}]
+        }]
+    }
+
+    trace_logger.info(json.dumps(request, separators=(",", ":")))
+
+# Context manager recording a span with given name and attributes, attributes can be added to the yielded span while it is active
+@contextlib.contextmanager
+def span(name, **attributes):
+    parent = get_current_span()
+
+    if trace_logger == None or (parent != None and not parent["sampled"]):
+        yield {"attributes": attributes, "sampled": False}
+        return
+
+    if parent == None:
+        sampled = random.random() < sample_rate
+        trace_id = os.urandom(16).hex()
+        parent_span_id = None
+    else:
+        sampled = True
+        trace_id = parent["traceId"]
+        parent_span_id = parent["spanId"]
+
+    current = {"traceId": trace_id, "spanId": os.urandom(8).hex(), "parentSpanId": parent_span_id, "name": name, "attributes": attributes, "sampled": sampled, "status": {"code": 1}}
+
+    if not hasattr(span_stack, "spans"):
+        span_stack.spans = list()
+
+    span_stack.spans.append(current)
+    current["start"] = time.time_ns()
+
+    try:
+        yield current
+    except Exception as e:
+        current["status"] = {"code": 2, "message": str(e)}
+        raise
+    finally:
+        current["end"] = time.time_ns()
+        span_stack.spans.pop()
+
+        if sampled:
+            try:
+                export_span(current)
+            except Exception as e:
+                print(e)
+                print("[ERROR] Could not export span!")
+
+# Decorator recording a span with given name and static attributes for every call of the decorated function
+def traced(name, **attributes):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name, **attributes):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
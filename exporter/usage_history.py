@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import threading
+
+from aws_pricing_api import ri_coverage
+from exporter import snapshot
+
+lookback_hours = 30 * 24 # hours of history the reservation optimizer looks at
+history_file = "usage_history.jsonl"
+history_lock = threading.Lock()
+
+# Returns the path of the usage history, it lives next to the snapshots
+def get_history_path():
+    return os.path.join(snapshot.snapshot_dir, history_file)
+
+# Appends the normalized units of the given resources that are not covered by reservations, per pool, to the usage history
+def record_usage(account, service, resources, class_key, multi_az_key, region="eu-central-1"):
+    units = dict()
+
+    for name in resources:
+        resource = resources[name]
+        pool, resource_units = ri_coverage.get_pool(resource[class_key], ri_coverage.get_product(resource.get("engine")), resource.get(multi_az_key, False), region)
+        resource_units *= resource.get("nodes", 1) # every node of a cache cluster needs its own reservation
+        pool_key = "|".join([service] + list(pool))
+
+        units[pool_key] = units.get(pool_key, 0) + resource_units * (1 - resource.get("riCoverage", 0))
+
+    line = json.dumps({"hour": int(time.time() // 3600), "account": account, "service": service, "units": units})
+
+    try:
+        with history_lock:
+            os.makedirs(snapshot.snapshot_dir, exist_ok=True)
+
+            with open(get_history_path(), "a") as history:
+                history.write(line + "\n")
+    except Exception as e:
+        print(e)
+        print(f"[ERROR] Could not record usage history for {account} ({service})!")
+
+# Returns the hourly demand per pool of the hours of the lookback window that have a recording of the pool's service
+def load_demand(now=None):
+    if now == None:
+        now = time.time()
+
+    last_hour = int(now // 3600)
+    first_hour = last_hour - lookback_hours + 1
+    latest = dict() # the last recording per hour, account and service wins
+
+    with history_lock:
+        if not os.path.exists(get_history_path()):
+            return dict()
+
+        with open(get_history_path(), "r") as history:
+            for line in history:
+                entry = json.loads(line)
+
+                if first_hour <= entry["hour"] <= last_hour:
+                    latest[(entry["hour"], entry["account"], entry["service"])] = entry["units"]
+
+    if len(latest) == 0:
+        return dict()
+
+    # only the hours with a recording of the service count, hours the exporter did not collect are left out instead of counting as no demand
+    recorded_hours = dict()
+    for hour, account, service in latest:
+        recorded_hours.setdefault(service, set()).add(hour)
+
+    hour_positions = {service: {hour: position for position, hour in enumerate(sorted(recorded_hours[service]))} for service in recorded_hours}
+    demand = dict()
+
+    for (hour, account, service), units in latest.items():
+        for pool_key in units:
+            pool = tuple(pool_key.split("|"))
+
+            if pool not in demand:
+                demand[pool] = [0] * len(hour_positions[service])
+
+            demand[pool][hour_positions[service][hour]] += units[pool_key]
+
+    return demand
+
+# Drops the recordings older than the lookback window from the usage history
+def prune(now=None):
+    if now == None:
+        now = time.time()
+
+    first_hour = int(now // 3600) - lookback_hours + 1
+
+    with history_lock:
+        if not os.path.exists(get_history_path()):
+            return
+
+        with open(get_history_path(), "r") as history:
+            lines = [line for line in history if json.loads(line)["hour"] >= first_hour]
+
+        tmp_path = get_history_path() + ".tmp"
+        with open(tmp_path, "w") as history:
+            history.writelines(lines)
+
+        os.replace(tmp_path, get_history_path())
@@ -5,83 +5,306 @@ import http.client
 import json
 import schedule
 import logging
+import os
+import sys
+import socket
+import threading
+import contextlib
 
-from prometheus_client import start_http_server, Gauge
+from concurrent.futures import ThreadPoolExecutor
+
+from prometheus_client import Gauge
 from datetime import date
 
 from aws_cloudwatch_api import rds_cloudwatch_api
 from aws_cloudwatch_api import ec_cloudwatch_api
+from aws_cloudwatch_api import inventory
+from aws_cloudwatch_api import tagging_api
 from aws_pricing_api import rds_pricing_api
 from aws_pricing_api import ec_pricing_api
+from aws_pricing_api import ri_coverage
+from aws_pricing_api import reservation_optimizer
+from aws_pricing_api import catalog_file
+from aws_pricing_api import storage_optimizer
 
 from aws_pricing_api import initialize_rds_price_dict
 from aws_pricing_api import initialize_ec_price_dict
 
+from exporter import snapshot
+from exporter import circuit_breaker
+from exporter import tracing
+from exporter import job_runner
+from exporter import report_writer
+from exporter import http_server
+from exporter import price_api
+from exporter import tag_attribution
+from exporter import usage_history
+from exporter import health
+from exporter import metric_sink
+from exporter import sharding
+from exporter import history_export
+from exporter import rollups
+from exporter import simulation_api
+from exporter import profiler
+
 connMattermost = http.client.HTTPSConnection("domain")
 headersMattermost = {
     "Content-Type": "application/json"
 }
+mattermost_lock = threading.Lock() # the connection is shared, the posts of concurrent workers are sent one at a time
 
 # general vars
 account_ids = []
 role_name = "finops-tool-member-role" # default name for finops tool member
 enterprise_discount = 0.00
+spread_window = 600 # seconds the accounts of an hourly run are spread over
+credentials_refresh_margin = 300 # seconds before their expiry the assumed role credentials of an account are renewed
+catalog_file_path = None # the loaded catalogs are compiled to this file for worker processes, see catalog_file
+catalog_retry_delay = 60 # seconds until catalogs that failed to load at startup are retried, doubled after every failed retry
+max_catalog_retry_delay = 1800
+catalog_lock = threading.Lock() # the startup retries and the daily update never load the catalogs at the same time
 
 # account id to team mapping
 teams = dict()
 team_short_names_to_webhook = dict()
 
-sts_client = boto3.client("sts", region_name="eu-central-1")
-pricing_client = boto3.client("pricing", region_name="eu-central-1")
-rds_client = boto3.client("rds", region_name="eu-central-1")
-cloudwatch_client = boto3.client("cloudwatch", region_name="eu-central-1")
-ec_client = boto3.client("elasticache", region_name="eu-central-1")
-s3_client = boto3.client("s3", region_name="eu-central-1")
+# clients of the accounts by account id: {"clients": dict, "expiresAt": float}, see get_account_clients
+account_clients = dict()
+account_clients_lock = threading.Lock()
+
+# clients of the tool's own account, created on first use so importing this module makes no AWS calls
+clients = dict()
+clients_lock = threading.Lock()
 
-# initialization of service pricing dictionaries
-initialize_rds_price_dict(pricing_client)
-logging.log(50, "Initialized RDS Pricing API Dictionary!")
+# Returns the client of given service in the tool's own account
+def get_client(service):
+    with clients_lock:
+        if service not in clients:
+            clients[service] = boto3.client(service, region_name="eu-central-1")
 
-initialize_ec_price_dict(pricing_client)
-logging.log(50, "Initialized EC Pricing API Dictionary!")
+        return clients[service]
+
+# Loads the price catalogs of all services, at startup this runs in the background while the http server already serves
+# returns true if every catalog was loaded, a catalog that fails to reload stays in use, with missing_only loaded catalogs are kept as they are
+def load_price_catalogs(missing_only=False):
+    with catalog_lock:
+        success = True
+
+        for service, initialize in [("rds", initialize_rds_price_dict), ("ec", initialize_ec_price_dict)]:
+            reload = health.get_catalog_state(service) == "loaded"
+
+            if reload and missing_only:
+                continue
+
+            if not reload:
+                health.set_catalog_state(service, "loading")
+
+            try:
+                initialize(get_client("pricing"))
+                health.set_catalog_state(service, "loaded")
+                logging.log(50, f"Initialized {service.upper()} Pricing API Dictionary!")
+            except Exception as e:
+                print(e)
+                print(f"[ERROR] Could not load the {service.upper()} pricing catalog!")
+                success = False
+
+                if not reload:
+                    health.set_catalog_state(service, "failed", str(e))
+
+        if success and catalog_file_path != None:
+            try:
+                records = catalog_file.compile_catalog(catalog_file_path)
+                print(f"[INFO] Compiled {records} prices to {catalog_file_path}")
+            except Exception as e:
+                print(e)
+                print(f"[ERROR] Could not compile the price catalog to {catalog_file_path}!")
+
+        return success
+
+# Loads the price catalogs and then resumes the accounts an interrupted run did not finish
+# missing catalogs are retried with a backoff of minutes, the collections are skipped until they are loaded
+def start_up():
+    delay = catalog_retry_delay
+
+    while not load_price_catalogs(missing_only=True):
+        print(f"[WARN] Retrying to load the price catalogs in {delay} seconds")
+        time.sleep(delay)
+        delay = min(delay * 2, max_catalog_retry_delay)
+
+    unfinished_accounts = snapshot.get_unfinished_accounts(account_ids)
+    if unfinished_accounts:
+        print(f"[INFO] Resuming interrupted run for {len(unfinished_accounts)} accounts")
+        job_runner.submit("fetch_metrics", unfinished_accounts)
 
 # Prometheus Gauges
 current_costs = Gauge("current_costs", "Shows the current running costs of the resource", ["resource_name", "account", "service"])
 monthly_costs = Gauge("monthly_costs", "Shows the forecast of this month's costs", ["resource_name", "account", "service"])
 total_current_costs = Gauge("total_current_costs", "Shows the total current running costs of this service", ["account", "service"])
 total_monthly_costs = Gauge("total_monthly_costs", "Shows the total forecast of this month's costs", ["account", "service"])
-
+account_circuit_state = Gauge("account_circuit_state", "Shows the circuit state of the account, 0 = closed, 1 = half-open, 2 = open", ["account"])
+account_consecutive_failures = Gauge("account_consecutive_failures", "Shows the number of consecutive failed collections of the account", ["account"])
+account_collection_duration = Gauge("account_collection_duration_seconds", "Shows the duration of the last collection of the account", ["account"])
+reserved_coverage = Gauge("reserved_coverage", "Shows the share of normalized instance units covered by reservations", ["account", "service"])
+reservation_recommended_units = Gauge("reservation_recommended_units", "Shows the normalized units of reservations the optimizer recommends to buy", ["service", "product", "family", "term", "payment_option"])
+reservation_expected_monthly_savings = Gauge("reservation_expected_monthly_savings", "Shows the expected monthly savings of the recommended reservations", ["service", "product", "family"])
+replication_group_current_costs = Gauge("replication_group_current_costs", "Shows the current running costs of all nodes of the replication group", ["replication_group", "account"])
+replication_group_monthly_costs = Gauge("replication_group_monthly_costs", "Shows the forecast of this month's costs of all nodes and snapshots of the replication group", ["replication_group", "account"])
+replication_group_nodes = Gauge("replication_group_nodes", "Shows the number of nodes of the replication group", ["replication_group", "account"])
+storage_recommended_monthly_savings = Gauge("storage_recommended_monthly_savings", "Shows the monthly savings of the cheapest storage configuration that meets the observed peaks", ["resource_name", "account", "storage_type"])
+last_collection_timestamp = Gauge("last_collection_timestamp", "Shows the unix timestamp of the collection the exposed costs stem from", ["account", "service"])
+
+# tagged cost gauges, their labels depend on --tag-labels so they are created in create_tag_gauges
+tagged_current_costs = None
+tagged_monthly_costs = None
+tagged_label_values = dict() # label values exposed per account and service, to remove combinations that vanished
+storage_label_values = dict() # storage recommendations exposed per account, to remove the ones that vanished
+
+@tracing.traced("update_pricing_api_info")
 def update_pricing_api_info():
     try:
-        if date.today().day == 1:
-            ec_pricing_api.init_ec_price_dict(pricing_client)
-            rds_pricing_api.init_rds_price_dict(pricing_client)
-            print("[INFO] Pricing API info has been updated successfully!")
+        if date.today().day == 1 or not health.catalogs_loaded(): # catalogs still missing after startup are retried too
+            if load_price_catalogs():
+                print("[INFO] Pricing API info has been updated successfully!")
     except Exception as e:
         print(e)
         print("[ERROR] Failed to update pricing API info!")
 
-def collect_ec_metrics(account, ec_client):
+# Sets the gauges of given account and service to the given prices, timestamp is the time the prices were collected at
+def expose_prices(account, service, prices, timestamp):
+    for resource in prices:
+        if resource == "totalMonth" or resource == "totalCurrent":
+            continue
+
+        current_costs.labels(resource_name=resource, account=account, service=service).set(prices[resource]["current"])
+        monthly_costs.labels(resource_name=resource, account=account, service=service).set(prices[resource]["month"])
+
+        if "aggregate" in prices[resource]: # replication groups, see calculate_ec_prices
+            replication_group_current_costs.labels(replication_group=resource, account=account).set(prices[resource]["aggregate"]["current"])
+            replication_group_monthly_costs.labels(replication_group=resource, account=account).set(prices[resource]["aggregate"]["month"])
+            replication_group_nodes.labels(replication_group=resource, account=account).set(prices[resource]["aggregate"]["nodes"])
+
+    total_current_costs.labels(account=account, service=service).set(prices["totalCurrent"])
+    total_monthly_costs.labels(account=account, service=service).set(prices["totalMonth"])
+    last_collection_timestamp.labels(account=account, service=service).set(timestamp)
+
+# Creates the tagged cost gauges with a label per allowlisted tag
+def create_tag_gauges():
+    global tagged_current_costs
+    global tagged_monthly_costs
+
+    label_names = ["account", "service"] + tag_attribution.get_label_names()
+
+    tagged_current_costs = Gauge("tagged_current_costs", "Shows the current running costs per combination of allowlisted resource tags", label_names)
+    tagged_monthly_costs = Gauge("tagged_monthly_costs", "Shows the forecast of this month's costs per combination of allowlisted resource tags", label_names)
+
+# Sets the tagged cost gauges of given account and service, the tags come from one cached GetResources query per account
+def expose_tagged_costs(account, service, prices, resources, tagging_client):
+    if tagged_current_costs == None or tagging_client == None:
+        return
+
     try:
-        clusters = ec_cloudwatch_api.get_ec_cache_clusters(ec_client)
-        ec_prices = ec_pricing_api.calculate_ec_prices(clusters, enterprise_discount, ec_client)
+        tags = tagging_api.get_cached_resource_tags(account, tagging_client)
+        tagged_costs = tag_attribution.aggregate_costs(prices, resources, tags)
 
-        for cluster in ec_prices:
-            if cluster == "totalMonth" or cluster == "totalCurrent":
-                continue
+        for label_values in tagged_label_values.get((account, service), set()) - set(tagged_costs.keys()):
+            tagged_current_costs.remove(account, service, *label_values)
+            tagged_monthly_costs.remove(account, service, *label_values)
 
-            current_costs.labels(resource_name=cluster, account=account, service="ec").set(ec_prices[cluster]["current"])
-            monthly_costs.labels(resource_name=cluster, account=account, service="ec").set(ec_prices[cluster]["month"])
+        for label_values in tagged_costs:
+            tagged_current_costs.labels(account, service, *label_values).set(round(tagged_costs[label_values]["current"], 2))
+            tagged_monthly_costs.labels(account, service, *label_values).set(round(tagged_costs[label_values]["month"], 2))
 
-        total_current_costs.labels(account=account, service="ec").set(ec_prices["totalCurrent"])
-        total_monthly_costs.labels(account=account, service="ec").set(ec_prices["totalMonth"])
+        tagged_label_values[(account, service)] = set(tagged_costs.keys())
+    except Exception as e:
+        print(e)
+        print(f"[ERROR] Could not attribute {service} costs by tags for account: {account}")
+
+# Appends the given prices of given account and service to the history export, if it is enabled
+def export_history(account, service, prices, resources, timestamp):
+    if not history_export.is_enabled():
+        return
+
+    try:
+        team, stage = get_team_and_stage(account)
+        catalog_version = rds_pricing_api.catalog_version if service == "rds" else ec_pricing_api.catalog_version
+
+        history_export.add_prices(account, team, stage, service, prices, resources, catalog_version, timestamp)
+    except Exception as e:
+        print(e)
+        print(f"[ERROR] Could not export the history of account: {account}")
+
+# Updates the team, stage, service, account and family rollups with the given prices of given account and service
+def update_rollups(account, service, prices, resources):
+    try:
+        team, stage = get_team_and_stage(account)
+        rollups.update(account, service, team, stage, prices, resources)
+    except Exception as e:
+        print(e)
+        print(f"[ERROR] Could not update the {service} rollups of account: {account}")
+
+# Writes the buffered rows of the history export
+def flush_history():
+    if not history_export.is_enabled():
+        return
+
+    try:
+        with tracing.span("history_export.flush"):
+            rows = history_export.flush()
+        print(f"[INFO] Exported {rows} history rows")
+    except Exception as e:
+        print(e)
+        print("[ERROR] Could not write the history export, the rows are kept for the next run")
+
+# Exposes the last checkpointed prices of all accounts, so the gauges are not empty until the first collection after a restart
+def restore_snapshot():
+    try:
+        for checkpoint in snapshot.load_checkpoints(account_ids, ["ec", "rds"]):
+            expose_prices(checkpoint["account"], checkpoint["service"], checkpoint["prices"], checkpoint["timestamp"])
+            update_rollups(checkpoint["account"], checkpoint["service"], checkpoint["prices"], {}) # the families follow with the first collection
+            health.set_costs_exposed("snapshot")
+
+        print("[INFO] Restored cost snapshot from disk!")
+    except Exception as e:
+        print(e)
+        print("[ERROR] Could not restore cost snapshot!")
+
+# Sets the health gauges of given account to the circuit breaker state of its cost collection
+def expose_account_health(account):
+    health = circuit_breaker.get_account_health(account)
+
+    account_circuit_state.labels(account=account).set(health["state"])
+    account_consecutive_failures.labels(account=account).set(health["consecutiveFailures"])
+    account_collection_duration.labels(account=account).set(health["lastDuration"])
+
+@tracing.traced("collect_metrics", service="ec")
+def collect_ec_metrics(account, ec_client, cloudwatch_client, tagging_client=None):
+    try:
+        clusters = inventory.get_ec_clusters(account, ec_client)
+        clusters = ec_pricing_api.apply_ec_reservations(clusters, ec_cloudwatch_api.get_ec_cache_reserved_nodes(ec_client))
+        replication_groups = inventory.get_ec_replication_groups(account, ec_client)
+        serverless_caches = inventory.get_ec_serverless_caches(account, ec_client)
+        serverless_usage = ec_cloudwatch_api.get_serverless_usage(cloudwatch_client, account, serverless_caches)
+        ec_prices = ec_pricing_api.calculate_ec_prices(clusters, enterprise_discount, ec_client, replication_groups, serverless_caches, serverless_usage)
+
+        reserved_coverage.labels(account=account, service="ec").set(ri_coverage.get_coverage(clusters))
+        usage_history.record_usage(account, "ec", clusters, "cacheNodeType", "multiAZ")
+
+        timestamp = time.time()
+        expose_prices(account, "ec", ec_prices, timestamp)
+        expose_tagged_costs(account, "ec", ec_prices, {**clusters, **replication_groups, **serverless_caches}, tagging_client)
+        export_history(account, "ec", ec_prices, {**clusters, **replication_groups, **serverless_caches}, timestamp)
+        update_rollups(account, "ec", ec_prices, {**clusters, **replication_groups, **serverless_caches})
+
+        return ec_prices
     except Exception as e:
         print(e)
         print("[EC] No entry written, error")
 
-def generate_ec_recommendations(account, ec_client, cloudwatch_client):
+@tracing.traced("generate_recommendations", service="ec")
+def generate_ec_recommendations(account, ec_client, cloudwatch_client, notify=True):
     try:
-        clusters = ec_cloudwatch_api.get_ec_cache_clusters(ec_client)
+        clusters = inventory.get_ec_clusters(account, ec_client)
+        recommendations = dict()
 
         for cluster in clusters:
             cpu_usage = ec_cloudwatch_api.get_cpu_usage(cloudwatch_client, cluster)
@@ -95,6 +318,11 @@ def generate_ec_recommendations(account, ec_client, cloudwatch_client):
             cpu_val = cluster_vcpu * cpu_usage
 
             possible_clusters = ec_pricing_api.get_possible_clusters(memory_usage, cpu_val, network_usage, outpost, cluster_costs)
+            recommendations[cluster] = possible_clusters
+
+            if not notify:
+                continue
+
             msg = "#### EC Recommendations FinOps Tool"
             msg += f"\n Account: {account}"
             msg += f"\n Instance: {cluster}"
@@ -116,33 +344,60 @@ def generate_ec_recommendations(account, ec_client, cloudwatch_client):
                         msg += f"\n Reserved (All Upfront, 3yr) monthly costs: {round(possible_clusters[p_cluster]['prices']['Reserved']['AllUpfront']['3yr'], 2)}"
 
             send_to_mattermost(account, msg)
+
+        return recommendations
     except Exception as e:
         print(e)
         print(f"[EC] Recommendations could not be generated, error in account: {account}")
 
-def collect_rds_metrics(account, rds_client, cloudwatch_client):
+@tracing.traced("collect_metrics", service="rds")
+def collect_rds_metrics(account, rds_client, cloudwatch_client, tagging_client=None):
     try:
-        instances = rds_cloudwatch_api.get_rds_on_demand_instances(rds_client)
-        rds_prices = rds_pricing_api.calculate_rds_prices(instances, enterprise_discount, cloudwatch_client, rds_client)
-
-        for instance in rds_prices:
-            if instance == "totalMonth" or instance == "totalCurrent":
-                continue
+        instances = inventory.get_rds_instances(account, rds_client)
+        clusters = inventory.get_rds_clusters(account, rds_client)
+        instances = rds_pricing_api.apply_rds_reservations(instances, rds_cloudwatch_api.get_rds_reserved_instances(rds_client), clusters)
+        rds_prices = rds_pricing_api.calculate_rds_prices(instances, enterprise_discount, cloudwatch_client, rds_client, clusters)
+
+        reservable = {instance: instances[instance] for instance in instances if instances[instance]["class"] != "db.serverless"} # serverless v2 can not be reserved
+        reserved_coverage.labels(account=account, service="rds").set(ri_coverage.get_coverage(reservable))
+        usage_history.record_usage(account, "rds", reservable, "class", "deployment")
+
+        timestamp = time.time()
+        expose_prices(account, "rds", rds_prices, timestamp)
+        resources = {**instances, **{rds_pricing_api.get_cluster_key(cluster): clusters[cluster] for cluster in clusters}}
+        expose_tagged_costs(account, "rds", rds_prices, resources, tagging_client)
+        export_history(account, "rds", rds_prices, resources, timestamp)
+        update_rollups(account, "rds", rds_prices, resources)
+
+        return rds_prices
+    except Exception as e:
+        print(e)
+        print("[RDS] No entry written, error")
 
-            current_costs.labels(resource_name=instance, account=account, service="rds").set(rds_prices[instance]["current"])
-            monthly_costs.labels(resource_name=instance, account=account, service="rds").set(rds_prices[instance]["month"])
+# Returns the peak IOPS and throughput of the provisioned instances of given account, aurora and serverless v2 have no provisioned storage
+# on errors nothing is returned, instances without usage get no storage recommendation
+def get_rds_storage_usage(account, rds_client, cloudwatch_client):
+    try:
+        instances = inventory.get_rds_instances(account, rds_client)
+        provisioned = [instance for instance in instances if instances[instance]["class"] != "db.serverless" and not rds_pricing_api.is_aurora(instances[instance])]
 
-        total_current_costs.labels(account=account, service="rds").set(rds_prices["totalCurrent"])
-        total_monthly_costs.labels(account=account, service="rds").set(rds_prices["totalMonth"])
+        return rds_cloudwatch_api.get_storage_usage(cloudwatch_client, provisioned)
     except Exception as e:
         print(e)
-        print("[RDS] No entry written, error")
+        print(f"[RDS] Storage usage could not be read, error in account: {account}")
+
+        return dict()
 
-def generate_rds_recommendations(account, rds_client, cloudwatch_client):
+@tracing.traced("generate_recommendations", service="rds")
+def generate_rds_recommendations(account, rds_client, cloudwatch_client, notify=True):
     try:
-        instances = rds_cloudwatch_api.get_rds_on_demand_instances(rds_client)
+        instances = inventory.get_rds_instances(account, rds_client)
+        recommendations = dict()
 
         for instance in instances:
+            if instances[instance]["class"] == "db.serverless":
+                continue # serverless v2 scales by itself, there is no instance class to recommend
+
             cpu_usage = rds_cloudwatch_api.get_cpu_usage(cloudwatch_client, instance)
             memory_usage = rds_cloudwatch_api.get_memory_usage(cloudwatch_client, instance)
             network_usage = rds_cloudwatch_api.get_network_usage(cloudwatch_client, instance)
@@ -155,6 +410,11 @@ def generate_rds_recommendations(account, rds_client, cloudwatch_client):
             cpu_val = instance_vcpu * cpu_usage
 
             possible_instances = rds_pricing_api.get_possible_instances(memory_usage, cpu_val, network_usage, deployment, instance_costs)
+            recommendations[instance] = possible_instances
+
+            if not notify:
+                continue
+
             msg = "#### RDS Recommendations FinOps Tool"
             msg += f"\n Account: {account}"
             msg += f"\n Instance: {instance}"
@@ -172,62 +432,275 @@ def generate_rds_recommendations(account, rds_client, cloudwatch_client):
                     msg += f"\n Reserved (All Upfront, 3yr) monthly costs: {round(possible_instances[p_instance]['prices']['Reserved']['AllUpfront']['3yr'], 2)}"
 
             send_to_mattermost(account, msg)
+
+        return recommendations
     except Exception as e:
         print(e)
         print(f"[RDS] Recommendations could not be generated, error in account: {account}")
 
-def fetch_metrics():
-    for account in account_ids:
-        print(account)
+@tracing.traced("generate_recommendations", service="rds_storage")
+def generate_storage_recommendations(account, rds_client, cloudwatch_client, notify=True):
+    try:
+        instances = inventory.get_rds_instances(account, rds_client)
+        storage_usage = get_rds_storage_usage(account, rds_client, cloudwatch_client)
 
-        try:
-            assume_session = account_assume_session(account)
+        recommendations = storage_optimizer.optimize(instances, storage_usage)
+
+        label_values = {(instance, recommendations[instance]["recommended"]["storageType"]) for instance in recommendations}
+
+        for resource_name, storage_type in storage_label_values.get(account, set()) - label_values:
+            storage_recommended_monthly_savings.remove(resource_name, account, storage_type)
+
+        storage_label_values[account] = label_values
+
+        for instance in recommendations:
+            recommendation = recommendations[instance]
+            storage_recommended_monthly_savings.labels(resource_name=instance, account=account, storage_type=recommendation["recommended"]["storageType"]).set(recommendation["savings"])
+
+            if not notify:
+                continue
+
+            msg = "#### RDS Storage Recommendations FinOps Tool"
+            msg += f"\n Account: {account}"
+            msg += f"\n Instance: {instance}"
+            msg += f"\n Peak usage: {recommendation['peakIops']} IOPS, {recommendation['peakThroughput']} MB/s"
+            msg += f"\n Current: {storage_optimizer.describe_configuration(recommendation['current'])}, monthly costs: {recommendation['current']['monthly']}"
+            msg += f"\n Recommended: {storage_optimizer.describe_configuration(recommendation['recommended'])}, monthly costs: {recommendation['recommended']['monthly']}"
+            msg += f"\n Monthly savings: {recommendation['savings']}"
+
+            send_to_mattermost(account, msg)
+
+        return recommendations
+    except Exception as e:
+        print(e)
+        print(f"[RDS] Storage recommendations could not be generated, error in account: {account}")
+
+# Collects the cost metrics of given account
+def fetch_account_metrics(account, run_state):
+    start_time = time.time()
+
+    try:
+        clients = get_account_clients(account)
 
-            sts_assumed_client = assume_session.client("sts", region_name="eu-central-1")
-            rds_assumed_client = assume_session.client("rds", region_name="eu-central-1")
-            cloudwatch_assumed_client = assume_session.client("cloudwatch", region_name="eu-central-1")
-            ec_assumed_client = assume_session.client("elasticache", region_name="eu-central-1")
+        ec_prices = collect_ec_metrics(account, clients["elasticache"], clients["cloudwatch"], clients["tagging"])
+        rds_prices = collect_rds_metrics(account, clients["rds"], clients["cloudwatch"], clients["tagging"])
 
-            # Check if right role assumed
-            response = sts_assumed_client.get_caller_identity()
-            print(response["Arn"])
+        if ec_prices != None:
+            snapshot.save_checkpoint(account, "ec", ec_prices)
 
-            collect_ec_metrics(account, ec_assumed_client)
-            collect_rds_metrics(account, rds_assumed_client, cloudwatch_assumed_client)
-        except Exception as e:
-            print(e)
-            print(f"[ERROR] Could not fetch metrics!")
+        if rds_prices != None:
+            snapshot.save_checkpoint(account, "rds", rds_prices)
+
+        if ec_prices != None and rds_prices != None:
+            snapshot.mark_account_finished(run_state, account)
+
+        if ec_prices == None and rds_prices == None:
+            inventory.invalidate(account) # the next attempt describes everything again
+            circuit_breaker.record_failure(account, time.time() - start_time)
+        else:
+            circuit_breaker.record_success(account, time.time() - start_time)
+    except Exception as e:
+        print(e)
+        print(f"[ERROR] Could not fetch metrics!")
+
+        with account_clients_lock:
+            account_clients.pop(account, None) # assumes the role again on the next attempt
+
+        circuit_breaker.record_failure(account, time.time() - start_time)
+
+    expose_account_health(account)
+
+def fetch_metrics(accounts=None, window=0):
+    if not health.catalogs_loaded():
+        print("[WARN] Price catalogs are not loaded, skipping the collection!")
+        return
+
+    if accounts == None:
+        accounts = account_ids
+
+    accounts = circuit_breaker.get_schedule(accounts)
+    run_state = snapshot.start_run(accounts)
+
+    with tracing.span("fetch_metrics", accounts=len(accounts)):
+        for account in job_runner.spread(accounts, window):
+            print(account)
+
+            with tracing.span("account", account=account):
+                fetch_account_metrics(account, run_state)
+
+    snapshot.complete_run(run_state)
+    health.set_costs_exposed("collection")
+    flush_history()
+
+# Generates the recommendations of given account and sends them to mattermost
+def fetch_account_recommendations(account):
+    start_time = time.time()
+
+    try:
+        clients = get_account_clients(account)
+
+        update_teams_json()
+        ec_recommendations = generate_ec_recommendations(account, clients["elasticache"], clients["cloudwatch"])
+        rds_recommendations = generate_rds_recommendations(account, clients["rds"], clients["cloudwatch"])
+        storage_recommendations = generate_storage_recommendations(account, clients["rds"], clients["cloudwatch"])
+
+        if ec_recommendations == None and rds_recommendations == None and storage_recommendations == None:
+            circuit_breaker.record_failure(account, time.time() - start_time, job="recommendations")
+        else:
+            circuit_breaker.record_success(account, time.time() - start_time, job="recommendations")
+    except Exception as e:
+        print(e)
+        print(f"[ERROR] Could not fetch recommendations")
+        circuit_breaker.record_failure(account, time.time() - start_time, job="recommendations")
+
+# Computes the fleet wide reservation purchases with the lowest expected costs from the usage history, writes them as report and metrics
+@tracing.traced("optimize_reservations")
+def optimize_reservations():
+    if not health.catalogs_loaded():
+        print("[WARN] Price catalogs are not loaded, skipping the reservation optimizer!")
+        return
+
+    try:
+        usage_history.prune()
+        plans = reservation_optimizer.optimize(usage_history.load_demand())
+
+        snapshot.write_json_atomic(os.path.join(snapshot.snapshot_dir, "reservation_plan.json"), {"timestamp": time.time(), "plans": plans})
+
+        reservation_recommended_units.clear()
+        reservation_expected_monthly_savings.clear()
+
+        for plan in plans:
+            reservation_recommended_units.labels(service=plan["service"], product=plan["product"], family=plan["family"], term=plan["term"], payment_option=plan["paymentOption"]).set(plan["units"])
+            reservation_expected_monthly_savings.labels(service=plan["service"], product=plan["product"], family=plan["family"]).set(round(plan["expectedMonthlySavings"], 2))
+
+        print(f"[INFO] Reservation optimizer recommends purchases for {len(plans)} pools")
+    except Exception as e:
+        print(e)
+        print("[ERROR] Could not optimize reservations!")
 
 def fetch_recommendations():
-    for account in account_ids:
-        print(account)
+    if not health.catalogs_loaded():
+        print("[WARN] Price catalogs are not loaded, skipping the recommendations!")
+        return
 
-        try:
-            assume_session = account_assume_session(account)
+    accounts = circuit_breaker.get_schedule(account_ids, job="recommendations")
+
+    with tracing.span("fetch_recommendations", accounts=len(accounts)):
+        for account in accounts:
+            print(account)
+
+            with tracing.span("account", account=account):
+                fetch_account_recommendations(account)
+
+# Returns the clients of given account by service name, they are reused by all jobs until the assumed role credentials are about to expire
+def get_account_clients(account):
+    with account_clients_lock:
+        cached = account_clients.get(account)
+
+    if cached != None and cached["expiresAt"] - time.time() > credentials_refresh_margin:
+        return cached["clients"]
+
+    assume_session, expires_at = account_assume_session(account)
+
+    sts_assumed_client = assume_session.client("sts", region_name="eu-central-1")
+
+    # Check if right role assumed
+    with tracing.span("sts.get_caller_identity"):
+        response = sts_assumed_client.get_caller_identity()
+    print(response["Arn"])
+
+    clients = {
+        "rds": assume_session.client("rds", region_name="eu-central-1"),
+        "cloudwatch": assume_session.client("cloudwatch", region_name="eu-central-1"),
+        "elasticache": assume_session.client("elasticache", region_name="eu-central-1"),
+        "tagging": assume_session.client("resourcegroupstaggingapi", region_name="eu-central-1")
+    }
+
+    with account_clients_lock:
+        account_clients[account] = {"clients": clients, "expiresAt": expires_at}
 
-            sts_assumed_client = assume_session.client("sts", region_name="eu-central-1")
-            rds_assumed_client = assume_session.client("rds", region_name="eu-central-1")
-            cloudwatch_assumed_client = assume_session.client("cloudwatch", region_name="eu-central-1")
-            ec_assumed_client = assume_session.client("elasticache", region_name="eu-central-1")
+    return clients
 
-            # Check if right role assumed
-            response = sts_assumed_client.get_caller_identity()
-            print(response["Arn"])
+# Collects the costs and recommendations of given account and writes them to the report
+def report_account(account, report, notify, sink=None):
+    try:
+        clients = get_account_clients(account)
 
+        if notify:
             update_teams_json()
-            generate_ec_recommendations(account, ec_assumed_client, cloudwatch_assumed_client)
-            generate_rds_recommendations(account, rds_assumed_client, cloudwatch_assumed_client)
-        except Exception as e:
-            print(e)
-            print(f"[ERROR] Could not fetch recommendations")
 
+        ec_prices = collect_ec_metrics(account, clients["elasticache"], clients["cloudwatch"], clients["tagging"])
+        rds_prices = collect_rds_metrics(account, clients["rds"], clients["cloudwatch"], clients["tagging"])
+        timestamp = time.time()
+
+        if ec_prices != None:
+            for record in report_writer.build_cost_records(account, "ec", ec_prices, timestamp):
+                report_writer.write_record(report, record)
+
+            if sink != None:
+                metric_sink.add_prices(sink, account, "ec", ec_prices, timestamp)
+
+        if rds_prices != None:
+            for record in report_writer.build_cost_records(account, "rds", rds_prices, timestamp):
+                report_writer.write_record(report, record)
+
+            if sink != None:
+                metric_sink.add_prices(sink, account, "rds", rds_prices, timestamp)
+
+        ec_recommendations = generate_ec_recommendations(account, clients["elasticache"], clients["cloudwatch"], notify)
+        rds_recommendations = generate_rds_recommendations(account, clients["rds"], clients["cloudwatch"], notify)
+        storage_recommendations = generate_storage_recommendations(account, clients["rds"], clients["cloudwatch"], notify)
+
+        if ec_recommendations != None:
+            for record in report_writer.build_recommendation_records(account, "ec", ec_recommendations, timestamp):
+                report_writer.write_record(report, record)
+
+        if rds_recommendations != None:
+            for record in report_writer.build_recommendation_records(account, "rds", rds_recommendations, timestamp):
+                report_writer.write_record(report, record)
+
+        if storage_recommendations != None:
+            for record in report_writer.build_storage_records(account, storage_recommendations, timestamp):
+                report_writer.write_record(report, record)
+    except Exception as e:
+        print(e)
+        print(f"[ERROR] Could not report account: {account}")
+
+# Runs the collection and recommendations for all accounts concurrently, writes the results to a report and returns
+# textfile is the path of an OpenMetrics file for the node_exporter textfile collector, pushgateway the url the metrics are pushed to
+# the report is opened by the caller, so a bad output path fails before the catalogs are loaded
+def run_once(report, workers, notify, textfile=None, pushgateway=None, push_job="finops_tool", push_instance=None):
+    sink = metric_sink.open_sink() if textfile != None or pushgateway != None else None
+
+    # the report may go to stdout, so all the logging goes to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        with tracing.span("run_once", accounts=len(account_ids)):
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(lambda account: report_account(account, report, notify, sink), account_ids))
+
+        report_writer.close_report(report)
+        print(f"[INFO] Wrote {report['records']} records for {len(account_ids)} accounts")
+
+        flush_history()
+
+        if textfile != None:
+            metric_sink.write_textfile(sink, textfile)
+            print(f"[INFO] Wrote cost metrics to {textfile}")
+
+        if pushgateway != None:
+            with tracing.span("pushgateway.push"):
+                metric_sink.push(sink, pushgateway, push_job, {"instance": push_instance or socket.gethostname()})
+            print(f"[INFO] Pushed cost metrics to {pushgateway}")
+
+# Returns the assumed role session of given account and the unix timestamp its credentials expire at
 def account_assume_session(account):
     try:
         role_arn = f"arn:aws:iam::{account}:role/{role_name}"
-        response = sts_client.assume_role(
-            RoleArn=role_arn,
-            RoleSessionName="finops-tool"
-        )
+        with tracing.span("sts.assume_role", account=account):
+            response = get_client("sts").assume_role(
+                RoleArn=role_arn,
+                RoleSessionName="finops-tool"
+            )
 
         credentials = response["Credentials"]
 
@@ -237,20 +710,23 @@ def account_assume_session(account):
             aws_session_token=credentials["SessionToken"]
         )
 
-        return assume_session
+        return assume_session, credentials["Expiration"].timestamp()
     except Exception as e:
         print(e)
         print(f"[ERROR] Could not assume session for: {account}!")
+        raise
 
 def update_teams_json():
-    file_obj = s3_client.get_object(Bucket="bucket_name", Key="file_name")
+    with tracing.span("s3.get_object"):
+        file_obj = get_client("s3").get_object(Bucket="bucket_name", Key="file_name")
     file_content = file_obj["Body"].read().decode("utf-8")
 
     teams_file = json.loads(file_content)
     # populate dicts
     # implement own logic
 
-def send_to_mattermost(account, msg):
+# Returns the team short name and the stage of given account from the teams json
+def get_team_and_stage(account):
     team_short_name = ""
     stage = "play/non-prod/prod/no-stage"
 
@@ -275,6 +751,11 @@ def send_to_mattermost(account, msg):
     if team_short_name == "":
         team_short_name = "core"
 
+    return team_short_name, stage
+
+def send_to_mattermost(account, msg):
+    team_short_name, stage = get_team_and_stage(account)
+
     mattermostUrl = team_short_names_to_webhook[team_short_name]
     print(team_short_name)
     print(stage)
@@ -289,40 +770,147 @@ def send_to_mattermost(account, msg):
     })
 
     try:
-        connMattermost.request("POST", url_post_to_mattermost, payload, headersMattermost)
-        res = connMattermost.getresponse()
-        print(res.read().decode("utf-8"))
+        with mattermost_lock, tracing.span("mattermost.post", account=account, team=team_short_name):
+            connMattermost.request("POST", url_post_to_mattermost, payload, headersMattermost)
+            response = connMattermost.getresponse().read()
+        print(response.decode("utf-8"))
     except Exception as e:
          print("sth went wrong: ", e)
 
 if __name__ == "__main__":
+    all_account_ids = list()
 
     try:
         parser = argparse.ArgumentParser(description="Reads arguments for finops tool")
         parser.add_argument("role_name", type=str, help="Name of the finops tool member role")
         parser.add_argument("enterprise_discount", type=float, help="Percentage of enterprise discount, e.g. 0.25")
         parser.add_argument("input_file", type=argparse.FileType("r"), help="Path to the CSV containing the AWS Account IDs")
+        parser.add_argument("--snapshot-dir", type=str, default=snapshot.snapshot_dir, help="Directory the last collected costs are checkpointed to")
+        parser.add_argument("--spread-window", type=int, default=spread_window, help="Seconds the accounts of an hourly run are spread over, 0 to collect all accounts at once")
+        parser.add_argument("--incremental-inventory", action="store_true", help="Only describe resources with RDS/ElastiCache events between full inventory resyncs")
+        parser.add_argument("--inventory-ttl", type=int, default=inventory.inventory_ttl, help="Seconds the listed resources of an account are shared between the jobs, 0 disables the cache")
+        parser.add_argument("--full-resync-interval", type=int, default=inventory.full_resync_interval, help="Seconds between full inventory resyncs in incremental mode")
+        parser.add_argument("--tag-labels", type=str, default="", help="Comma separated allowlist of resource tags the costs are attributed by, e.g. team,product")
+        parser.add_argument("--tag-ttl", type=int, default=tagging_api.tag_ttl, help="Seconds the resource tags of an account are cached")
+        parser.add_argument("--once", action="store_true", help="Collect costs and recommendations of all accounts once, write them as a report and exit")
+        parser.add_argument("--output", type=str, default="-", help="Path of the report written by --once, - for stdout")
+        parser.add_argument("--format", type=str, default="jsonl", choices=report_writer.report_formats, help="Format of the report written by --once")
+        parser.add_argument("--workers", type=int, default=8, help="Number of accounts processed concurrently by --once")
+        parser.add_argument("--notify", action="store_true", help="Also send the recommendations of --once to mattermost")
+        parser.add_argument("--textfile", type=str, default=None, help="Path of an OpenMetrics file --once writes the cost metrics to, for the node_exporter textfile collector")
+        parser.add_argument("--pushgateway", type=str, default=None, help="Url of a Pushgateway --once pushes the cost metrics to, e.g. http://pushgateway:9091")
+        parser.add_argument("--push-job", type=str, default="finops_tool", help="Job name the cost metrics are pushed with")
+        parser.add_argument("--push-instance", type=str, default=None, help="Instance label the cost metrics are pushed with, defaults to the host name")
+        parser.add_argument("--catalog-file", type=str, default=None, help="Path the loaded price catalogs are compiled to, worker processes memory-map it with aws_pricing_api.catalog_file")
+        parser.add_argument("--history-dir", type=str, default=None, help="Directory the prices of every collection are appended to as parquet files partitioned by date and account (needs pyarrow)")
+        parser.add_argument("--history-batch-size", type=int, default=history_export.batch_size, help="Rows of the history export buffered before they are written")
+        parser.add_argument("--shard-index", type=int, default=0, help="Index of this replica if the accounts are sharded over --shard-count replicas")
+        parser.add_argument("--shard-count", type=int, default=1, help="Number of replicas the accounts are sharded over")
+        parser.add_argument("--shard-members", type=str, default="", help="Comma separated names of all replicas, instead of --shard-index and --shard-count")
+        parser.add_argument("--shard-name", type=str, default=None, help="Name of this replica, one of --shard-members")
+        parser.add_argument("--debug-token", type=str, default=None, help="Token the /debug/profile and /debug/memory endpoints require as bearer token, they are only served if set")
+        parser.add_argument("--trace-malloc", action="store_true", help="Trace the allocations from startup on, so /debug/memory shows the price catalogs and gauges too")
+        parser.add_argument("--trace-file", type=str, default=None, help="Path of the json lines file spans are written to, tracing is disabled if not set")
+        parser.add_argument("--trace-sample-rate", type=float, default=1.0, help="Fraction of collection runs that are traced, e.g. 0.1")
         args = parser.parse_args()
 
         role_name = args.role_name
         enterprise_discount = args.enterprise_discount
+        snapshot.snapshot_dir = args.snapshot_dir
+        spread_window = args.spread_window
+        catalog_file_path = args.catalog_file
+        inventory.inventory_ttl = args.inventory_ttl
+        inventory.incremental = args.incremental_inventory
+        inventory.full_resync_interval = args.full_resync_interval
+        tagging_api.tag_ttl = args.tag_ttl
 
-        # fetch account IDs
-        for account in args.input_file.readlines():
-            account_ids.append(account.strip())
-            logging.log(50, account.strip())
+        # fetch account IDs, every replica only keeps the accounts of its shard
+        all_account_ids = [account.strip() for account in args.input_file.readlines() if account.strip()]
 
     except Exception as e:
         print(e)
         print("[ERROR] Could not read input file!")
 
-    # start server
-    start_http_server(8000)
+    # the options are applied outside of the input file block, so a bad option stops the exporter instead of leaving it without accounts
+    try:
+        tag_attribution.configure([tag_key.strip() for tag_key in args.tag_labels.split(",") if tag_key.strip()])
+    except ValueError as e:
+        parser.error(str(e))
+
+    if tag_attribution.tag_labels:
+        create_tag_gauges()
+
+    if args.trace_file != None:
+        try:
+            tracing.configure(args.trace_file, args.trace_sample_rate)
+        except OSError as e:
+            parser.error(f"Could not open the trace file: {e}")
+
+    profiler.token = args.debug_token
+
+    if args.trace_malloc:
+        profiler.start_tracing()
+
+    if args.history_dir != None:
+        try:
+            history_export.configure(args.history_dir, args.history_batch_size)
+        except ImportError as e:
+            parser.error(str(e))
+
+    shard_members = [member.strip() for member in args.shard_members.split(",") if member.strip()]
+
+    try:
+        sharding.configure(args.shard_index, args.shard_count, shard_members, args.shard_name)
+    except ValueError as e:
+        parser.error(str(e))
+
+    account_ids.extend(sharding.get_owned_accounts(all_account_ids))
+
+    for account in account_ids:
+        logging.log(50, account)
+
+    print(f"[INFO] Replica {sharding.replica} collects {len(account_ids)} of {len(all_account_ids)} accounts")
+
+    # batch mode, no server and no scheduler
+    if args.once:
+        try:
+            report = report_writer.open_report(args.output, args.format)
+        except (ValueError, ImportError, OSError) as e:
+            parser.error(str(e))
+
+        with contextlib.redirect_stdout(sys.stderr):
+            if not load_price_catalogs():
+                report_writer.close_report(report)
+                sys.exit(1)
+
+        run_once(report, args.workers, args.notify, args.textfile, args.pushgateway, args.push_job, args.push_instance)
+        sys.exit(0)
+
+    # start server first, it serves the metrics, the price api, the simulation api, the profiling and the health endpoints
+    price_api.register_routes(http_server)
+    simulation_api.register_routes(http_server, get_team_and_stage, enterprise_discount)
+    profiler.register_routes(http_server)
+    health.register_routes(http_server)
+    http_server.start_http_server(8000)
+
+    # expose the last checkpointed costs until the first collection is done
+    restore_snapshot()
+
+    # every job kind runs on its own executor, the scheduler just triggers them
+    job_runner.register_job("start_up", start_up, 3600)
+    job_runner.register_job("update_pricing_api_info", update_pricing_api_info, 24 * 3600)
+    job_runner.register_job("fetch_metrics", fetch_metrics, 3600)
+    job_runner.register_job("fetch_recommendations", fetch_recommendations, 7 * 24 * 3600)
+    job_runner.register_job("optimize_reservations", optimize_reservations, 24 * 3600)
+
+    # the catalogs load in the background, afterwards the accounts an interrupted run did not finish are resumed
+    job_runner.submit("start_up")
 
     # append methods to scheduler
-    schedule.every().day.do(update_pricing_api_info)
-    schedule.every().hour.at(":00").do(fetch_metrics)
-    schedule.every().monday.at("08:30").do(fetch_recommendations)
+    job_runner.schedule_job(schedule.every().day, "update_pricing_api_info")
+    job_runner.schedule_job(schedule.every().hour.at(":00"), "fetch_metrics", None, spread_window)
+    job_runner.schedule_job(schedule.every().monday.at("08:30"), "fetch_recommendations")
+    job_runner.schedule_job(schedule.every().day.at("06:00"), "optimize_reservations")
 
     # start scheduled methods
     while True: